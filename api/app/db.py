@@ -1,21 +1,174 @@
 import sqlite3
 import os
+import time
+import weakref
 from argon2 import PasswordHasher, exceptions
+from flask import g, has_app_context
+from app.offload import native_lock
 
 DB_PATH = os.environ.get("DB_PATH", "/app/data/app.db")
+GALLERY_PATH = "/mnt/gallery" # Ensure this matches scanner.py
 ph = PasswordHasher()
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    # ⚡ Bolt: WAL mode for better concurrency, NORMAL synchronous for balance of speed and safety,
-    # and a larger cache to reduce disk I/O.
-    conn.execute("PRAGMA journal_mode=WAL;")
-    conn.execute("PRAGMA synchronous=NORMAL;")
-    conn.execute("PRAGMA cache_size=-10000;") # 10MB cache
+# Connection pools (per worker process). Idle connections beyond these are really closed.
+READ_POOL_SIZE = int(os.environ.get("DB_READ_POOL_SIZE", 8))
+WRITE_POOL_SIZE = int(os.environ.get("DB_WRITE_POOL_SIZE", 2))
+# Prepared statements kept per connection; pooled connections reuse them across requests
+STATEMENT_CACHE_SIZE = 256
+# Bytes of the database file read through mmap instead of read() on read connections
+MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", 256 * 1024 * 1024))
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    sqlite3 connection whose close() returns it to the pool it came from. Open cursors are
+    closed and any transaction rolled back first: a half-read SELECT would otherwise pin its
+    WAL snapshot, so the next user would see stale data and checkpoints could not complete.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+        self._cursors = weakref.WeakSet()
+
+    def cursor(self, factory=sqlite3.Cursor):
+        cursor = super().cursor(factory)
+        self._cursors.add(cursor)
+        return cursor
+
+    # sqlite3's own execute shortcuts create cursors internally, out of sight of cursor()
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        return self.cursor().executemany(sql, parameters)
+
+    def close(self):
+        if self.pool is None or not self.pool.release(self):
+            super().close()
+
+    def reset(self):
+        """Closes open cursors and ends any transaction; False if the connection is unusable."""
+        try:
+            for cursor in list(self._cursors):
+                cursor.close()
+            if self.in_transaction:
+                self.rollback()
+        except sqlite3.Error:
+            return False
+        return True
+
+
+class ConnectionPool:
+    """LIFO pool of idle connections, opened on demand and dropped in forked children."""
+
+    def __init__(self, size, readonly):
+        self.size = size
+        self.readonly = readonly
+        self._idle = []
+        # Taken by greenlets and offloaded threads alike (see offload.py), so it must be a real lock
+        self._lock = native_lock()
+        self._pid = os.getpid()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            DB_PATH, factory=PooledConnection, cached_statements=STATEMENT_CACHE_SIZE, check_same_thread=False,
+        )
+        conn.row_factory = sqlite3.Row
+        # ⚡ Bolt: WAL mode for better concurrency, NORMAL synchronous for balance of speed and safety,
+        # and a larger cache to reduce disk I/O. Set once per connection, not per request.
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.execute("PRAGMA cache_size=-10000;") # 10MB cache
+        if self.readonly:
+            conn.execute(f"PRAGMA mmap_size={MMAP_SIZE};")
+            conn.execute("PRAGMA query_only=ON;")
+        conn.pool = self
+        return conn
+
+    def acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Connections must not cross a fork; let the parent's copies go
+                self._idle, self._pid = [], os.getpid()
+            conn = self._idle.pop() if self._idle else None
+        return conn or self._connect()
+
+    def release(self, conn):
+        """Takes conn back; False if the caller should close it instead."""
+        if not conn.reset():
+            return False
+        with self._lock:
+            if self._pid != os.getpid() or len(self._idle) >= self.size:
+                return False
+            self._idle.append(conn)
+        return True
+
+
+_read_pool = ConnectionPool(READ_POOL_SIZE, readonly=True)
+_write_pool = ConnectionPool(WRITE_POOL_SIZE, readonly=False)
+
+
+def _acquire(pool):
+    start = time.perf_counter()
+    conn = pool.acquire()
+    if has_app_context():
+        # Reported in the Server-Timing header (see main.py)
+        g.db_connect_time = g.get("db_connect_time", 0.0) + time.perf_counter() - start
     return conn
 
 
+def get_db():
+    """A pooled read-write connection; close() hands it back for reuse."""
+    return _acquire(_write_pool)
+
+
+def get_read_db():
+    """A pooled read-only connection (query_only, memory-mapped) for endpoints that only read."""
+    return _acquire(_read_pool)
+
+
+def _add_column(c, table, column, definition):
+    """Adds a column to an existing table unless it is already there."""
+    columns = {row["name"] for row in c.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def _subgroup_sql(ref):
+    """SQL for the subgroup (second directory level under the gallery) of a media row reference."""
+    prefix = f"'{GALLERY_PATH}/' || {ref}.group_tag || '/'"
+    rest = f"substr({ref}.path, length({prefix}) + 1)"
+    return (
+        f"CASE WHEN {ref}.group_tag IS NOT NULL AND substr({ref}.path, 1, length({prefix})) = {prefix} "
+        f"AND instr({rest}, '/') > 0 THEN substr({rest}, 1, instr({rest}, '/') - 1) ELSE '' END"
+    )
+
+
+def _count_delta_sql(ref, delta):
+    """Trigger statements adding delta to the media_counts row of a media row reference."""
+    sql = f"""
+      INSERT INTO media_counts (group_tag, subgroup, type, count)
+      VALUES (coalesce({ref}.group_tag, ''), {_subgroup_sql(ref)}, coalesce({ref}.type, ''), {delta})
+      ON CONFLICT (group_tag, subgroup, type) DO UPDATE SET count = count + {delta};"""
+    if delta < 0:
+        # Drop emptied counters so removed groups/subgroups disappear from listings
+        sql += f"""
+      DELETE FROM media_counts
+      WHERE group_tag = coalesce({ref}.group_tag, '') AND subgroup = {_subgroup_sql(ref)}
+        AND type = coalesce({ref}.type, '') AND count <= 0;"""
+    return sql
+
+
+def get_generation(conn):
+    """Change counter of the media library; bumped by triggers on any change to listed or searched data."""
+    return conn.execute("SELECT generation FROM db_generation").fetchone()[0]
+
+
+# rand_key values are drawn from [0, RAND_KEY_RANGE)
+RAND_KEY_RANGE = 1 << 31
+
+
 def init_db():
     conn = get_db()
     c = conn.cursor()
@@ -48,14 +201,37 @@ def init_db():
     )
     """)
 
+    # ---- Columns added after the first release ----
+    # thumb_state: NULL = unknown/missing, 'ready' = file in THUMB_DIR, 'placeholder' = shared asset
+    _add_column(c, "media", "thumb_state", "TEXT")
+    # Inline placeholders computed with the thumbnail: tiny WebP data URI and #rrggbb colour
+    _add_column(c, "media", "lqip", "TEXT")
+    _add_column(c, "media", "dominant_color", "TEXT")
+    # Containing folder (see the folders table below); assigned by the scanner
+    _add_column(c, "media", "folder_id", "INTEGER")
+    # Persisted random position of each item, so random browsing is an indexed walk (see gallery.py)
+    _add_column(c, "media", "rand_key", "INTEGER")
+
     # ---- Full Text Search (FTS5) for fast search on filename + user_comment ----
+    # prefix='2 3' adds indexes of 2- and 3-character term prefixes, so short `term*` queries
+    # read one prefix entry instead of merging every term that starts with them. Tables from
+    # before the option are rebuilt from media.
+    fts_table = c.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'media_fts'").fetchone()
+    if fts_table and "prefix" not in fts_table["sql"]:
+        c.execute("DROP TABLE media_fts")
     c.execute("""
     CREATE VIRTUAL TABLE IF NOT EXISTS media_fts
-    USING fts5(filename, user_comment, exif, content='media', content_rowid='id')
+    USING fts5(filename, user_comment, exif, content='media', content_rowid='id', prefix='2 3')
     """)
+    if fts_table and "prefix" not in fts_table["sql"]:
+        c.execute("INSERT INTO media_fts(media_fts) VALUES ('rebuild')")
 
-    # Keep FTS index in sync
+    # Keep FTS index in sync.
+    # media_au only fires for the indexed columns, so bookkeeping updates (e.g. thumb_state)
+    # don't rewrite FTS rows; it is recreated to upgrade databases with the old definition.
     c.executescript("""
+    BEGIN;
+    DROP TRIGGER IF EXISTS media_au;
     CREATE TRIGGER IF NOT EXISTS media_ai AFTER INSERT ON media BEGIN
       INSERT INTO media_fts(rowid, filename, user_comment, exif)
       VALUES (new.id, new.filename, new.user_comment, new.exif);
@@ -64,12 +240,13 @@ def init_db():
       INSERT INTO media_fts(media_fts, rowid, filename, user_comment, exif)
       VALUES('delete', old.id, old.filename, old.user_comment, old.exif);
     END;
-    CREATE TRIGGER IF NOT EXISTS media_au AFTER UPDATE ON media BEGIN
+    CREATE TRIGGER media_au AFTER UPDATE OF filename, user_comment, exif ON media BEGIN
       INSERT INTO media_fts(media_fts, rowid, filename, user_comment, exif)
       VALUES('delete', old.id, old.filename, old.user_comment, old.exif);
       INSERT INTO media_fts(rowid, filename, user_comment, exif)
       VALUES (new.id, new.filename, new.user_comment, new.exif);
     END;
+    COMMIT;
     """)
 
     c.execute("CREATE INDEX IF NOT EXISTS idx_media_group_tag ON media (group_tag);")
@@ -80,10 +257,144 @@ def init_db():
     c.execute("CREATE INDEX IF NOT EXISTS idx_media_mtime ON media (mtime);")
     c.execute("CREATE INDEX IF NOT EXISTS idx_media_filename ON media (filename);")
     # ⚡ Bolt: Added composite indexes to optimize grouped gallery views and subgroup discovery.
-    # idx_media_group_mtime eliminates temporary B-tree sorts when filtering by group.
+    # idx_media_group_mtime_asc eliminates temporary B-tree sorts when filtering by group.
     # idx_media_group_path enables covering index scans for subgroup path discovery.
-    c.execute("CREATE INDEX IF NOT EXISTS idx_media_group_mtime ON media (group_tag, mtime DESC);")
+    # Gallery sorts tie-break on id, and the implicit rowid in an index is always ascending, so
+    # (group_tag, mtime) is stored ascending: scanned backwards it yields (mtime DESC, id DESC),
+    # which a DESC-declared mtime column cannot. This lets cursor pages seek straight to their start.
+    c.execute("DROP INDEX IF EXISTS idx_media_group_mtime;")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_media_group_mtime_asc ON media (group_tag, mtime);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_media_group_filename ON media (group_tag, filename);")
     c.execute("CREATE INDEX IF NOT EXISTS idx_media_group_path ON media (group_tag, path);")
+    # rand_key: assigned on insert, backfilled for rows from before the column existed
+    c.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS media_rand_ai AFTER INSERT ON media WHEN new.rand_key IS NULL BEGIN
+      UPDATE media SET rand_key = random() & {RAND_KEY_RANGE - 1} WHERE id = new.id;
+    END;
+    """)
+    c.execute(f"UPDATE media SET rand_key = random() & {RAND_KEY_RANGE - 1} WHERE rand_key IS NULL;")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_media_rand ON media (rand_key);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_media_group_rand ON media (group_tag, rand_key);")
+    # Partial index so the scanner's thumbnail backfill only visits rows it hasn't resolved yet
+    c.execute("CREATE INDEX IF NOT EXISTS idx_media_thumb_pending ON media (id) WHERE thumb_state IS NULL;")
+
+    # ---- Materialized counts ----
+    # media_counts holds the number of items per (group, subgroup, type), '' standing for none,
+    # so listings get totals without a COUNT(*) scan. db_generation changes whenever rows are
+    # added, removed, or their listed/searched columns change, keying caches of derived data.
+    # Both are maintained by triggers; counts are rebuilt once when the table is first created.
+    conn.commit()
+    c.execute("BEGIN IMMEDIATE")
+    counts_exist = c.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'media_counts'"
+    ).fetchone()
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS media_counts (
+        group_tag TEXT NOT NULL,
+        subgroup TEXT NOT NULL,
+        type TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (group_tag, subgroup, type)
+    ) WITHOUT ROWID
+    """)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS db_generation (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        generation INTEGER NOT NULL
+    )
+    """)
+    c.execute("INSERT OR IGNORE INTO db_generation (id, generation) VALUES (0, 0)")
+    c.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS media_counts_ai AFTER INSERT ON media BEGIN
+      {_count_delta_sql("new", 1)}
+      UPDATE db_generation SET generation = generation + 1;
+    END;
+    """)
+    c.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS media_counts_ad AFTER DELETE ON media BEGIN
+      {_count_delta_sql("old", -1)}
+      UPDATE db_generation SET generation = generation + 1;
+    END;
+    """)
+    c.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS media_counts_au AFTER UPDATE OF path, group_tag, type ON media
+    WHEN old.path IS NOT new.path OR old.group_tag IS NOT new.group_tag OR old.type IS NOT new.type BEGIN
+      {_count_delta_sql("old", -1)}
+      {_count_delta_sql("new", 1)}
+    END;
+    """)
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS media_generation_au
+    AFTER UPDATE OF path, filename, group_tag, type, user_comment, exif ON media
+    WHEN old.path IS NOT new.path OR old.filename IS NOT new.filename
+      OR old.group_tag IS NOT new.group_tag OR old.type IS NOT new.type
+      OR old.user_comment IS NOT new.user_comment OR old.exif IS NOT new.exif BEGIN
+      UPDATE db_generation SET generation = generation + 1;
+    END;
+    """)
+    if not counts_exist:
+        c.execute(f"""
+        INSERT INTO media_counts (group_tag, subgroup, type, count)
+        SELECT coalesce(group_tag, ''), {_subgroup_sql("media")}, coalesce(type, ''), COUNT(*)
+        FROM media GROUP BY 1, 2, 3
+        """)
+    conn.commit()
+
+    # ---- Folders ----
+    # The directory tree under the gallery, one row per directory holding media (directly or
+    # below). item_count and latest_mtime cover the folder's direct items and are kept current by
+    # triggers on media.folder_id; recursive totals are summed over the (small) folder tree.
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS folders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        parent_id INTEGER REFERENCES folders(id),
+        name TEXT NOT NULL,
+        path TEXT NOT NULL UNIQUE,
+        item_count INTEGER NOT NULL DEFAULT 0,
+        latest_mtime REAL
+    )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_folders_parent ON folders (parent_id, name);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_media_folder_mtime ON media (folder_id, mtime);")
+    c.executescript("""
+    BEGIN;
+    CREATE TRIGGER IF NOT EXISTS media_folders_ai AFTER INSERT ON media WHEN new.folder_id IS NOT NULL BEGIN
+      UPDATE folders SET item_count = item_count + 1,
+        latest_mtime = max(coalesce(latest_mtime, new.mtime), new.mtime)
+      WHERE id = new.folder_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS media_folders_ad AFTER DELETE ON media WHEN old.folder_id IS NOT NULL BEGIN
+      UPDATE folders SET item_count = item_count - 1,
+        latest_mtime = (SELECT MAX(mtime) FROM media WHERE folder_id = old.folder_id)
+      WHERE id = old.folder_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS media_folders_au AFTER UPDATE OF folder_id, mtime ON media
+    WHEN old.folder_id IS NOT new.folder_id OR old.mtime IS NOT new.mtime BEGIN
+      UPDATE folders SET item_count = item_count - 1,
+        latest_mtime = (SELECT MAX(mtime) FROM media WHERE folder_id = old.folder_id)
+      WHERE id = old.folder_id;
+      UPDATE folders SET item_count = item_count + 1,
+        latest_mtime = (SELECT MAX(mtime) FROM media WHERE folder_id = new.folder_id)
+      WHERE id = new.folder_id;
+    END;
+    COMMIT;
+    """)
+    # Rows from before the folders table existed get their folder now rather than at the next
+    # full scan, which folder and subgroup filters would otherwise wait on
+    from app.folders import assign_folders  # app.folders imports this module
+    if assign_folders(c):
+        conn.commit()
+
+    # ---- Thumbnail priority queue ----
+    # Ids the API was asked for but could not render itself; the scanner drains these
+    # (newest request first) before its background backfill.
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS thumbnail_queue (
+        media_id INTEGER PRIMARY KEY,
+        requested_at REAL NOT NULL
+    )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_thumbnail_queue_requested ON thumbnail_queue (requested_at DESC);")
 
     conn.commit()
     conn.close()
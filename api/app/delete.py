@@ -1,10 +1,13 @@
 import os
 import shutil
 import time
+import sqlite3
 import logging
 from flask import Blueprint, jsonify, abort
-from app.db import get_db
+from app.db import get_db, get_read_db
 from app.api_key_middleware import api_key_required
+from app.offload import run_blocking, map_blocking, OFFLOAD_THREADS
+from app.media import parse_ids
 
 logger = logging.getLogger(__name__)
 bp = Blueprint("delete", __name__)
@@ -12,6 +15,81 @@ bp = Blueprint("delete", __name__)
 # Define the path to the recycle bin
 RECYCLEBIN_PATH = "/mnt/gallery/recyclebin"
 SECONDARY_MOUNT_PATH = os.environ.get("SECONDARY_MOUNT_PATH", None)
+# Upper bound on ids in one /api/delete/batch request, and file moves it runs at once. Moves
+# take native threads from the offload pool, so a bulk request may use at most a third of them
+# and the thumbnail, stream and database calls of other requests keep theirs.
+MAX_BULK_IDS = 1000
+BULK_MOVE_WORKERS = max(1, min(int(os.getenv("BULK_MOVE_WORKERS", 3)), OFFLOAD_THREADS // 3))
+
+
+def recycle_destination(mid, file_path):
+    """
+    Recycle bin name for a file. The timestamp keeps repeated deletions of one name apart, the
+    id same-named files from different folders deleted together.
+    """
+    name, ext = os.path.splitext(os.path.basename(file_path))
+    return os.path.join(RECYCLEBIN_PATH, f"{name}_{int(time.time() * 1000)}_{mid}{ext}")
+
+
+def recycle_file(mid, file_path):
+    """
+    Moves a media file, and any matching secondary file, to the recycle bin. Returns a result
+    of the form {"id", "status", "message"}, where a file that is already gone is a warning
+    (its record can still be removed) and any other failure an error.
+    """
+    destination_path = recycle_destination(mid, file_path)
+    try:
+        shutil.move(file_path, destination_path)
+    except FileNotFoundError:
+        return {"id": mid, "status": "warning", "message": "File not found, but DB record was cleaned up."}
+    except Exception as e:
+        logger.error(f"Error deleting media {mid}: {e}", exc_info=True)
+        # Return a generic error to avoid leaking details
+        return {"id": mid, "status": "error", "message": "An internal error occurred while deleting the media."}
+
+    if SECONDARY_MOUNT_PATH:
+        secondary_file_path = os.path.join(SECONDARY_MOUNT_PATH, os.path.basename(file_path))
+        if os.path.exists(secondary_file_path):
+            try:
+                # Define and create the secondary recycle bin folder dynamically
+                secondary_recycle_path = os.path.join(RECYCLEBIN_PATH, "secondary")
+                os.makedirs(secondary_recycle_path, exist_ok=True)
+                secondary_destination_path = os.path.join(secondary_recycle_path, os.path.basename(destination_path))
+                shutil.move(secondary_file_path, secondary_destination_path)
+                logger.info(f"Successfully moved secondary file to: {secondary_destination_path}")
+            except Exception as e:
+                logger.error(f"Failed to move secondary file {secondary_file_path}: {e}")
+        else:
+            logger.info(f"Secondary file not found, skipping: {secondary_file_path}")
+
+    return {"id": mid, "status": "ok", "message": "File moved to recycle bin", "recycled_path": destination_path}
+
+
+def _restore(result, file_path):
+    """Moves a recycled file back after its record could not be deleted."""
+    try:
+        shutil.move(result["recycled_path"], file_path)
+    except Exception as e:
+        logger.error(f"Could not restore {file_path} from the recycle bin: {e}")
+
+
+def _fetch_paths(ids):
+    conn = get_read_db()
+    try:
+        rows = conn.execute(f"SELECT id, path FROM media WHERE id IN ({','.join('?' * len(ids))})", ids).fetchall()
+    finally:
+        conn.close()
+    return {row["id"]: row["path"] for row in rows}
+
+
+def _delete_records(ids):
+    """Deletes the records of ids in one transaction."""
+    conn = get_db()
+    try:
+        conn.executemany("DELETE FROM media WHERE id=?", [(mid,) for mid in ids])
+        conn.commit()
+    finally:
+        conn.close()
 
 
 @bp.route("/api/delete/<int:mid>", methods=["POST"])
@@ -21,65 +99,56 @@ def delete_media_item(mid):
     Moves a media file to the recycle bin, deletes its DB record,
     and moves any matching secondary file to a 'secondary' subfolder in the recycle bin.
     """
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT path FROM media WHERE id=?", (mid,))
-    row = c.fetchone()
-    if not row:
-        conn.close()
+    file_path = run_blocking(_fetch_paths, [mid]).get(mid)
+    if file_path is None:
         abort(404, description="Media not found")
 
-    file_path = row["path"]
-
     # Ensure the recycle bin directory exists
     os.makedirs(RECYCLEBIN_PATH, exist_ok=True)
-    
-    # Generate unique filename with timestamp to prevent collisions
-    timestamp = int(time.time() * 1000)
-    filename = os.path.basename(file_path)
-    name, ext = os.path.splitext(filename)
-    unique_filename = f"{name}_{timestamp}{ext}"
-    destination_path = os.path.join(RECYCLEBIN_PATH, unique_filename)
+    result = run_blocking(recycle_file, mid, file_path)
+    if result["status"] == "error":
+        return jsonify({"status": "error", "message": result["message"]}), 500
 
+    # If the move succeeded (or the file was already gone), delete the record
+    run_blocking(_delete_records, [mid])
+    return jsonify({"status": result["status"], "message": result["message"]}), 200
 
-    try:
-        # Move the file
-        shutil.move(file_path, destination_path)
-        if SECONDARY_MOUNT_PATH:
-            secondary_file_path = os.path.join(SECONDARY_MOUNT_PATH, filename)
-            
-            if os.path.exists(secondary_file_path):
-                try:
-                    # Define and create the secondary recycle bin folder dynamically
-                    secondary_recycle_path = os.path.join(RECYCLEBIN_PATH, "secondary")
-                    os.makedirs(secondary_recycle_path, exist_ok=True)
-                    
-                    # Destination for the secondary file
-                    secondary_destination_path = os.path.join(secondary_recycle_path, unique_filename)
-                    
-                    # Move the secondary file
-                    shutil.move(secondary_file_path, secondary_destination_path)
-                    logger.info(f"Successfully moved secondary file to: {secondary_destination_path}")
-                except Exception as e:
-                    logger.error(f"Failed to move secondary file {secondary_file_path}: {e}")
-            else:
-                logger.info(f"Secondary file not found, skipping: {secondary_file_path}")
-                
-        # If move is successful, delete the record from the database
-        c.execute("DELETE FROM media WHERE id=?", (mid,))
-        conn.commit()
-        
-    except FileNotFoundError:
-        # If the file is already missing, just delete the DB record
-        c.execute("DELETE FROM media WHERE id=?", (mid,))
-        conn.commit()
-        return jsonify({"status": "warning", "message": "File not found, but DB record was cleaned up."}), 200
-    except Exception as e:
-        logger.error(f"Error deleting media {mid}: {e}", exc_info=True)
-        conn.close()
-        # Return a generic server error to avoid leaking details
-        return jsonify({"status": "error", "message": "An internal error occurred while deleting the media."}), 500
-    finally:
-        conn.close()
-        
-    return jsonify({"status": "ok", "message": "File moved to recycle bin"}), 200
\ No newline at end of file
+
+@bp.route("/api/delete/batch", methods=["POST"])
+@api_key_required
+def delete_media_batch():
+    """
+    Deletes several items (JSON body {"ids": [...]}, or `ids=1,2,3`) as /api/delete/<id> does
+    each. Files are moved BULK_MOVE_WORKERS at a time and the records removed in one
+    transaction. Returns one result per id, in order, with status ok, warning (file was
+    already gone), error, or not_found.
+    """
+    ids = parse_ids(MAX_BULK_IDS)
+    paths = run_blocking(_fetch_paths, ids)
+    found = [mid for mid in ids if mid in paths]
+
+    os.makedirs(RECYCLEBIN_PATH, exist_ok=True)
+    moved = map_blocking(lambda mid: recycle_file(mid, paths[mid]), found, BULK_MOVE_WORKERS)
+    results = {result["id"]: result for result in moved}
+
+    removed = [mid for mid in found if results[mid]["status"] != "error"]
+    deleted = 0
+    if removed:
+        try:
+            run_blocking(_delete_records, removed)
+            deleted = len(removed)
+        except sqlite3.Error as e:
+            logger.error(f"Could not delete {len(removed)} media records: {e}", exc_info=True)
+            # Put the files back so the library and the database stay in step
+            map_blocking(lambda mid: _restore(results[mid], paths[mid]), [
+                mid for mid in removed if results[mid]["status"] == "ok"
+            ], BULK_MOVE_WORKERS)
+            for mid in removed:
+                results[mid] = {"id": mid, "status": "error", "message": "An internal error occurred while deleting the media."}
+
+    items = []
+    for mid in ids:
+        result = results.get(mid) or {"id": mid, "status": "not_found", "message": "Media not found"}
+        result.pop("recycled_path", None)
+        items.append(result)
+    return jsonify({"results": items, "deleted": deleted})
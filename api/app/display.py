@@ -0,0 +1,133 @@
+import os
+import logging
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from flask import Blueprint, request, jsonify, send_file, redirect, abort
+from app.db import get_read_db
+from app.api_key_middleware import api_key_required
+from app.offload import run_blocking, path_exists
+from app.large_images import estimate_decode_bytes
+from app.thumbnails import (
+    create_image_version, submit_generation, get_media_row, temp_path, GENERATION_WAIT_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+bp = Blueprint("display", __name__)
+
+# Screen-sized WebP rendition the viewer shows instead of the original
+DISPLAY_DIR = "/app/data/display"
+os.makedirs(DISPLAY_DIR, exist_ok=True)
+DISPLAY_SIZE = (2048, 2048)
+DISPLAY_QUALITY = 82
+# Originals already in a web format and no larger than this are served as they are
+PASSTHROUGH_EXTS = (".jpg", ".jpeg", ".webp", ".gif")
+# Most neighbours a single prefetch request may warm
+DISPLAY_PREFETCH_LIMIT = 6
+
+
+def get_display_path(mid):
+    return os.path.join(DISPLAY_DIR, f"{mid}.webp")
+
+
+def needs_derivative(row):
+    """Whether an image is shown from a display derivative rather than its original file."""
+    ext = os.path.splitext(row["path"])[1].lower()
+    if ext == ".gif":
+        return False  # Keep animations
+    if ext in PASSTHROUGH_EXTS and row["width"] and row["height"]:
+        return max(row["width"], row["height"]) > DISPLAY_SIZE[0]
+    return True
+
+
+def render_display(src, dst):
+    """Writes the display derivative for src. Runs in the generation pool."""
+    tmp = temp_path(dst)
+    try:
+        if not create_image_version(src, tmp, DISPLAY_SIZE, DISPLAY_QUALITY):
+            return False
+        os.replace(tmp, dst)
+        return True
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def request_display(row, wait=1.0):
+    """Starts (or joins) the display generation for a media row; None if the server is busy."""
+    cost = run_blocking(estimate_decode_bytes, row["path"], "image", row["width"], row["height"], DISPLAY_SIZE)
+    return submit_generation(
+        ("display", row["id"]), cost, render_display,
+        row["path"], get_display_path(row["id"]), wait=wait,
+    )
+
+
+@bp.route("/api/display/<int:mid>")
+@api_key_required
+def display(mid):
+    """Serves an image at screen size (long edge 2048px), falling back to the original."""
+    row = get_media_row(mid)
+    if row["type"] != "image":
+        abort(404)
+    src = row["path"]
+    if not needs_derivative(row):
+        if not path_exists(src):
+            abort(404)
+        return send_file(src, conditional=True, max_age=86400)
+
+    dst = get_display_path(mid)
+    if path_exists(dst):
+        return send_file(dst, mimetype="image/webp", max_age=31536000)
+    if not path_exists(src):
+        abort(404)
+
+    future = request_display(row)
+    if future is None:
+        logger.warning(f"Server busy. Serving the original for display of ID: {mid}")
+        return redirect(f"/api/stream/{mid}")
+    try:
+        created = future.result(timeout=GENERATION_WAIT_TIMEOUT)
+    except FutureTimeoutError:
+        return redirect(f"/api/stream/{mid}")
+    except Exception as e:
+        logger.error(f"Display generation failed for ID {mid}: {e}", exc_info=True)
+        created = False
+
+    if not created or not path_exists(dst):
+        return redirect(f"/api/stream/{mid}")
+    return send_file(dst, mimetype="image/webp", max_age=31536000)
+
+
+def _prefetch_candidates(ids):
+    """Rows of the images among ids whose display derivative is due and whose source is there."""
+    conn = get_read_db()
+    try:
+        rows = conn.execute(
+            f"SELECT id, path, type, width, height FROM media WHERE id IN ({','.join('?' * len(ids))}) AND type = 'image'",
+            ids,
+        ).fetchall()
+    finally:
+        conn.close()
+    return [
+        row for row in rows
+        if needs_derivative(row) and not os.path.exists(get_display_path(row["id"])) and os.path.exists(row["path"])
+    ]
+
+
+@bp.route("/api/display/prefetch", methods=["POST"])
+@api_key_required
+def prefetch():
+    """
+    Starts display generation for the items around the one being viewed, so next/previous is
+    served from cache. Never waits for a slot: prefetches only use generation capacity that is idle.
+    """
+    data = request.get_json(silent=True)
+    ids = data.get("ids") if isinstance(data, dict) else None
+    ids = [i for i in ids or [] if isinstance(i, int)][:DISPLAY_PREFETCH_LIMIT]
+    if not ids:
+        return jsonify({"queued": []}), 202
+
+    queued = []
+    for row in run_blocking(_prefetch_candidates, ids):
+        if request_display(row, wait=0) is None:
+            break  # Pool is busy with interactive work
+        queued.append(row["id"])
+    return jsonify({"queued": queued}), 202
@@ -0,0 +1,92 @@
+# api/app/file_cache.py
+import os
+import time
+import mimetypes
+from collections import OrderedDict, namedtuple
+from app.db import get_read_db, get_generation
+from app.offload import run_blocking, native_lock
+
+MediaFile = namedtuple("MediaFile", "path type size mtime mime")
+
+# Per-worker media id -> MediaFile for the stream, HLS and thumbnail hot paths. A player issues
+# dozens of range requests per video; with the entry cached each costs one stat of the file
+# instead of a connection and a SELECT.
+FILE_CACHE_SIZE = int(os.getenv("FILE_CACHE_SIZE", 4096))
+# Seconds between reads of the library generation, which drops every entry when it changes.
+# In between, the stat catches moved or rewritten files.
+GENERATION_CHECK_INTERVAL = 2
+
+_files = OrderedDict()
+# Shared by greenlets and offloaded threads
+_lock = native_lock()
+_generation = None
+_checked_at = 0.0
+
+
+def _check_generation():
+    global _generation, _checked_at
+    now = time.monotonic()
+    if now - _checked_at < GENERATION_CHECK_INTERVAL:
+        return
+    conn = get_read_db()
+    try:
+        generation = get_generation(conn)
+    finally:
+        conn.close()
+    with _lock:
+        if generation != _generation:
+            _files.clear()
+            _generation = generation
+        _checked_at = now
+
+
+def _stat(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def _get_media_file(mid, validate):
+    _check_generation()
+    with _lock:
+        entry = _files.get(mid)
+        if entry is not None:
+            _files.move_to_end(mid)
+    if entry is not None:
+        if not validate:
+            return entry
+        st = _stat(entry.path)
+        if st is not None and st.st_size == entry.size and st.st_mtime == entry.mtime:
+            return entry
+
+    conn = get_read_db()
+    try:
+        row = conn.execute("SELECT path, type FROM media WHERE id=?", (mid,)).fetchone()
+    finally:
+        conn.close()
+    st = _stat(row["path"]) if row else None
+    if st is None:
+        with _lock:
+            _files.pop(mid, None)
+        return None
+
+    entry = MediaFile(
+        row["path"], row["type"], st.st_size, st.st_mtime,
+        mimetypes.guess_type(row["path"])[0] or "application/octet-stream",
+    )
+    with _lock:
+        _files[mid] = entry
+        _files.move_to_end(mid)
+        if len(_files) > FILE_CACHE_SIZE:
+            _files.popitem(last=False)  # Least recently used
+    return entry
+
+
+def get_media_file(mid, validate=True):
+    """
+    The file of a media item as a MediaFile, or None if the item or its file is gone. The
+    size and mtime come from a stat made by this call; with validate=False a cached entry is
+    returned without one, for callers that only need the path and type.
+    """
+    return run_blocking(_get_media_file, mid, validate)
@@ -0,0 +1,136 @@
+# api/app/folders.py
+import os
+from flask import Blueprint, jsonify, request, abort
+from app.db import get_read_db, GALLERY_PATH
+from app.api_key_middleware import api_key_required
+from app.offload import offload
+
+bp = Blueprint("folders", __name__)
+
+# All folders below a folder (itself included), as a subquery for `folder_id IN (...)`.
+# The folders table is small, so walking it is cheap next to scanning media paths.
+SUBTREE_SQL = """
+    WITH RECURSIVE subtree(id) AS (
+        SELECT id FROM folders WHERE {root}
+        UNION ALL
+        SELECT f.id FROM folders f JOIN subtree ON f.parent_id = subtree.id
+    )
+    SELECT id FROM subtree
+"""
+
+
+def subtree_sql(root_condition):
+    """SUBTREE_SQL rooted at the folder(s) matching root_condition (e.g. "id = ?")."""
+    return SUBTREE_SQL.format(root=root_condition)
+
+
+def _folder_id(c, path, cache):
+    """Returns the id of the folder at path, creating it (and its missing parents) if needed."""
+    if path in cache:
+        return cache[path]
+    if path == GALLERY_PATH or not path.startswith(GALLERY_PATH + os.sep):
+        parent_id, name, folder_path = None, "", GALLERY_PATH
+    else:
+        parent_id, name, folder_path = _folder_id(c, os.path.dirname(path), cache), os.path.basename(path), path
+    c.execute(
+        "INSERT INTO folders (parent_id, name, path) VALUES (?, ?, ?) ON CONFLICT(path) DO NOTHING",
+        (parent_id, name, folder_path),
+    )
+    folder_id = c.execute("SELECT id FROM folders WHERE path = ?", (folder_path,)).fetchone()[0]
+    cache[path] = folder_id
+    return folder_id
+
+
+def assign_folders(c):
+    """
+    Sets folder_id on media rows that have none (new rows, or rows from before folders existed).
+    Folder counters follow through the media_folders_* triggers. Caller commits.
+    """
+    rows = c.execute("SELECT id, path FROM media WHERE folder_id IS NULL").fetchall()
+    if not rows:
+        return 0
+    cache = {}
+    updates = [(_folder_id(c, os.path.dirname(path), cache), mid) for mid, path in rows]
+    c.executemany("UPDATE media SET folder_id = ? WHERE id = ?", updates)
+    return len(updates)
+
+
+def prune_folders(c):
+    """Deletes folders left without media or subfolders, bottom-up. Caller commits."""
+    while True:
+        c.execute("""
+            DELETE FROM folders
+            WHERE item_count = 0 AND parent_id IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM folders child WHERE child.parent_id = folders.id)
+        """)
+        if c.rowcount <= 0:
+            return
+
+
+def _relative(path):
+    return os.path.relpath(path, GALLERY_PATH) if path != GALLERY_PATH else ""
+
+
+@bp.route("/api/folders")
+@api_key_required
+@offload
+def list_folders():
+    """
+    Lists the subfolders of `parent` (default: the gallery root) with their direct item count,
+    recursive total and latest modification time, plus the parent's breadcrumb trail.
+    """
+    parent = request.args.get("parent", type=int)
+
+    conn = get_read_db()
+    try:
+        c = conn.cursor()
+        if parent is None:
+            folder = c.execute("SELECT * FROM folders WHERE parent_id IS NULL").fetchone()
+            if folder is None:
+                return jsonify({"folder": None, "ancestors": [], "children": []})
+        else:
+            folder = c.execute("SELECT * FROM folders WHERE id = ?", (parent,)).fetchone()
+            if folder is None:
+                abort(404, description="Folder not found")
+
+        ancestors = c.execute("""
+            WITH RECURSIVE chain(id, parent_id, name, depth) AS (
+                SELECT id, parent_id, name, 0 FROM folders WHERE id = ?
+                UNION ALL
+                SELECT f.id, f.parent_id, f.name, chain.depth + 1
+                FROM folders f JOIN chain ON f.id = chain.parent_id
+            )
+            SELECT id, name FROM chain WHERE depth > 0 ORDER BY depth DESC
+        """, (folder["id"],)).fetchall()
+
+        children = c.execute("""
+            WITH RECURSIVE tree(root, id) AS (
+                SELECT id, id FROM folders WHERE parent_id = ?
+                UNION ALL
+                SELECT tree.root, f.id FROM folders f JOIN tree ON f.parent_id = tree.id
+            )
+            SELECT r.id, r.name, r.path, r.item_count,
+                   SUM(d.item_count) AS total_count,
+                   MAX(d.latest_mtime) AS latest_mtime,
+                   COUNT(*) > 1 AS has_children
+            FROM tree
+            JOIN folders r ON r.id = tree.root
+            JOIN folders d ON d.id = tree.id
+            GROUP BY tree.root
+            ORDER BY r.name
+        """, (folder["id"],)).fetchall()
+    finally:
+        conn.close()
+
+    return jsonify({
+        "folder": {
+            "id": folder["id"], "name": folder["name"], "path": _relative(folder["path"]),
+            "parent_id": folder["parent_id"], "item_count": folder["item_count"],
+            "latest_mtime": folder["latest_mtime"],
+        },
+        "ancestors": [dict(row) for row in ancestors],
+        "children": [
+            {**dict(row), "path": _relative(row["path"]), "has_children": bool(row["has_children"])}
+            for row in children
+        ],
+    })
@@ -1,121 +1,407 @@
 # api/app/gallery.py
 import os # Import os
-from flask import Blueprint, jsonify, request
-from app.db import get_db
+import base64
+import binascii
+import random
+import struct
+import sys
+import time
+from array import array
+from collections import OrderedDict
+from flask import Blueprint, Response, jsonify, request, abort
+from app.db import get_read_db, get_generation, RAND_KEY_RANGE
 import json
 from app.api_key_middleware import api_key_required
+from app.offload import offload, native_lock
+from app.folders import subtree_sql
+from app.media import parse_fields, row_to_item
 
 bp = Blueprint("gallery", __name__)
 GALLERY_PATH = "/mnt/gallery" # Ensure this matches scanner.py
+
+# Deterministic sorts: name -> (column, direction). Each is paired with id as a tie-breaker so
+# (sort key, id) identifies a position exactly and pages can continue from a cursor.
+SORTS = {
+    "date_desc": ("mtime", "DESC"),
+    "date_asc": ("mtime", "ASC"),
+    "file_asc": ("filename", "ASC"),
+    "file_desc": ("filename", "DESC"),
+}
+
+# Totals of listings without a materialized counter (searches, mixed filters):
+# filter key -> (db generation, expiry time, count)
+COUNT_CACHE_TTL = 300
+COUNT_CACHE_SIZE = 256
+_count_cache = OrderedDict()
+
+# Layout manifests: the whole ordered listing as packed arrays (see gallery_manifest).
+# (filters, sort, seed) -> (db generation, expiry time, body); ~9 bytes per item each.
+MANIFEST_CACHE_TTL = 300
+MANIFEST_CACHE_SIZE = 16
+MANIFEST_MAGIC = b"VMAN"
+MANIFEST_VERSION = 1
+MANIFEST_TYPES = {"image": 0, "video": 1, "audio": 2}  # Anything else is 3
+_manifest_cache = OrderedDict()
+# Both caches are shared by the offloaded request threads
+_cache_lock = native_lock()
+
+def _cache_get(cache, key, generation):
+    """The cached value for key if it is from this generation and unexpired, else None."""
+    with _cache_lock:
+        cached = cache.get(key)
+        if cached and cached[0] == generation and cached[1] > time.time():
+            cache.move_to_end(key)
+            return cached[2]
+    return None
+
+def _cache_put(cache, key, generation, ttl, size, value):
+    """Stores value, dropping the least recently used entries beyond `size`."""
+    with _cache_lock:
+        cache[key] = (generation, time.time() + ttl, value)
+        cache.move_to_end(key)
+        while len(cache) > size:
+            cache.popitem(last=False)
+
+def count_items(c, key, counter, count_sql, params):
+    """
+    Total items for a listing. `counter` is an (sql, params) pair reading trigger-maintained
+    counters (media_counts, folders) when the filter has one; otherwise count_sql runs once per
+    change of the library and its result is reused meanwhile.
+    """
+    if counter:
+        return c.execute(*counter).fetchone()[0]
+
+    generation = get_generation(c)
+    total = _cache_get(_count_cache, key, generation)
+    if total is None:
+        total = c.execute(count_sql, params).fetchone()[0]
+        _cache_put(_count_cache, key, generation, COUNT_CACHE_TTL, COUNT_CACHE_SIZE, total)
+    return total
+
+def encode_cursor(sort, row, seed=None):
+    """Opaque position after `row` in the given sort."""
+    if sort == "random":
+        values = [sort, seed, row["rand_key"], row["id"]]
+    else:
+        values = [sort, row[SORTS[sort][0]], row["id"]]
+    raw = json.dumps(values, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor, sort):
+    """
+    Returns the position stored in a cursor: (sort key, id), or (seed, rand_key, id) for the
+    random sort. Aborts with 400 if it is malformed or for another sort.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        cursor_sort, *position = values
+    except (binascii.Error, ValueError, TypeError):
+        abort(400, description="Invalid cursor")
+    if cursor_sort != sort or len(position) != (3 if sort == "random" else 2):
+        abort(400, description="Cursor does not match the requested sort")
+    if not all(isinstance(v, int) for v in position[-2 if sort == "random" else -1:]):
+        abort(400, description="Invalid cursor")
+    if sort == "random" and not isinstance(position[0], int):
+        abort(400, description="Invalid cursor")
+    return position
+
+def read_filters():
+    """The listing filters of the request: (q, group, subgroup, folder, recursive)."""
+    return (
+        request.args.get("q", ""),
+        request.args.get("group", ""),
+        request.args.get("subgroup", ""), # New subgroup filter
+        request.args.get("folder", type=int), # Folder id from /api/folders
+        request.args.get("recursive", "false").lower() == "true",
+    )
+
+def filter_sql(query, group, subgroup, folder, recursive):
+    """WHERE conditions on media (to be ANDed) and their params for the listing filters."""
+    params = []
+    where_conditions = []
+
+    if query:
+        # An IN subquery (not a join) makes SQLite evaluate the match set once; joined, the
+        # planner may walk a media index and re-run MATCH for every row of a group.
+        where_conditions.append("media.id IN (SELECT rowid FROM media_fts WHERE media_fts MATCH ?)")
+        params.append(f'{query}*')
+
+    if group:
+        where_conditions.append("media.group_tag = ?")
+        params.append(group)
+        # ✅ If subgroup is specified, filter on its folder subtree
+        if subgroup:
+            # The subgroup is the folder /mnt/gallery/group/subgroup; matching folder ids uses
+            # the folders tree and the (folder_id, mtime) index instead of a LIKE over paths.
+            subgroup_path = os.path.join(GALLERY_PATH, group, subgroup)
+            where_conditions.append(f"media.folder_id IN ({subtree_sql('path = ?')})")
+            params.append(subgroup_path)
+
+    if folder is not None:
+        if recursive:
+            where_conditions.append(f"media.folder_id IN ({subtree_sql('id = ?')})")
+        else:
+            where_conditions.append("media.folder_id = ?")
+        params.append(folder)
+
+    return where_conditions, params
+
 @bp.route("/api/gallery")
 @api_key_required
+@offload
 def gallery():
     """
-    Get a paginated list of media items with sorting, searching, and group/subgroup filtering.
+    Get a paginated list of media items with sorting, searching, and group/subgroup/folder
+    filtering (`folder` takes a folder id, `recursive=true` includes its subfolders).
+    Items carry the columns named in `fields=` (default: the full record, exif included);
+    clients that lay out a grid should name just what it shows.
+
+    Responses carry `next_cursor`; passing it back as `cursor` continues right after the last
+    item (keyset pagination), which stays cheap at any depth and is not shifted by files the
+    scanner adds meanwhile. `page` still works, via OFFSET (pass `seed` back for random).
+    Date sorts also take `start` (a timestamp, e.g. a /api/timeline bucket boundary) to begin
+    the listing there.
     """
     page = int(request.args.get("page", 1))
     limit = int(request.args.get("limit", 20))
     offset = (page - 1) * limit
     sort = request.args.get("sort", "random")
-    query = request.args.get("q", "")
-    group = request.args.get("group", "")
-    subgroup = request.args.get("subgroup", "") # New subgroup filter
+    cursor = request.args.get("cursor")
+    start = request.args.get("start", type=float) # Unix time to start from (date sorts)
+    query, group, subgroup, folder, recursive = read_filters()
+    fields = parse_fields()
 
-    conn = get_db()
+    conn = get_read_db()
     c = conn.cursor()
 
     # --- Dynamic Query Building ---
-    params = []
-    where_conditions = []
+    where_conditions, params = filter_sql(query, group, subgroup, folder, recursive)
     base_sql = "FROM media"
     join_sql = ""
 
-    if query:
-        join_sql = "JOIN media_fts f ON media.id = f.rowid"
-        where_conditions.append("media_fts MATCH ?")
-        params.append(f'{query}*')
-
-    if group:
-        where_conditions.append("group_tag = ?")
-        params.append(group)
-        # ✅ If subgroup is specified, add a path-based filter
-        if subgroup:
-            # Construct the expected path prefix for the subgroup
-            # IMPORTANT: This assumes paths are stored like /mnt/gallery/group/subgroup/...
-            # Using LIKE ensures flexibility, but might be slow on huge datasets without path indexing
-            subgroup_path_prefix = os.path.join(GALLERY_PATH, group, subgroup) + os.sep
-            where_conditions.append("path LIKE ?")
-            params.append(f'{subgroup_path_prefix}%')
+    # If no sort specified and no query, default to something reasonable (e.g., date descending)
+    if not sort and not query:
+        sort = "date_desc"
+    if cursor and sort not in SORTS and sort != "random":
+        abort(400, description="Cursors are only supported for random, date and filename sorts")
+    if start is not None and (cursor or sort not in ("date_desc", "date_asc")):
+        abort(400, description="start is only supported on the first page of date sorts")
 
     where_sql = ""
     if where_conditions:
         where_sql = "WHERE " + " AND ".join(where_conditions)
 
-    # Build final SQL
-    sql = f"SELECT * {base_sql} {join_sql} {where_sql}"
-    count_sql = f"SELECT COUNT(*) as cnt {base_sql} {join_sql} {where_sql}"
+    total_items = total_pages = None
+    if not cursor:
+        # Get total count for pagination. Cursor requests continue a listing whose first page
+        # already reported it, so they skip it entirely.
+        count_sql = f"SELECT COUNT(*) as cnt {base_sql} {join_sql} {where_sql}"
+        counter = None
+        if query or (folder is not None and group):
+            pass  # No counter covers these filters
+        elif folder is not None:
+            if recursive:
+                counter = (f"SELECT COALESCE(SUM(item_count), 0) FROM folders WHERE id IN ({subtree_sql('id = ?')})", (folder,))
+            else:
+                counter = ("SELECT COALESCE(MAX(item_count), 0) FROM folders WHERE id = ?", (folder,))
+        elif group and subgroup:
+            counter = ("SELECT COALESCE(SUM(count), 0) FROM media_counts WHERE group_tag = ? AND subgroup = ?", (group, subgroup))
+        elif group:
+            counter = ("SELECT COALESCE(SUM(count), 0) FROM media_counts WHERE group_tag = ?", (group,))
+        else:
+            counter = ("SELECT COALESCE(SUM(count), 0) FROM media_counts", ())
+        key = (query, group, subgroup, folder, recursive)
+        total_items = count_items(c, key, counter, count_sql, tuple(params))
+        total_pages = (total_items + limit - 1) // limit if limit > 0 else 1
+
+    # A cursor (or start) says where the page begins, so any `page` sent along is only echoed
+    if cursor or start is not None:
+        offset = 0
 
-    # Get total count for pagination
-    c.execute(count_sql, tuple(params))
-    total_row = c.fetchone()
-    total_items = total_row["cnt"] if total_row else 0
-    total_pages = (total_items + limit - 1) // limit if limit > 0 else 1
+    # The page is read as one or more segments, each a contiguous stretch of the sort order:
+    # (extra condition, its params). Segments are concatenated in order.
+    segments = [(None, [])]
+    inner_order_sql = order_by_sql = ""
+    inner_order_params, order_by_params = [], []
+    seed = None
+    if sort == "random":
+        # Seeded shuffle: rand_key is a persisted random permutation of the library. A listing
+        # starts at a random seed and walks rand_key upwards, wrapping around to the keys below
+        # the seed, so pages never repeat and each one is an index range scan.
+        position = None
+        if cursor:
+            seed, *position = decode_cursor(cursor, sort)
+        else:
+            seed = request.args.get("seed", type=int)
+            if seed is None or not 0 <= seed < RAND_KEY_RANGE:
+                seed = random.randrange(RAND_KEY_RANGE)
+        inner_order_sql = "ORDER BY media.rand_key, media.id"
+        order_by_sql = "ORDER BY m.rand_key < ?, m.rand_key, m.id"
+        order_by_params = [seed]
+        if offset:
+            # Cursorless page-number clients: same order, reached with OFFSET (sorts, but deterministically)
+            inner_order_sql = "ORDER BY media.rand_key < ?, media.rand_key, media.id"
+            inner_order_params = [seed]
+        elif position is None:
+            segments = [("media.rand_key >= ?", [seed]), ("media.rand_key < ?", [seed])]
+        elif position[0] >= seed:
+            segments = [
+                ("media.rand_key >= ? AND (media.rand_key, media.id) > (?, ?)", [seed, *position]),
+                ("media.rand_key < ?", [seed]),
+            ]
+        else:
+            segments = [("media.rand_key < ? AND (media.rand_key, media.id) > (?, ?)", [seed, *position])]
+    elif sort in SORTS:
+        column, direction = SORTS[sort]
+        inner_order_sql = f"ORDER BY media.{column} {direction}, media.id {direction}"
+        order_by_sql = f"ORDER BY m.{column} {direction}, m.id {direction}"
+        if cursor:
+            # Keyset pagination: seek past the last item instead of skipping `offset` rows.
+            # The row-value comparison walks the (column, rowid) index directly.
+            op = "<" if direction == "DESC" else ">"
+            segments = [(f"(media.{column}, media.id) {op} (?, ?)", decode_cursor(cursor, sort))]
+        elif start is not None:
+            # Jump to a point in time (a /api/timeline bucket): newest first starts below it,
+            # oldest first at it. Paging on from there continues by cursor.
+            segments = [("media.mtime < ?" if direction == "DESC" else "media.mtime >= ?", [start])]
 
     # ⚡ Bolt: Late Row Lookup optimization for all sorted queries.
     # Sorting and paginating only IDs in a subquery prevents loading large EXIF blobs into memory
     # for all records being sorted, significantly reducing memory pressure and improving latency.
-    # The composite indexes added in db.py (e.g., idx_media_group_mtime) ensure these subqueries
+    # The composite indexes added in db.py (e.g., idx_media_group_mtime_asc) ensure these subqueries
     # can be satisfied without temporary B-trees or full table scans.
-    order_by_sql = ""
+    id_queries = []
+    sql_params = []
+    for condition, condition_params in segments:
+        conditions = where_conditions + ([condition] if condition else [])
+        segment_where_sql = "WHERE " + " AND ".join(conditions) if conditions else ""
+        id_queries.append(f"""
+            SELECT id FROM (
+                SELECT media.id {base_sql} {join_sql} {segment_where_sql}
+                {inner_order_sql}
+                LIMIT ? OFFSET ?
+            )""")
+        sql_params += params + condition_params + inner_order_params + [limit, offset]
+
+    # Only the projected columns are read, plus whatever the next cursor is built from
+    columns = list(fields)
     if sort == "random":
-        order_by_sql = "ORDER BY RANDOM()"
-    elif sort == "date_desc":
-        order_by_sql = "ORDER BY mtime DESC"
-    elif sort == "date_asc":
-        order_by_sql = "ORDER BY mtime ASC"
-    elif sort == "file_asc":
-        order_by_sql = "ORDER BY filename ASC"
-    elif sort == "file_desc":
-        order_by_sql = "ORDER BY filename DESC"
-    # If no sort specified and no query, default to something reasonable (e.g., date descending)
-    elif not sort and not query:
-        order_by_sql = "ORDER BY mtime DESC"
+        columns.append("rand_key")
+    elif sort in SORTS:
+        columns.append(SORTS[sort][0])
+    columns = list(dict.fromkeys(columns))
 
     # Use Late Row Lookup for all sorted/paginated queries
     sql = f"""
-        SELECT m.* FROM media m
-        JOIN (
-            SELECT media.id {base_sql} {join_sql} {where_sql}
-            {order_by_sql}
-            LIMIT ? OFFSET ?
-        ) as t ON m.id = t.id
+        SELECT {", ".join(f"m.{col}" for col in columns)} FROM media m
+        JOIN ({" UNION ALL ".join(id_queries)}) as t ON m.id = t.id
         {order_by_sql}
+        LIMIT ?
     """
-    params.extend([limit, offset])
-    c.execute(sql, tuple(params))
-
-    # Decode the exif string into a dictionary
-    items = []
-    for row in c.fetchall():
-        item = dict(row)
-        if item.get("exif"):
-            try:
-                # Handle both dict (already parsed?) and string cases
-                if isinstance(item["exif"], str):
-                     item["exif"] = json.loads(item["exif"])
-                elif not isinstance(item["exif"], dict):
-                     item["exif"] = {} # Default to empty if it's neither string nor dict
-            except (json.JSONDecodeError, TypeError):
-                item["exif"] = {} # Default to empty on error
-        else:
-             item["exif"] = {} # Ensure exif key exists even if null in DB
-        items.append(item)
-
+    sql_params += order_by_params + [limit]
+    c.execute(sql, tuple(sql_params))
+    rows = c.fetchall()
     conn.close()
 
-    return jsonify({
+    items = [row_to_item(row, fields) for row in rows]
+
+    response = {
         "total_items": total_items,
         "page": page,
         "total_pages": total_pages,
         "items": items
-    })
\ No newline at end of file
+    }
+    if sort == "random":
+        response["seed"] = seed
+    if sort in SORTS or sort == "random":
+        # A short page means the listing is exhausted
+        response["next_cursor"] = encode_cursor(sort, rows[-1], seed) if len(rows) == limit and rows else None
+    return jsonify(response)
+
+def build_manifest(c, sort, seed, where_conditions, params):
+    """
+    Packs the listing into the manifest format: a 16-byte header (magic, version, count,
+    reserved; little-endian uint32s) followed by ids as uint32[count], widths and heights as
+    uint16[count] and types as uint8[count]. Dimensions beyond 65535 are scaled down together,
+    keeping the aspect ratio, which is all layout needs.
+    """
+    if sort == "random":
+        # Same order as the seeded gallery walk: two index range scans, no sort
+        segments = [("media.rand_key >= ?", [seed]), ("media.rand_key < ?", [seed])]
+        order_sql = "ORDER BY media.rand_key, media.id"
+    else:
+        column, direction = SORTS[sort]
+        segments = [(None, [])]
+        order_sql = f"ORDER BY media.{column} {direction}, media.id {direction}"
+
+    ids, widths, heights, types = array("I"), array("H"), array("H"), array("B")
+    for condition, condition_params in segments:
+        conditions = where_conditions + ([condition] if condition else [])
+        where_sql = "WHERE " + " AND ".join(conditions) if conditions else ""
+        rows = c.execute(
+            f"SELECT media.id, media.width, media.height, media.type FROM media {where_sql} {order_sql}",
+            params + condition_params,
+        )
+        for mid, width, height, ftype in rows:
+            width, height = width or 0, height or 0
+            if width > 0xFFFF or height > 0xFFFF:
+                scale = 0xFFFF / max(width, height)
+                width, height = max(1, round(width * scale)), max(1, round(height * scale))
+            ids.append(mid)
+            widths.append(width)
+            heights.append(height)
+            types.append(MANIFEST_TYPES.get(ftype, 3))
+
+    if sys.byteorder == "big":
+        for column in (ids, widths, heights):
+            column.byteswap()
+    header = struct.pack("<4sIII", MANIFEST_MAGIC, MANIFEST_VERSION, len(ids), 0)
+    return b"".join((header, ids.tobytes(), widths.tobytes(), heights.tobytes(), types.tobytes()))
+
+@bp.route("/api/gallery/manifest")
+@api_key_required
+@offload
+def gallery_manifest():
+    """
+    The layout of a whole listing in one compact binary response (format in build_manifest),
+    so virtualised grids can size the full scroll area and jump anywhere; fetch the records of
+    the items in view with /api/media/batch. Takes the gallery's filters and sorts (date and
+    filename; random with `seed`, which is echoed in X-Manifest-Seed). Cached per listing and
+    database generation (random ones only when seeded), with an ETag for revalidation.
+    """
+    sort = request.args.get("sort", "date_desc")
+    if sort not in SORTS and sort != "random":
+        abort(400, description=f"sort must be one of: {', '.join([*SORTS, 'random'])}")
+    seed = None
+    seeded = True
+    if sort == "random":
+        seed = request.args.get("seed", type=int)
+        if seed is None or not 0 <= seed < RAND_KEY_RANGE:
+            seed = random.randrange(RAND_KEY_RANGE)
+            seeded = False
+    filters = read_filters()
+    where_conditions, params = filter_sql(*filters)
+
+    conn = get_read_db()
+    try:
+        c = conn.cursor()
+        key = (filters, sort, seed)
+        generation = get_generation(c)
+        body = _cache_get(_manifest_cache, key, generation)
+        if body is None:
+            body = build_manifest(c, sort, seed, where_conditions, params)
+            # A freshly drawn seed is only reused once the client sends it back, so caching
+            # it would just push out manifests that do get hit again
+            if seeded:
+                _cache_put(_manifest_cache, key, generation, MANIFEST_CACHE_TTL, MANIFEST_CACHE_SIZE, body)
+    finally:
+        conn.close()
+
+    response = Response(body, mimetype="application/octet-stream")
+    response.headers["Cache-Control"] = "private, no-cache"
+    response.headers["X-Manifest-Count"] = str(struct.unpack_from("<I", body, 8)[0])
+    if seed is not None:
+        response.headers["X-Manifest-Seed"] = str(seed)
+    response.add_etag()
+    return response.make_conditional(request)
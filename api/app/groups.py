@@ -1,21 +1,23 @@
 from flask import Blueprint, jsonify
-from app.db import get_db
+from app.db import get_read_db
 from app.api_key_middleware import api_key_required
+from app.offload import offload
 
 bp = Blueprint("groups", __name__)
 @bp.route("/api/gallery/groups")
 @api_key_required
+@offload
 def get_groups():
     """
     Get a list of all unique group_tags and the count of items in each.
     """
-    conn = get_db()
+    conn = get_read_db()
     c = conn.cursor()
-    # Get distinct, non-null group tags, count them
+    # Sum the trigger-maintained per-(group, subgroup, type) counters instead of scanning media
     c.execute("""
-        SELECT group_tag, COUNT(*) as count 
-        FROM media 
-        WHERE group_tag IS NOT NULL AND group_tag != ''
+        SELECT group_tag, SUM(count) as count
+        FROM media_counts
+        WHERE group_tag != ''
         GROUP BY group_tag
         ORDER BY group_tag ASC
     """)
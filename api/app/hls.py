@@ -0,0 +1,222 @@
+# api/app/hls.py
+import os
+import math
+import uuid
+import logging
+import subprocess
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from flask import Blueprint, Response, send_file, abort
+from app.api_key_middleware import api_key_required
+from app.auth_middleware import login_required
+from app.offload import run_blocking, path_exists
+from app.large_images import FFMPEG_COST
+from app.file_cache import get_media_file
+from app.thumbnails import submit_generation, GENERATION_WAIT_TIMEOUT
+
+logger = logging.getLogger(__name__)
+bp = Blueprint("hls", __name__)
+
+# HLS renditions for videos browsers cannot play as-is (mkv/avi containers, HEVC, ...). Segments
+# are transcoded on demand, one ffmpeg run each, into <HLS_DIR>/<id>-<mtime>-<size>/<n>.ts, so a
+# replaced source gets a fresh folder and the stale one ages out of the cache.
+HLS_DIR = "/app/data/hls"
+os.makedirs(HLS_DIR, exist_ok=True)
+HLS_SEGMENT_SECONDS = int(os.getenv("HLS_SEGMENT_SECONDS", 6))
+# Segments transcoded ahead of the one being played, so playback does not wait on ffmpeg
+HLS_PREFETCH_SEGMENTS = int(os.getenv("HLS_PREFETCH_SEGMENTS", 2))
+# Total size of the segment cache; least recently played segments are evicted first
+HLS_CACHE_BYTES = int(os.getenv("HLS_CACHE_MB", 4096)) * 1024 * 1024
+HLS_MAX_HEIGHT = int(os.getenv("HLS_MAX_HEIGHT", 1080))
+# Rough peak memory of one segment transcode (decoder, x264 lookahead and scaler)
+HLS_SEGMENT_COST = 4 * FFMPEG_COST
+PLAYLIST_NAME = "index.m3u8"
+
+
+def probe_duration(src):
+    """Duration of a media file in seconds, or None if ffprobe cannot read it."""
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", src],
+            capture_output=True, text=True, check=True, timeout=30,
+        )
+        return float(result.stdout.strip())
+    except subprocess.TimeoutExpired:
+        logger.warning(f"ffprobe timed out for {src}")
+    except (subprocess.CalledProcessError, ValueError) as e:
+        logger.error(f"Could not get the duration of {src}: {e}")
+    return None
+
+
+def segment_lengths(duration):
+    count = max(1, math.ceil(round(duration / HLS_SEGMENT_SECONDS, 3)))
+    return [min(HLS_SEGMENT_SECONDS, duration - n * HLS_SEGMENT_SECONDS) for n in range(count)]
+
+
+def load_segments(src, folder):
+    """
+    (start, length) of every segment of a video, read from its cached playlist or, on first
+    play, probed and written out as one.
+    """
+    path = os.path.join(folder, PLAYLIST_NAME)
+    try:
+        with open(path) as f:
+            lengths = [float(line[8:].strip().rstrip(",")) for line in f if line.startswith("#EXTINF:")]
+    except FileNotFoundError:
+        duration = probe_duration(src)
+        if not duration or duration <= 0:
+            return None
+        lengths = segment_lengths(duration)
+        lines = [
+            "#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{HLS_SEGMENT_SECONDS}",
+            "#EXT-X-MEDIA-SEQUENCE:0", "#EXT-X-PLAYLIST-TYPE:VOD",
+        ]
+        for n, length in enumerate(lengths):
+            lines += [f"#EXTINF:{length:.3f},", f"{n}.ts"]
+        lines.append("#EXT-X-ENDLIST")
+        os.makedirs(folder, exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp, path)
+    return [(n * HLS_SEGMENT_SECONDS, length) for n, length in enumerate(lengths)]
+
+
+def render_segment(src, dst, start, length):
+    """
+    Transcodes one segment to H.264/AAC in MPEG-TS. Runs in the generation pool. The accurate
+    input seek starts every segment on a fresh keyframe, and the timestamp offset keeps the
+    segments one continuous timeline. Returns whether the segment was written.
+    """
+    tmp = f"{dst}.{uuid.uuid4().hex}.tmp"
+    cmd = [
+        "ffmpeg", "-y", "-v", "error", "-ss", f"{start:.3f}", "-i", src, "-t", f"{length:.3f}",
+        "-map", "0:v:0", "-map", "0:a:0?", "-sn", "-dn",
+        "-vf", f"scale=-2:'min({HLS_MAX_HEIGHT},trunc(ih/2)*2)',format=yuv420p",
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", "23",
+        "-c:a", "aac", "-ac", "2", "-b:a", "160k",
+        "-output_ts_offset", f"{start:.3f}", "-muxdelay", "0", "-f", "mpegts", tmp,
+    ]
+    try:
+        result = subprocess.run(cmd, check=False, capture_output=True, text=True, timeout=120)
+        if result.returncode == 0 and os.path.exists(tmp):
+            os.replace(tmp, dst)
+        else:
+            logger.warning(f"ffmpeg created no HLS segment at {start:.0f}s of {src}: {result.stderr.strip()}")
+    except subprocess.TimeoutExpired:
+        logger.error(f"ffmpeg timed out transcoding {start:.0f}s of {src}")
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    evict_segments(keep=dst)
+    return os.path.exists(dst)
+
+
+def evict_segments(keep=None):
+    """Removes the least recently played segments until the cache fits HLS_CACHE_BYTES."""
+    segments = []
+    try:
+        for folder in os.scandir(HLS_DIR):
+            if not folder.is_dir(follow_symlinks=False):
+                continue
+            for entry in os.scandir(folder.path):
+                if entry.name.endswith(".ts"):
+                    st = entry.stat(follow_symlinks=False)
+                    segments.append((st.st_mtime, st.st_size, entry.path))
+    except OSError as e:
+        logger.warning(f"Could not measure the HLS cache: {e}")
+        return
+    total = sum(size for _, size, _ in segments)
+    for _, size, path in sorted(segments):
+        if total <= HLS_CACHE_BYTES:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+
+def _touch(path):
+    """Marks a segment as recently played (the LRU clock is its mtime)."""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _source(mid):
+    """A video's path and the cache folder of its current version."""
+    media = get_media_file(mid)
+    if media is None or media.type != "video":
+        abort(404)
+    return media.path, os.path.join(HLS_DIR, f"{mid}-{int(media.mtime)}-{media.size}")
+
+
+def _segments(src, folder):
+    segments = run_blocking(load_segments, src, folder)
+    if segments is None:
+        abort(415, description="Video cannot be read for transcoding")
+    return segments
+
+
+def _prefetch(src, folder, segments, n):
+    """Starts transcoding the segments after n that are not cached, while slots are free."""
+    for m in range(n + 1, min(n + 1 + HLS_PREFETCH_SEGMENTS, len(segments))):
+        path = os.path.join(folder, f"{m}.ts")
+        if path_exists(path):
+            continue
+        if submit_generation(("hls", folder, m), HLS_SEGMENT_COST, render_segment, src, path, *segments[m], wait=0) is None:
+            break
+
+
+def _busy():
+    # Players retry failed segment loads (e.g. hls.js fragLoadPolicy)
+    return Response("Transcoding busy", status=503, headers={"Retry-After": "2"})
+
+
+@bp.route("/api/hls/<int:mid>/index.m3u8")
+@api_key_required
+@login_required
+def playlist(mid):
+    """
+    HLS playlist of a video transcoded to H.264/AAC, for sources browsers cannot play from
+    /api/stream. Segments are produced on first request and cached.
+    """
+    src, folder = _source(mid)
+    _segments(src, folder)
+    return send_file(os.path.join(folder, PLAYLIST_NAME), mimetype="application/vnd.apple.mpegurl")
+
+
+@bp.route("/api/hls/<int:mid>/<int:n>.ts")
+@api_key_required
+@login_required
+def segment(mid, n):
+    """Serves segment n, transcoding it if needed, and starts transcoding the next ones."""
+    src, folder = _source(mid)
+    segments = _segments(src, folder)
+    if n >= len(segments):
+        abort(404)
+
+    path = os.path.join(folder, f"{n}.ts")
+    future = None
+    if path_exists(path):
+        run_blocking(_touch, path)
+    else:
+        future = submit_generation(("hls", folder, n), HLS_SEGMENT_COST, render_segment, src, path, *segments[n])
+        if future is None:
+            return _busy()
+    _prefetch(src, folder, segments, n)
+
+    if future is not None:
+        try:
+            future.result(timeout=GENERATION_WAIT_TIMEOUT)
+        except FutureTimeoutError:
+            return _busy()
+        except Exception as e:
+            logger.error(f"HLS transcoding failed for ID {mid} segment {n}: {e}", exc_info=True)
+            abort(500)
+        if not path_exists(path):
+            abort(500)
+    return send_file(path, mimetype="video/mp2t", max_age=3600)
@@ -0,0 +1,195 @@
+import os
+import struct
+import zlib
+import logging
+import threading
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Images above this many pixels take the bounded-memory path where the format allows
+LARGE_IMAGE_PIXELS = 40_000_000
+# Target size of one decoded PNG strip
+STRIP_BYTES = 16 * 1024 * 1024
+# Rough peak memory of one ffmpeg thumbnail run (decode + scale of a single frame)
+FFMPEG_COST = 64 * 1024 * 1024
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# PNG colour type -> (Pillow mode, bytes per pixel) for the 8-bit layouts Pillow's
+# "zip" decoder can unfilter straight into an image of that mode
+STRIP_MODES = {0: ("L", 1), 2: ("RGB", 3), 4: ("LA", 2), 6: ("RGBA", 4)}
+
+
+def read_png_header(path):
+    """Returns (width, height, bit_depth, colour_type, interlace) from the IHDR chunk, or None."""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(33)
+    except OSError:
+        return None
+    if len(head) < 33 or head[:8] != PNG_SIGNATURE or head[12:16] != b"IHDR":
+        return None
+    width, height, bit_depth, colour_type, _, _, interlace = struct.unpack(">IIBBBBB", head[16:29])
+    return width, height, bit_depth, colour_type, interlace
+
+
+def can_decode_in_strips(header):
+    if header is None:
+        return False
+    _, _, bit_depth, colour_type, interlace = header
+    return bit_depth == 8 and interlace == 0 and colour_type in STRIP_MODES
+
+
+def _iter_idat(f):
+    """Yields the payload of each IDAT chunk in order."""
+    f.seek(8)
+    while True:
+        head = f.read(8)
+        if len(head) < 8:
+            return
+        length, chunk_type = struct.unpack(">I4s", head)
+        if chunk_type == b"IDAT":
+            yield f.read(length)
+            f.seek(4, os.SEEK_CUR)  # CRC
+        elif chunk_type == b"IEND":
+            return
+        else:
+            f.seek(length + 4, os.SEEK_CUR)
+
+
+def png_strip_rows(header, multiple=1):
+    """Rows per strip for a PNG so a strip stays near STRIP_BYTES, rounded to a multiple."""
+    width, _, _, colour_type, _ = header
+    stride = width * STRIP_MODES[colour_type][1] + 1
+    return max(multiple, (STRIP_BYTES // stride) // multiple * multiple)
+
+
+def iter_png_strips(src, rows_per_strip):
+    """
+    Decodes an 8-bit, non-interlaced PNG as a series of (y, strip image) pairs without ever
+    holding the whole image. The IDAT stream is inflated incrementally; each strip of filtered
+    scanlines is handed to Pillow's PNG unfilter, prefixed with the previous (already unfiltered)
+    row so Up/Paeth filters resolve. Callers check can_decode_in_strips() first.
+    """
+    header = read_png_header(src)
+    width, height, _, colour_type, _ = header
+    mode, bpp = STRIP_MODES[colour_type]
+    stride = width * bpp + 1  # Each scanline starts with its filter byte
+    strip_bytes = rows_per_strip * stride
+
+    inflater = zlib.decompressobj()
+    pending = bytearray()
+    previous_row = None
+    y = 0
+
+    def decode(rows):
+        nonlocal previous_row, y
+        chunk = bytes(pending[:rows * stride])
+        del pending[:rows * stride]
+        if previous_row is not None:
+            # Filter type 0 ("None") seeds the unfilter with the real previous row
+            chunk = b"\x00" + previous_row + chunk
+        total_rows = rows + (previous_row is not None)
+        strip = Image.frombytes(mode, (width, total_rows), zlib.compress(chunk, 0), "zip", mode)
+        if previous_row is not None:
+            strip = strip.crop((0, 1, width, total_rows))
+        previous_row = strip.crop((0, rows - 1, width, rows)).tobytes()
+        top = y
+        y += rows
+        return top, strip
+
+    with open(src, "rb") as f:
+        for data in _iter_idat(f):
+            while data:
+                # Cap each inflate step: flat images compress so well that one IDAT chunk
+                # can expand to hundreds of megabytes
+                pending += inflater.decompress(data, strip_bytes)
+                data = inflater.unconsumed_tail
+                while len(pending) >= strip_bytes and y + rows_per_strip <= height:
+                    yield decode(rows_per_strip)
+        pending += inflater.flush()
+
+    remaining = min(height - y, len(pending) // stride)
+    if remaining > 0:
+        yield decode(remaining)
+    if y < height:
+        logger.warning(f"PNG data ended early for {src} ({y}/{height} rows)")
+
+
+def thumbnail_png_in_strips(src, size):
+    """
+    Thumbnails a huge 8-bit, non-interlaced PNG without decoding it all at once: each strip is
+    box-reduced into a small intermediate image, which is then thumbnailed.
+    Returns the thumbnail, or None if the file is not eligible.
+    """
+    header = read_png_header(src)
+    if not can_decode_in_strips(header):
+        return None
+    width, height, _, colour_type, _ = header
+    mode = STRIP_MODES[colour_type][0]
+
+    # Reduce by an integer factor that keeps the intermediate at least twice the target size,
+    # and decode strips whose height is a multiple of it so reduced strips tile exactly.
+    factor = max(1, int(min(width / size[0], height / size[1]) / 2))
+    reduced = Image.new(mode, (-(-width // factor), -(-height // factor)))
+    for y, strip in iter_png_strips(src, png_strip_rows(header, factor)):
+        with strip, strip.reduce(factor) as small:
+            reduced.paste(small, (0, y // factor))
+
+    reduced.thumbnail(size)
+    return reduced
+
+
+def estimate_decode_bytes(src, ftype, width=None, height=None, size=(600, 600)):
+    """Estimates the peak memory needed to thumbnail a file, for admission control."""
+    if ftype != "image":
+        return FFMPEG_COST
+    ext = os.path.splitext(src)[1].lower()
+    header = read_png_header(src) if ext == ".png" else None
+    if header:
+        width, height = header[0], header[1]
+    if not width or not height:
+        try:
+            with Image.open(src) as im:  # Reads the header only
+                width, height = im.size
+        except Exception:
+            return FFMPEG_COST
+    if width * height > LARGE_IMAGE_PIXELS and can_decode_in_strips(header):
+        # Inflated strip + stored-zlib copy + decoded strip, plus the intermediate
+        return 3 * STRIP_BYTES + 4 * size[0] * size[1] * 4
+    pixels = width * height
+    if ext in (".jpg", ".jpeg"):
+        # draft() decodes at 1/2, 1/4 or 1/8 scale while staying above the target size
+        scale = 1
+        while scale < 8 and width // (scale * 2) >= size[0] and height // (scale * 2) >= size[1]:
+            scale *= 2
+        pixels //= scale * scale
+    return pixels * 4
+
+
+class MemoryBudget:
+    """
+    Admits jobs while the sum of their estimated memory stays within a byte budget.
+    A job larger than the whole budget is admitted only when nothing else is running.
+    """
+
+    def __init__(self, limit_bytes):
+        self.limit = limit_bytes
+        self.used = 0
+        self._cond = threading.Condition()
+
+    def _charge(self, cost):
+        return min(cost, self.limit)
+
+    def acquire(self, cost, timeout=None):
+        charge = self._charge(cost)
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.used + charge <= self.limit, timeout):
+                return False
+            self.used += charge
+            return True
+
+    def release(self, cost):
+        with self._cond:
+            self.used -= self._charge(cost)
+            self._cond.notify_all()
@@ -1,46 +1,153 @@
-import os, shutil
-from flask import Blueprint, jsonify, abort
-from app.db import get_db
+import os, shutil, sqlite3, logging
+from flask import Blueprint, jsonify, request, abort
+from app.db import get_db, get_read_db
 from app.api_key_middleware import api_key_required
+from app.offload import run_blocking, map_blocking
+from app.media import parse_ids
+from app.folders import assign_folders, prune_folders
+from app.delete import MAX_BULK_IDS, BULK_MOVE_WORKERS
 
+logger = logging.getLogger(__name__)
 bp = Blueprint("like", __name__)
 LIKED_DIR = "/mnt/gallery/liked"
+
+
+def like_target(row, liked):
+    """
+    Where a media file goes when its liked state becomes `liked`: the liked folder, or back to
+    its original location. Returns (target, None), or (None, error message) if it cannot move.
+    """
+    if liked:
+        return os.path.join(LIKED_DIR, os.path.basename(row["path"])), None
+    # Unlike -> move back to original location
+    orig = row["original_path"] if row["original_path"] else None  # May be None for old records
+    if orig and os.path.exists(os.path.dirname(orig)):
+        return orig, None
+    return None, "Cannot unlike: original path unknown"
+
+
+def move_file(mid, path, target):
+    """Moves one file for a like change; returns its result ({"id", "status", "message"?})."""
+    try:
+        if os.path.exists(target):
+            return {"id": mid, "status": "error", "message": "A file with this name is already there"}
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.move(path, target)
+    except Exception as e:
+        logger.error(f"Could not move {path} to {target}: {e}")
+        return {"id": mid, "status": "error", "message": "Could not move the file"}
+    return {"id": mid, "status": "ok"}
+
+
+def _fetch_rows(ids):
+    conn = get_read_db()
+    try:
+        rows = conn.execute(
+            f"SELECT id, path, liked, original_path FROM media WHERE id IN ({','.join('?' * len(ids))})", ids
+        ).fetchall()
+    finally:
+        conn.close()
+    return {row["id"]: row for row in rows}
+
+
+def _record_likes(changes):
+    """
+    Stores (id, path, liked, original path) changes in one transaction, moving each record to
+    the folder of its new path.
+    """
+    conn = get_db()
+    try:
+        c = conn.cursor()
+        c.executemany(
+            "UPDATE media SET path=?, liked=?, original_path=?, folder_id=NULL WHERE id=?",
+            [(path, int(liked), orig, mid) for mid, path, liked, orig in changes],
+        )
+        assign_folders(c)
+        prune_folders(c)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _change(row, target, liked):
+    # Liking remembers where the file came from; unliking forgets it
+    return row["id"], target, liked, row["path"] if liked else None
+
+
+def _plan_likes(ids, rows, liked):
+    """Sorts ids into final results and (row, target) moves for a like_batch() request."""
+    results, moves, targets = {}, [], set()
+    for mid in ids:
+        row = rows.get(mid)
+        if row is None:
+            results[mid] = {"id": mid, "status": "not_found", "message": "Media not found"}
+        elif bool(row["liked"]) == liked:
+            results[mid] = {"id": mid, "status": "unchanged"}
+        else:
+            target, error = like_target(row, liked)
+            if target in targets:
+                # Same-named files liked together would land on one path
+                error = "A file with this name is already there"
+            if error:
+                results[mid] = {"id": mid, "status": "error", "message": error}
+            else:
+                targets.add(target)
+                moves.append((row, target))
+    return results, moves
+
+
 @bp.route("/api/toggle_like/<int:mid>", methods=["POST"])
 @api_key_required
 def toggle_like(mid):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT * FROM media WHERE id=?", (mid,))
-    row = c.fetchone()
+    row = run_blocking(_fetch_rows, [mid]).get(mid)
     if not row:
-        conn.close()
         abort(404)
 
-    path = row["path"]
-    liked = row["liked"]
-    orig = row["original_path"] if row["original_path"] else None  # May be None for old records
+    liked = not row["liked"]
+    target, error = run_blocking(like_target, row, liked)
+    if error:
+        return jsonify({"status": "error", "message": error}), 400
+    result = run_blocking(move_file, mid, row["path"], target)
+    if result["status"] == "error":
+        return jsonify({"status": "error", "message": result["message"]}), 400
 
-    if liked:
-        # Unlike -> move back to original location
-        if orig and os.path.exists(os.path.dirname(orig)):
-            target = orig
-        else:
-            # Fallback: if original_path is missing, keep in liked folder
-            # This shouldn't happen but prevents errors
-            conn.close()
-            return jsonify({"status": "error", "message": "Cannot unlike: original path unknown"}), 400
-        
-        os.makedirs(os.path.dirname(target), exist_ok=True)
-        shutil.move(path, target)
-        c.execute("UPDATE media SET path=?, liked=0, original_path=NULL WHERE id=?", (target, mid))
-    else:
-        # Like -> move to liked folder and store original path
-        target = os.path.join(LIKED_DIR, os.path.basename(path))
-        os.makedirs(LIKED_DIR, exist_ok=True)
-        shutil.move(path, target)
-        c.execute("UPDATE media SET path=?, liked=1, original_path=? WHERE id=?", (target, path, mid))
+    run_blocking(_record_likes, [_change(row, target, liked)])
+    return jsonify({"status": "ok", "liked": liked})
+
+
+@bp.route("/api/like/batch", methods=["POST"])
+@api_key_required
+def like_batch():
+    """
+    Likes or unlikes several items: JSON body {"ids": [...], "liked": true|false}. Files are
+    moved BULK_MOVE_WORKERS at a time and the records updated in one transaction. Returns one
+    result per id, in order, with status ok, unchanged (already in that state), error, or
+    not_found.
+    """
+    body = request.get_json(silent=True)
+    liked = body.get("liked") if isinstance(body, dict) else None
+    if not isinstance(liked, bool):
+        abort(400, description="liked must be true or false")
+    ids = parse_ids(MAX_BULK_IDS)
+    rows = run_blocking(_fetch_rows, ids)
+    results, moves = run_blocking(_plan_likes, ids, rows, liked)
+
+    moved = map_blocking(lambda move: move_file(move[0]["id"], move[0]["path"], move[1]), moves, BULK_MOVE_WORKERS)
+    changes = []
+    for (row, target), result in zip(moves, moved):
+        results[row["id"]] = result
+        if result["status"] == "ok":
+            changes.append(_change(row, target, liked))
 
-    conn.commit()
-    conn.close()
-    return jsonify({"status": "ok", "liked": not liked})
+    if changes:
+        try:
+            run_blocking(_record_likes, changes)
+        except sqlite3.Error as e:
+            logger.error(f"Could not record {len(changes)} like changes: {e}", exc_info=True)
+            # Put the files back so the library and the database stay in step
+            map_blocking(lambda change: move_file(change[0], change[1], rows[change[0]]["path"]), changes, BULK_MOVE_WORKERS)
+            for mid, *_ in changes:
+                results[mid] = {"id": mid, "status": "error", "message": "Could not update the database"}
+            changes = []
 
+    return jsonify({"results": [results[mid] for mid in ids], "changed": len(changes), "liked": liked})
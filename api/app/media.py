@@ -0,0 +1,123 @@
+# api/app/media.py
+import json
+from flask import Blueprint, jsonify, request, abort
+from app.db import get_read_db
+from app.api_key_middleware import api_key_required
+from app.offload import offload
+
+bp = Blueprint("media", __name__)
+
+# Columns a client may request through `fields=`
+MEDIA_FIELDS = (
+    "id", "filename", "path", "size", "mtime", "liked", "user_comment", "type", "width", "height",
+    "exif", "group_tag", "original_path", "thumb_state", "lqip", "dominant_color", "folder_id",
+)
+# Upper bound on ids in one batch request
+MAX_BATCH_IDS = 200
+
+
+def parse_fields(default=MEDIA_FIELDS):
+    """
+    Reads the `fields=` projection: a comma-separated list, or `*` for every field. Without it
+    the full record is returned, as existing clients (the Android app) expect; grids should ask
+    for their layout fields and fetch the rest, notably the exif blob, from /api/media/<id>.
+    """
+    value = request.args.get("fields")
+    if value is None:
+        return list(default)
+    if value.strip() == "*":
+        return list(MEDIA_FIELDS)
+    fields = [f.strip() for f in value.split(",") if f.strip()]
+    unknown = [f for f in fields if f not in MEDIA_FIELDS]
+    if unknown:
+        abort(400, description=f"Unknown fields: {', '.join(unknown)}")
+    if "id" not in fields:
+        fields.insert(0, "id")
+    return fields
+
+
+def parse_ids(limit=MAX_BATCH_IDS):
+    """
+    Reads `ids=` (comma-separated media ids), or for POSTs the "ids" list of a JSON body, in
+    order and without duplicates; 400 if malformed.
+    """
+    body = request.get_json(silent=True) if request.method == "POST" else None
+    if isinstance(body, dict):
+        values = body.get("ids")
+        if not isinstance(values, list) or not all(isinstance(i, int) for i in values):
+            abort(400, description="ids must be a list of integers")
+        ids = values
+    else:
+        try:
+            ids = [int(i) for i in request.args.get("ids", "").split(",") if i.strip()]
+        except ValueError:
+            abort(400, description="ids must be a comma-separated list of integers")
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        abort(400, description="Missing ids")
+    if len(ids) > limit:
+        abort(400, description=f"At most {limit} ids per request")
+    return ids
+
+
+def parse_exif(value):
+    """Decodes the stored exif JSON, falling back to an empty dict."""
+    if isinstance(value, dict):
+        return value
+    if not value:
+        return {}
+    try:
+        exif = json.loads(value)
+    except (json.JSONDecodeError, TypeError):
+        return {}
+    return exif if isinstance(exif, dict) else {}
+
+
+def row_to_item(row, fields):
+    """Projects a database row onto the requested fields."""
+    item = {f: row[f] for f in fields}
+    if "exif" in item:
+        item["exif"] = parse_exif(item["exif"])
+    return item
+
+
+@bp.route("/api/media/batch")
+@api_key_required
+@offload
+def media_batch():
+    """
+    Records of several items in one request (`ids=1,2,3`), in the order given; `fields=` as for
+    the gallery. Ids that do not exist are listed under `missing`.
+    """
+    ids = parse_ids()
+    fields = parse_fields()
+    conn = get_read_db()
+    try:
+        rows = conn.execute(
+            f"SELECT {', '.join(fields)} FROM media WHERE id IN ({','.join('?' * len(ids))})", ids
+        ).fetchall()
+    finally:
+        conn.close()
+    found = {row["id"]: row for row in rows}
+    return jsonify({
+        "items": [row_to_item(found[mid], fields) for mid in ids if mid in found],
+        "missing": [mid for mid in ids if mid not in found],
+    })
+
+
+@bp.route("/api/media/<int:mid>")
+@api_key_required
+@offload
+def media_detail(mid):
+    """Full record of one media item (including its decoded exif), for detail views."""
+    fields = parse_fields()
+    conn = get_read_db()
+    try:
+        row = conn.execute(
+            f"SELECT {', '.join(fields)} FROM media WHERE id = ?", (mid,)
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        abort(404, description="Media not found")
+    return jsonify(row_to_item(row, fields))
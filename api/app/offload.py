@@ -0,0 +1,93 @@
+# api/app/offload.py
+import os
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+try:
+    from gevent import monkey, get_hub
+    from gevent.pool import Pool
+except ImportError:  # Plain threaded servers have nothing to offload from
+    monkey = get_hub = Pool = None
+
+# Native threads available to blocking calls of one worker (gevent's hub threadpool)
+OFFLOAD_THREADS = int(os.getenv("OFFLOAD_THREADS", 10))
+
+
+# Set inside offloaded calls, which are already off the loop and run nested calls directly
+_offloaded = contextvars.ContextVar("offloaded", default=False)
+
+
+def _gevent_active():
+    return monkey is not None and monkey.is_module_patched("threading")
+
+
+def _run_offloaded(fn, args, kwargs):
+    _offloaded.set(True)
+    # Exceptions are handed back rather than raised in the pool, which would log every abort()
+    try:
+        return fn(*args, **kwargs), None
+    except BaseException as e:
+        return None, e
+
+
+def _threadpool():
+    pool = get_hub().threadpool
+    if pool.maxsize != OFFLOAD_THREADS:
+        pool.maxsize = OFFLOAD_THREADS
+    return pool
+
+
+def native_lock():
+    """
+    A real OS-level lock, even under monkey-patching. For state shared between greenlets and
+    offloaded threads; only hold it for short critical sections that never yield.
+    """
+    if _gevent_active():
+        return monkey.get_original("threading", "Lock")()
+    return threading.Lock()
+
+
+def run_blocking(fn, *args, **kwargs):
+    """
+    Calls fn in a native thread and waits for it without blocking the gevent loop, so other
+    greenlets keep serving meanwhile. sqlite3, os.stat and friends are C calls gevent cannot
+    patch; run directly in a greenlet they stall every request on the worker. Exceptions
+    propagate to the caller. Without gevent, fn is simply called.
+    """
+    if not _gevent_active() or _offloaded.get():
+        return fn(*args, **kwargs)
+    # The thread runs in a copy of the caller's context, so Flask's request, app context and
+    # `g` are the caller's own objects (the greenlet is parked until it returns).
+    result, error = _threadpool().apply(contextvars.copy_context().run, (_run_offloaded, fn, args, kwargs))
+    if error is not None:
+        raise error
+    return result
+
+
+def map_blocking(fn, items, workers):
+    """
+    fn(item) for every item, at most `workers` at a time in native threads; results in order.
+    For batches of independent blocking calls (file moves on a slow mount) that gain from
+    overlapping. Already offloaded callers run them one by one.
+    """
+    if not _gevent_active():
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(fn, items))
+    if _offloaded.get():
+        return [fn(item) for item in items]
+    return Pool(workers).map(lambda item: run_blocking(fn, item), items)
+
+
+def path_exists(path):
+    """os.path.exists through run_blocking; the gallery is often a network mount."""
+    return run_blocking(os.path.exists, path)
+
+
+def offload(view):
+    """Decorator running a view through run_blocking; for views that are mostly DB or disk work."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        return run_blocking(view, *args, **kwargs)
+    return wrapper
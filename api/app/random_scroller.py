@@ -1,65 +1,127 @@
-from flask import Blueprint, jsonify, request
-from app.db import get_db
+import os
+import random
+from flask import Blueprint, jsonify, request, abort
+from app.db import get_read_db, RAND_KEY_RANGE
 from app.api_key_middleware import api_key_required
+from app.offload import offload
 
 bp = Blueprint("random_scroller", __name__)
+
+# Upper bound on items returned by one /api/files/random call; larger counts are rejected
+MAX_RANDOM_COUNT = int(os.getenv("RANDOM_MAX_COUNT", 100))
+# Batches of id lookups sample_ids() makes before drawing the rest from a rand_key segment
+RANDOM_PROBE_ROUNDS = 4
+# Rows of the rand_key segment the remainder is drawn from
+RANDOM_SEGMENT_ROWS = 1000
+
+
+def sample_ids(c, count):
+    """
+    Picks up to `count` distinct ids uniformly at random: random ids from the id range are looked
+    up in batches and kept if they exist (rejection sampling), which stays exact however the rows
+    are spread, in O(count log n) while the range is dense. If deletions have left it too sparse
+    to fill the sample within RANDOM_PROBE_ROUNDS batches, the rest is drawn from the rows that
+    follow a random rand_key, the segment a random gallery listing starts with. That also covers
+    libraries smaller than `count`.
+    """
+    # Separate subqueries: SQLite answers a lone MIN or MAX from the end of the index, but scans
+    # the table for both at once
+    low, high = c.execute("SELECT (SELECT MIN(id) FROM media), (SELECT MAX(id) FROM media)").fetchone()
+    if low is None:
+        return []  # Empty library
+    ids, chosen = [], set()
+    for _ in range(RANDOM_PROBE_ROUNDS):
+        if len(ids) == count:
+            break
+        # Twice the missing ids per batch, so a library with holes still fills in one or two
+        probes = [random.randint(low, high) for _ in range(2 * (count - len(ids)))]
+        found = {row["id"] for row in c.execute(
+            f"SELECT id FROM media WHERE id IN ({','.join('?' * len(probes))})", probes
+        )}
+        for mid in probes:
+            if mid in found and mid not in chosen and len(ids) < count:
+                ids.append(mid)
+                chosen.add(mid)
+
+    if len(ids) < count:
+        # A random draw from the RANDOM_SEGMENT_ROWS rows after a random rand_key: exact for
+        # libraries that size or smaller, and close to uniform beyond
+        seed = random.randrange(RAND_KEY_RANGE)
+        segment = [row["id"] for row in c.execute(
+            "SELECT id FROM media WHERE rand_key >= ? ORDER BY rand_key LIMIT ?", (seed, RANDOM_SEGMENT_ROWS)
+        )]
+        if len(segment) < RANDOM_SEGMENT_ROWS:
+            segment += [row["id"] for row in c.execute(
+                "SELECT id FROM media WHERE rand_key < ? ORDER BY rand_key LIMIT ?",
+                (seed, RANDOM_SEGMENT_ROWS - len(segment)),
+            )]
+        rest = [mid for mid in segment if mid not in chosen]
+        ids += random.sample(rest, min(count - len(ids), len(rest)))
+    return ids
+
+
+def sample_match(c, fts_query):
+    """Picks one random rowid from an FTS match set by counting it and stepping to a random offset, without sorting it."""
+    total = c.execute(
+        "SELECT COUNT(*) FROM media_fts WHERE media_fts MATCH ?", (fts_query,)
+    ).fetchone()[0]
+    if not total:
+        return None
+    row = c.execute(
+        "SELECT rowid FROM media_fts WHERE media_fts MATCH ? LIMIT 1 OFFSET ?",
+        (fts_query, random.randrange(total)),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def fetch_rows(c, ids):
+    """Loads full rows for ids, keeping their order."""
+    if not ids:
+        return []
+    placeholders = ",".join("?" * len(ids))
+    rows = {row["id"]: row for row in c.execute(f"SELECT * FROM media WHERE id IN ({placeholders})", ids)}
+    return [dict(rows[i]) for i in ids if i in rows]
+
+
 @bp.route("/api/files/random")
 @api_key_required
+@offload
 def random_files():
-    """Get a list of random media files."""
+    """Get a list of random media files: `count` of them (default 1, at most MAX_RANDOM_COUNT)."""
     try:
         count = int(request.args.get("count", 1))
     except ValueError:
         count = 1
-        
-    conn = get_db()
+    if not 1 <= count <= MAX_RANDOM_COUNT:
+        abort(400, description=f"count must be between 1 and {MAX_RANDOM_COUNT}")
+
+    conn = get_read_db()
     c = conn.cursor()
-    # ⚡ Bolt: Late Row Lookup optimization.
-    # Sorting only the IDs by RANDOM() is significantly faster than sorting full rows (with EXIF).
-    c.execute("""
-        SELECT m.* FROM media m
-        JOIN (SELECT id FROM media ORDER BY RANDOM() LIMIT ?) as t ON m.id = t.id
-    """, (count,))
-    items = [dict(row) for row in c.fetchall()]
+    # Sampling by id lookups stays flat as the library grows, unlike sorting every id by RANDOM()
+    items = fetch_rows(c, sample_ids(c, count))
     conn.close()
-    
+
     return jsonify(items)
 
 @bp.route("/api/random-single")
 @api_key_required
+@offload
 def random_single():
     """Get a single random media file, optionally matching a query."""
     q = request.args.get("q", "").strip()
-    
-    conn = get_db()
+
+    conn = get_read_db()
     c = conn.cursor()
-    
-    item = None
+
     if q:
-        # ⚡ Bolt: Late Row Lookup for random selection with FTS.
-        c.execute("""
-            SELECT m.*
-            FROM media m
-            JOIN (
-                SELECT rowid
-                FROM media_fts
-                WHERE media_fts MATCH ?
-                ORDER BY RANDOM()
-                LIMIT 1
-            ) as t ON m.id = t.rowid
-        """, (f'{q}*',))
-        item = c.fetchone()
+        mid = sample_match(c, f'{q}*')
+        items = fetch_rows(c, [mid] if mid is not None else [])
     else:
-        # ⚡ Bolt: Late Row Lookup for random selection from entire library.
-        c.execute("""
-            SELECT m.* FROM media m
-            JOIN (SELECT id FROM media ORDER BY RANDOM() LIMIT 1) as t ON m.id = t.id
-        """)
-        item = c.fetchone()
-        
+        items = fetch_rows(c, sample_ids(c, 1))
+
     conn.close()
-    
-    if not item:
+
+    if not items:
         return jsonify({"error": "No media found matching that query."}), 404
-        
-    return jsonify([dict(item)])
\ No newline at end of file
+
+    return jsonify(items)
@@ -1,5 +1,6 @@
 # In api/app/scanner.py
 import os
+import shutil
 import sqlite3
 import logging
 import subprocess
@@ -7,7 +8,9 @@ import json
 import concurrent.futures
 import time  # Import the time module
 from app.db import DB_PATH, init_db
-from app.thumbnails import create_image_version, create_video_thumb, create_audio_thumb, THUMB_DIR
+from app.thumbnails import render_thumbnail, describe_thumbnail, THUMB_DIR, THUMB_SIZE, GENERATION_BUDGET
+from app.large_images import estimate_decode_bytes
+from app.folders import assign_folders, prune_folders
 from PIL import Image
 from PIL.PngImagePlugin import PngInfo
 import piexif
@@ -204,6 +207,9 @@ def scan(limit=None):
         # Actually safer to just check if we have nothing to process and limit was set.
         # If limit was NOT set, we still might need to delete.
         if limit is not None or not (db_paths - all_disk_paths):
+             # Rows from before the folders table existed still need their folder
+             if assign_folders(c):
+                 conn.commit()
              logger.info("No new/modified files and no deletions pending. Scan complete.")
              conn.close()
              return
@@ -292,6 +298,7 @@ def scan(limit=None):
                     if len(files_to_add) >= BATCH_SIZE:
                         logger.info(f"Batch inserting {len(files_to_add)} files...")
                         c.executemany("INSERT INTO media (path, filename, type, size, mtime, user_comment, width, height, exif, group_tag) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", files_to_add)
+                        assign_folders(c)
                         conn.commit()
                         files_to_add.clear() # <--- FREE RAM
                         
@@ -311,6 +318,8 @@ def scan(limit=None):
     if files_to_add:
         logger.info(f"Adding final {len(files_to_add)} new files...")
         c.executemany("INSERT INTO media (path, filename, type, size, mtime, user_comment, width, height, exif, group_tag) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", files_to_add)
+    # Also backfills rows from before the folders table existed
+    assign_folders(c)
 
     if files_to_update:
         logger.info(f"Updating final {len(files_to_update)} existing files...")
@@ -323,6 +332,7 @@ def scan(limit=None):
         if paths_to_delete:
             logger.info(f"Removing {len(paths_to_delete)} deleted files...")
             c.executemany("DELETE FROM media WHERE path=?", [(path,) for path in paths_to_delete])
+            prune_folders(c)
 
     logger.info("Committing changes...")
     conn.commit()
@@ -379,6 +389,7 @@ def process_single_file(path):
                     "INSERT INTO media (path, filename, type, size, mtime, user_comment, width, height, exif, group_tag) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
                     (path, filename, ftype, stat.st_size, stat.st_mtime, user_comment, width, height, exif, group_tag)
                 )
+                assign_folders(c)
                 logger.info(f"Inserted new media record for: {path}")
             conn.commit()
         finally:
@@ -397,7 +408,9 @@ def delete_single_file(path):
     Removes a media record (and its thumbnail) from the database.
     Used by the real-time watchdog watcher when a file deletion is detected.
     """
-    from app.thumbnails import THUMB_DIR
+    from app.thumbnails import THUMB_DIR, get_preview_path
+    from app.tiles import TILE_DIR
+    from app.display import get_display_path
     try:
         conn = sqlite3.connect(DB_PATH)
         try:
@@ -407,14 +420,16 @@ def delete_single_file(path):
             if row:
                 media_id = row[0]
                 c.execute("DELETE FROM media WHERE path=?", (path,))
+                prune_folders(c)
                 conn.commit()
                 logger.info(f"Deleted media record for: {path} (id={media_id})")
                 # Clean up associated thumbnail(s)
-                for ext in (".jpg", ".gif"):
-                    thumb_path = os.path.join(THUMB_DIR, f"{media_id}{ext}")
+                thumb_paths = [os.path.join(THUMB_DIR, f"{media_id}{ext}") for ext in (".jpg", ".gif")]
+                for thumb_path in thumb_paths + [get_preview_path(media_id), get_display_path(media_id)]:
                     if os.path.exists(thumb_path):
                         os.remove(thumb_path)
                         logger.info(f"Deleted thumbnail: {thumb_path}")
+                shutil.rmtree(os.path.join(TILE_DIR, str(media_id)), ignore_errors=True)
             else:
                 logger.debug(f"Delete event for unknown path (not in DB): {path}")
         finally:
@@ -422,69 +437,163 @@ def delete_single_file(path):
     except Exception as e:
         logger.error(f"Failed to delete record for {path}: {e}", exc_info=True)
 
+def get_thumb_path(mid, src, ftype):
+    """Returns the thumbnail path the API serves for a media item."""
+    # Audio and Video thumbs are always .jpg
+    if ftype in ("audio", "video") or not src.lower().endswith(".gif"):
+        return os.path.join(THUMB_DIR, f"{mid}.jpg")
+    return os.path.join(THUMB_DIR, f"{mid}.gif")
+
+
+def record_thumbnails(results):
+    """Stores (render result, media_id) pairs from render_thumbnail() in one transaction."""
+    if not results:
+        return
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        conn.executemany(
+            "UPDATE media SET thumb_state=?, lqip=?, dominant_color=? WHERE id=?",
+            [(r["thumb_state"], r["lqip"], r["dominant_color"], media_id) for r, media_id in results]
+        )
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        logger.error(f"Database error while recording thumbnail states: {e}")
+
+
+def generate_thumbnails(missing_items, max_workers=2):
+    """Renders a list of (row, dst) pairs in parallel and records their thumb_state and placeholders."""
+    def process_thumb(item):
+        row, dst_path = item
+        src_path = row['path']
+        f_type = row['type']
+        media_id = row['id']
+        
+        if not os.path.exists(src_path):
+            return None # Original file deleted, skip
+            
+        # Block until the memory budget can take this file's estimated decoded size
+        cost = estimate_decode_bytes(src_path, f_type, row.get('width'), row.get('height'), THUMB_SIZE)
+        GENERATION_BUDGET.acquire(cost)
+        try:
+            return (render_thumbnail(src_path, f_type, dst_path, media_id), media_id)
+        except Exception as e:
+            logger.error(f"Failed to precompute thumb for media ID {media_id}: {e}")
+            return None
+        finally:
+            GENERATION_BUDGET.release(cost)
+            
+    # Use ThreadPoolExecutor to speed up generation, especially for many images
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = [result for result in executor.map(process_thumb, missing_items) if result]
+    record_thumbnails(results)
+
+
+def process_thumbnail_queue(batch_size=8):
+    """
+    Generates thumbnails the API asked for but could not render itself, most recent request first.
+    Returns True if the queue had entries.
+    """
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        conn.row_factory = sqlite3.Row
+        c = conn.cursor()
+        c.execute("""
+            SELECT q.media_id, m.id, m.path, m.type, m.width, m.height, m.thumb_state
+            FROM thumbnail_queue q
+            LEFT JOIN media m ON m.id = q.media_id
+            ORDER BY q.requested_at DESC
+            LIMIT ?
+        """, (batch_size,))
+        rows = c.fetchall()
+        conn.close()
+    except Exception as e:
+        logger.error(f"Database error while reading the thumbnail queue: {e}")
+        return False
+
+    if not rows:
+        return False
+
+    missing_items = []
+    for row in rows:
+        if row['id'] is None or row['thumb_state'] == 'placeholder':
+            continue # Media was deleted after being queued, or uses a shared placeholder
+        dst = get_thumb_path(row['id'], row['path'], row['type'])
+        if not os.path.exists(dst):
+            missing_items.append((dict(row), dst))
+
+    if missing_items:
+        logger.info(f"Generating {len(missing_items)} requested thumbnails from the priority queue...")
+        generate_thumbnails(missing_items)
+
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        conn.executemany("DELETE FROM thumbnail_queue WHERE media_id=?", [(row['media_id'],) for row in rows])
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        logger.error(f"Database error while clearing the thumbnail queue: {e}")
+    return True
+
+
+def thumbnail_queue_pending():
+    """Cheap check used by the scanner service to wake up early for queued requests."""
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        row = conn.execute("SELECT 1 FROM thumbnail_queue LIMIT 1").fetchone()
+        conn.close()
+        return row is not None
+    except Exception:
+        return False
+
+
+# Id below which the next precompute batch starts, so rows that stay unresolved (source gone
+# until the next scan) cannot hold back the rest; None starts again from the newest
+_precompute_cursor = None
+
+
 def precompute_missing_thumbnails(batch_size=50):
     """
     Finds missing thumbnails in the background and generates them.
     Returns True if some thumbnails were missing, False if all caught up.
     """
+    global _precompute_cursor
     try:
         conn = sqlite3.connect(DB_PATH)
         conn.row_factory = sqlite3.Row
         c = conn.cursor()
         
-        # Query media, ordered by ID DESC to prioritize new files
-        c.execute("SELECT id, path, type FROM media ORDER BY id DESC")
+        # Query unresolved media only (partial index), ordered by ID DESC to prioritize new files.
+        # At most batch_size rows per call, already generated ones included, so the service loop
+        # gets back to the priority queue between batches.
+        below = "AND id < ?" if _precompute_cursor is not None else ""
+        c.execute(
+            f"SELECT id, path, type, width, height FROM media WHERE thumb_state IS NULL {below} ORDER BY id DESC LIMIT ?",
+            (*((_precompute_cursor,) if below else ()), batch_size),
+        )
+        rows = c.fetchall()
+        _precompute_cursor = rows[-1]['id'] if len(rows) == batch_size else None
         
         missing_items = []
-        for row in c:
-            mid = row['id']
-            src = row['path']
-            ftype = row['type']
-            
-            is_gif = src.lower().endswith(".gif")
-            thumb_ext = ".gif" if is_gif else ".jpg"
-            dst = os.path.join(THUMB_DIR, f"{mid}{thumb_ext}")
-            
-            # Audio and Video thumbs are always .jpg
-            if ftype in ("audio", "video"):
-                dst = os.path.join(THUMB_DIR, f"{mid}.jpg")
-
-            if not os.path.exists(dst):
+        already_present = []
+        for row in rows:
+            dst = get_thumb_path(row['id'], row['path'], row['type'])
+            if os.path.exists(dst):
+                # Generated before thumb_state existed; only the inline placeholders are missing
+                lqip, dominant_color = describe_thumbnail(dst)
+                already_present.append(({"thumb_state": "ready", "lqip": lqip, "dominant_color": dominant_color}, row['id']))
+            else:
                 missing_items.append((dict(row), dst))
-                if len(missing_items) >= batch_size:
-                    break
-                    
+
         conn.close()
     except Exception as e:
         logger.error(f"Database error while fetching media for thumbnails: {e}")
         return False
-                
+
+    record_thumbnails(already_present)
     if not missing_items:
-        return False
+        return bool(already_present)
         
     logger.info(f"Precomputing thumbnails for {len(missing_items)} missing items...")
-    
-    def process_thumb(item):
-        row, dst_path = item
-        src_path = row['path']
-        f_type = row['type']
-        media_id = row['id']
-        
-        if not os.path.exists(src_path):
-            return # Original file deleted, skip
-            
-        try:
-            if f_type == "image":
-                 create_image_version(src_path, dst_path, size=(600, 600), quality=90)
-            elif f_type == "audio":
-                 create_audio_thumb(dst_path)
-            else:
-                 create_video_thumb(src_path, dst_path)
-        except Exception as e:
-            logger.error(f"Failed to precompute thumb for media ID {media_id}: {e}")
-            
-    # Use ThreadPoolExecutor to speed up generation, especially for many images
-    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-        list(executor.map(process_thumb, missing_items))
-        
+    generate_thumbnails(missing_items)
     return True
@@ -1,31 +1,126 @@
-from flask import Blueprint, request, jsonify
+import base64
+import binascii
+import json
 import sqlite3
-from app.db import DB_PATH
+from flask import Blueprint, request, jsonify, abort
+from app.db import get_read_db
 from app.api_key_middleware import api_key_required
+from app.offload import offload
+from app.media import parse_fields, row_to_item
 
 search_bp = Blueprint("search", __name__)
+
+# bm25 weights of the media_fts columns (filename, user_comment, exif): a hit in the filename or
+# a comment says more about an item than one somewhere in a long generation prompt.
+BM25_WEIGHTS = (10.0, 5.0, 1.0)
+SEARCH_FIELDS = ("id", "filename", "type", "user_comment")
+DEFAULT_SEARCH_LIMIT = 100
+MAX_SEARCH_LIMIT = 200
+# snippet() settings: highlight markers, ellipsis, and tokens of context
+SNIPPET_MARKERS = ("[", "]")
+SNIPPET_TOKENS = 12
+
+
+def prefix_query(q):
+    """
+    FTS5 query matching items that contain a word starting with each term of q. Terms are
+    quoted, so punctuation in them is searched for rather than parsed as query syntax.
+    """
+    terms = [t.replace('"', '""') for t in q.split()]
+    return " ".join(f'"{t}"*' for t in terms)
+
+
+def _encode_cursor(score, mid):
+    raw = json.dumps([score, mid], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor):
+    try:
+        score, mid = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError, TypeError):
+        abort(400, description="Invalid cursor")
+    if not isinstance(score, (int, float)) or not isinstance(mid, int):
+        abort(400, description="Invalid cursor")
+    return score, mid
+
+
 @search_bp.route("/api/search")
 @api_key_required
+@offload
 def search():
+    """
+    Full-text search over filename, comment and exif, best matches first (bm25). Each term
+    matches as a word prefix. Optional `group` and `type` filters; `fields=` as for the gallery;
+    every item carries a `snippet` of its best matching column with hits in [brackets].
+
+    The response is a bare list of items, as it always was. With `paged=true` (implied by
+    `cursor`) it is {"items", "next_cursor"} instead, and `next_cursor` passed back as `cursor`
+    continues after the last item.
+    """
     q = request.args.get("q", "").strip()
     if not q:
         return jsonify({"error": "Missing search query"}), 400
+    limit = max(1, min(request.args.get("limit", DEFAULT_SEARCH_LIMIT, type=int), MAX_SEARCH_LIMIT))
+    group = request.args.get("group", "")
+    media_type = request.args.get("type", "")
+    cursor = request.args.get("cursor")
+    paged = bool(cursor) or request.args.get("paged", "false").lower() == "true"
+    fields = parse_fields(default=SEARCH_FIELDS)
+    match = prefix_query(q)
+
+    # Scoring and filtering happen in one statement: the FTS match drives it, each hit is
+    # checked against the filters by rowid, and only the page is sorted out of the survivors.
+    conditions, params = [], [match]
+    if group:
+        conditions.append("m.group_tag = ?")
+        params.append(group)
+    if media_type:
+        conditions.append("m.type = ?")
+        params.append(media_type)
+    if cursor:
+        # bm25 scores are negative, lower is better; (score, id) orders ties deterministically
+        conditions.append("(s.score, s.id) > (?, ?)")
+        params += _decode_cursor(cursor)
+    where_sql = "WHERE " + " AND ".join(conditions) if conditions else ""
+
+    conn = get_read_db()
+    try:
+        rows = conn.execute(f"""
+            SELECT {", ".join(f"m.{f}" for f in fields)}, s.score
+            FROM (
+                SELECT rowid AS id, bm25(media_fts, {", ".join(map(str, BM25_WEIGHTS))}) AS score
+                FROM media_fts WHERE media_fts MATCH ?
+            ) s
+            JOIN media m ON m.id = s.id
+            {where_sql}
+            ORDER BY s.score, s.id
+            LIMIT ?
+        """, (*params, limit)).fetchall()
+
+        # Snippets are built for the page only, not for every match that was ranked
+        snippets = {}
+        if rows:
+            ids = [row["id"] for row in rows]
+            snippets = dict(conn.execute(f"""
+                SELECT rowid, snippet(media_fts, -1, ?, ?, '…', ?)
+                FROM media_fts WHERE media_fts MATCH ? AND rowid IN ({",".join("?" * len(ids))})
+            """, (*SNIPPET_MARKERS, SNIPPET_TOKENS, match, *ids)).fetchall())
+    except sqlite3.OperationalError as e:
+        # Malformed FTS input that quoting did not neutralise
+        abort(400, description=f"Invalid search query: {e}")
+    finally:
+        conn.close()
+
+    items = []
+    for row in rows:
+        item = row_to_item(row, fields)
+        item["snippet"] = snippets.get(row["id"], "")
+        items.append(item)
 
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-
-    # ⚡ Bolt: Optimized search using FTS5 and fixed parameter binding mismatch.
-    # Expected impact: Reduces search latency from O(N) to O(log N) using the FTS5 index.
-    # Fixes a bug where 3 placeholders were used with only 1 parameter.
-    c.execute("""
-        SELECT m.id, m.filename, m.type, m.user_comment
-        FROM media_fts f
-        JOIN media m ON m.id = f.rowid
-        WHERE media_fts MATCH ?
-        LIMIT 100
-    """, (f'{q}*',))
-    results = [dict(r) for r in c.fetchall()]
-    conn.close()
-
-    return jsonify(results)
\ No newline at end of file
+    if not paged:
+        return jsonify(items)
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = _encode_cursor(rows[-1]["score"], rows[-1]["id"])
+    return jsonify({"items": items, "next_cursor": next_cursor})
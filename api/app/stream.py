@@ -1,59 +1,163 @@
-import mimetypes
 import os
-from flask import Blueprint, request, Response, abort, send_file
-from app.db import get_db
+import uuid
+from datetime import datetime, timezone
+from urllib.parse import quote
+from zlib import adler32
+from flask import Blueprint, request, Response, abort
+from werkzeug.http import is_resource_modified
+from werkzeug.wsgi import wrap_file
+from app.db import GALLERY_PATH
+from app.file_cache import get_media_file
 from app.auth_middleware import login_required
 from app.api_key_middleware import api_key_required
+from app.offload import offload
 
 stream_bp = Blueprint("stream", __name__)
 
-CHUNK_SIZE = 8192
+CHUNK_SIZE = 256 * 1024
+# More ranges than this in one request are ignored and the whole file is sent instead
+MAX_RANGES = 16
+# When set (e.g. "/_protected_media"), responses only name the file in X-Accel-Redirect and
+# nginx serves it from an internal location aliasing the gallery (see portal/nginx.conf),
+# handling ranges, conditionals and sendfile itself. Only for deployments behind that nginx.
+ACCEL_PREFIX = os.environ.get("STREAM_ACCEL_PREFIX", "").rstrip("/")
 
-def generate_range_response(path, start, end):
+def parse_ranges(header, size):
+    """
+    Byte ranges of a Range header as inclusive (start, end) pairs. None when the header is
+    absent or malformed (serve the whole file); [] when no range is satisfiable (416).
+    Handles "a-b", open-ended "a-" and suffix "-n" specs.
+    """
+    if not header:
+        return None
+    units, _, specs = header.partition("=")
+    if units.strip().lower() != "bytes":
+        return None
+    specs = [s.strip() for s in specs.split(",") if s.strip()]
+    if not specs or len(specs) > MAX_RANGES:
+        return None
+    ranges = []
+    for spec in specs:
+        first, dash, last = spec.partition("-")
+        if not dash:
+            return None
+        try:
+            if not first:
+                suffix = int(last)
+                if suffix > 0 and size > 0:
+                    ranges.append((max(0, size - suffix), size - 1))
+                continue
+            start = int(first)
+            end = int(last) if last else None
+        except ValueError:
+            return None
+        if start < 0 or (end is not None and end < start):
+            return None
+        if start < size:
+            ranges.append((start, size - 1 if end is None else min(end, size - 1)))
+    return ranges
+
+def generate_range_response(path, ranges, boundary=None, mime_type=None, size=None):
+    """Reads the ranges of a file; with a boundary, as multipart/byteranges parts."""
     with open(path, "rb") as f:
-        f.seek(start)
-        while start <= end:
-            data = f.read(min(CHUNK_SIZE, end - start + 1))
-            if not data:
-                break
-            yield data
-            start += len(data)
+        for start, end in ranges:
+            if boundary:
+                yield (
+                    f"\r\n--{boundary}\r\nContent-Type: {mime_type}\r\n"
+                    f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+                ).encode()
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                data = f.read(min(CHUNK_SIZE, remaining))
+                if not data:
+                    break
+                yield data
+                remaining -= len(data)
+        if boundary:
+            yield f"\r\n--{boundary}--\r\n".encode()
+
+def _multipart_length(ranges, boundary, mime_type, size):
+    length = len(f"\r\n--{boundary}--\r\n")
+    for start, end in ranges:
+        length += len(
+            f"\r\n--{boundary}\r\nContent-Type: {mime_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+        ) + end - start + 1
+    return length
+
+def _file_from(path, start):
+    """The file from `start` to its end as a wsgi.file_wrapper, which servers send with sendfile."""
+    f = open(path, "rb")
+    f.seek(start)
+    return wrap_file(request.environ, f, CHUNK_SIZE)
 
 @stream_bp.route("/api/stream/<int:media_id>")
 @api_key_required
 @login_required
+@offload
 def stream(media_id):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT path FROM media WHERE id=?", (media_id,))
-    row = c.fetchone()
-    conn.close()
-    if not row:
+    """
+    Streams an original file with HTTP range support: single, multiple (multipart/byteranges)
+    and suffix ranges, If-Range, 416 for unsatisfiable ranges, and conditional GETs (304).
+    """
+    media = get_media_file(media_id)
+    if media is None:
         abort(404)
+    file_path, mime_type = media.path, media.mime
 
-    file_path = row["path"]
-    if not os.path.exists(file_path):
-        abort(404)
+    if ACCEL_PREFIX and file_path.startswith(GALLERY_PATH + "/"):
+        response = Response(mimetype=mime_type)
+        response.headers["X-Accel-Redirect"] = ACCEL_PREFIX + quote(file_path[len(GALLERY_PATH):])
+        return response
+
+    size = media.size
+    last_modified = datetime.fromtimestamp(int(media.mtime), timezone.utc)
+    etag = f"{media.mtime}-{size}-{adler32(file_path.encode()) & 0xFFFFFFFF}"
+
+    # If-Range: only honour the ranges if the client's copy is still the current file
+    ranges = parse_ranges(request.headers.get("Range"), size)
+    if ranges is not None and "If-Range" in request.headers:
+        if_range = request.if_range
+        if if_range.etag is not None:
+            current = if_range.etag == etag
+        else:
+            current = if_range.date == last_modified
+        if not current:
+            ranges = None
+
+    if ranges is None and not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    if ranges == []:
+        response = Response(status=416)
+        response.headers["Content-Range"] = f"bytes */{size}"
+    elif ranges is None:
+        response = Response(_file_from(file_path, 0), mimetype=mime_type, direct_passthrough=True)
+        response.content_length = size
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        if end == size - 1:
+            # Open-ended (the usual video seek): the file wrapper lets the server sendfile it
+            body = _file_from(file_path, start)
+        else:
+            body = generate_range_response(file_path, ranges)
+        response = Response(body, status=206, mimetype=mime_type, direct_passthrough=True)
+        response.headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response.content_length = end - start + 1
+    else:
+        boundary = uuid.uuid4().hex
+        response = Response(
+            generate_range_response(file_path, ranges, boundary, mime_type, size),
+            status=206,
+            mimetype=f"multipart/byteranges; boundary={boundary}",
+            direct_passthrough=True,
+        )
+        response.content_length = _multipart_length(ranges, boundary, mime_type, size)
 
-    mime_type, _ = mimetypes.guess_type(file_path)
-    file_size = os.path.getsize(file_path)
-
-    range_header = request.headers.get("Range", None)
-    if not range_header:
-        return send_file(file_path, mimetype=mime_type)
-
-    # Parse Range header
-    range_match = range_header.strip().split("=")[-1]
-    start, end = range_match.split("-")
-    start = int(start)
-    end = int(end) if end else file_size - 1
-
-    response = Response(
-        generate_range_response(file_path, start, end),
-        status=206,
-        mimetype=mime_type,
-        direct_passthrough=True,
-    )
-    response.headers.add("Content-Range", f"bytes {start}-{end}/{file_size}")
-    response.headers.add("Accept-Ranges", "bytes")
+    response.headers["Accept-Ranges"] = "bytes"
+    response.set_etag(etag)
+    response.last_modified = last_modified
     return response
@@ -1,13 +1,25 @@
 import os
 import io
+import base64
+import time
+import uuid
+import sqlite3
 import subprocess
 import logging
 import threading
-from flask import Blueprint, send_file, abort
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from flask import Blueprint, Response, send_file, abort
 from werkzeug.exceptions import HTTPException
-from PIL import Image, ImageDraw
-from app.db import get_db
+from PIL import Image, ImageDraw, ImageOps
+from app.db import get_db, get_read_db
 from app.api_key_middleware import api_key_required
+from app.offload import offload, run_blocking, path_exists
+from app.media import parse_ids
+from app.file_cache import get_media_file
+from app.large_images import LARGE_IMAGE_PIXELS, MemoryBudget, estimate_decode_bytes, thumbnail_png_in_strips
 
 # Suppress DecompressionBombWarning and allow massive AI grids (e.g. 167+ megapixel PNGs)
 Image.MAX_IMAGE_PIXELS = None
@@ -18,15 +30,50 @@ bp = Blueprint("thumbnails", __name__)
 # Define directories for thumbnails
 THUMB_DIR = "/app/data/thumbs"
 os.makedirs(THUMB_DIR, exist_ok=True)
-GENERATION_SEMAPHORE = threading.Semaphore(4)
+PREVIEW_DIR = "/app/data/previews"
+os.makedirs(PREVIEW_DIR, exist_ok=True)
+THUMB_SIZE = (600, 600)
+# Long edge of the blurred inline placeholder returned with gallery items
+LQIP_SIZE = 16
+
+# Animated hover previews for videos (low-res WebP built from keyframes), off by default
+VIDEO_PREVIEWS = os.getenv("VIDEO_PREVIEWS", "false").lower() == "true"
+PREVIEW_WIDTH = 240
+PREVIEW_FRAMES = 12
+PREVIEW_FPS = 2
+
+# Animated GIFs get a small animated WebP preview so hovering never pulls the original.
+# Cost is bounded per file: sampled frames, decode time and output size are all capped.
+GIF_PREVIEWS = os.getenv("GIF_PREVIEWS", "true").lower() == "true"
+GIF_PREVIEW_FRAMES = 24
+GIF_PREVIEW_TIME_LIMIT = 10  # seconds
+GIF_PREVIEW_MAX_BYTES = 1024 * 1024
+
+# On-demand generation runs in a per-worker process pool so Pillow/ffmpeg never block
+# the gevent loop. The semaphore caps in-flight generations at the pool size.
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", 4))
+GENERATION_SEMAPHORE = threading.Semaphore(THUMBNAIL_WORKERS)
+# Generations are also admitted by their estimated decoded size, so a handful of gigapixel
+# grids cannot exhaust memory even when slots are free.
+GENERATION_BUDGET = MemoryBudget(int(os.getenv("THUMBNAIL_MEMORY_BUDGET_MB", 1024)) * 1024 * 1024)
+# Upper bound on thumbnails in one /api/thumbnails/batch response
+MAX_THUMB_BATCH = 100
+# How long a request waits for a generation (its own or one already in flight) to finish
+GENERATION_WAIT_TIMEOUT = 30
+
+_pool = None
+_pool_pid = None
+_inflight = {}  # job key -> Future of the generation currently running for it
+_inflight_lock = threading.Lock()
 
 def create_image_version(src, dst, size, quality):
-    """Creates a resized and compressed version of an image or GIF."""
+    """Creates a resized and compressed version of an image or GIF. Returns False on failure."""
     try:
         logger.info(f"Creating image version for: {src} at size {size}")
         
         # Determine output format based on destination extension
-        output_format = "JPEG" if dst.lower().endswith(".jpg") else "GIF"
+        ext = os.path.splitext(dst)[1].lower()
+        output_format = {".jpg": "JPEG", ".webp": "WEBP"}.get(ext, "GIF")
         
         with Image.open(src) as im:
             # Handle animated GIFs - create a static thumbnail from the first frame
@@ -43,93 +90,322 @@ def create_image_version(src, dst, size, quality):
                             first_frame.save(dst, format="GIF")
             else:
                 # Handle non-animated images (including static GIFs)
-                # ⚡ Bolt: Massive memory optimization for huge JPEGs
-                # This instructs libjpeg to decode the image at a lower resolution natively,
-                # saving gigabytes of RAM when processing extremely large images.
-                if im.format in ("JPEG", "MPO"):
-                    im.draft('RGB', size)
-                im.thumbnail(size)
+                strip_thumb = None
+                if im.format == "PNG" and im.width * im.height > LARGE_IMAGE_PIXELS:
+                    # Gigapixel PNG grids are decoded in row strips so only a slice is in memory
+                    strip_thumb = thumbnail_png_in_strips(src, size)
+                if strip_thumb is not None:
+                    im = strip_thumb
+                else:
+                    # ⚡ Bolt: Massive memory optimization for huge JPEGs
+                    # This instructs libjpeg to decode the image at a lower resolution natively,
+                    # saving gigabytes of RAM when processing extremely large images.
+                    if im.format in ("JPEG", "MPO"):
+                        im.draft('RGB', size)
+                    im.thumbnail(size)
+                    # Bake in the EXIF orientation: the encoded output drops the tag browsers honour
+                    im = ImageOps.exif_transpose(im)
                 # Ensure image is in a saveable format (convert images with transparency to RGB for JPEG)
                 save_kwargs = {}
+                if output_format == "WEBP":
+                    save_kwargs['quality'] = quality
+                    save_kwargs['method'] = 4
                 if output_format == "JPEG":
                     save_kwargs['quality'] = quality
                     if im.mode in ("P", "PA", "RGBA"):
                         with im.convert("RGB") as rgb_im:
                             rgb_im.save(dst, output_format, **save_kwargs)
                             logger.info(f"Successfully saved converted image version to: {dst}")
-                            return # Early exit to avoid double save
+                            return True # Early exit to avoid double save
 
                 # Save with appropriate format and options
                 im.save(dst, output_format, **save_kwargs)
 
         logger.info(f"Successfully saved image version to: {dst}")
+        return True
     except Exception as e:
         logger.error(f"Failed to create image version for {src}: {e}", exc_info=True)
-        logger.info(f"Creating fallback error thumbnail for {src}")
-        create_error_thumb(dst)
+        logger.info(f"Using the shared error placeholder for {src}")
+        return False
 
-def create_video_thumb(src, dst):
-    """Creates a thumbnail for a video file."""
+def create_video_thumb(src, dst, size=THUMB_SIZE, preview_dst=None):
+    """
+    Creates a thumbnail (and optionally an animated hover preview) for a video file
+    with a single ffmpeg run. Returns False if no thumbnail could be extracted.
+    """
     try:
         logger.info(f"Creating video thumbnail for: {src}")
-        # Moving -ss before -i for Input Seeking (much faster)
-        subprocess.run(
-            ["ffmpeg", "-y", "-ss", "00:00:01.000", "-i", src, "-vframes", "1", "-strict", "unofficial", dst],
-            check=False, capture_output=True, text=True
-        )
-        
-        # Fallback for short videos if 1s target failed to create file
-        if not os.path.exists(dst):
-                logger.info(f"Thumbnail at 1s failed (likely short video), trying at 0s for: {src}")
-                subprocess.run(
-                    ["ffmpeg", "-y", "-ss", "00:00:00.000", "-i", src, "-vframes", "1", "-strict", "unofficial", dst],
-                    check=True, capture_output=True, text=True
-                )
+        # Decode keyframes only: no inter-frame decoding work, and no seek that can land past
+        # the end of short clips. 'thumbnail' picks the most representative of the first few
+        # keyframes (skipping black intros), and the scale happens in the same pass so a 4K
+        # source never produces a full-resolution JPEG.
+        width, height = size
+        scale = f"scale={width}:{height}:force_original_aspect_ratio=decrease"
+        cmd = ["ffmpeg", "-y", "-v", "error", "-skip_frame", "nokey", "-i", src]
+        if preview_dst:
+            preview_scale = f"scale={PREVIEW_WIDTH}:-2"
+            cmd += [
+                "-filter_complex",
+                f"[0:v:0]split=2[t][p];[t]thumbnail=3,{scale}[thumb];"
+                f"[p]{preview_scale},setpts=N/({PREVIEW_FPS}*TB)[preview]",
+                "-map", "[thumb]", "-frames:v", "1", "-strict", "unofficial", dst,
+                "-map", "[preview]", "-frames:v", str(PREVIEW_FRAMES), "-loop", "0", "-q:v", "50", preview_dst,
+            ]
+        else:
+            cmd += ["-map", "0:v:0", "-vf", f"thumbnail=3,{scale}", "-frames:v", "1", "-strict", "unofficial", dst]
+
+        result = subprocess.run(cmd, check=False, capture_output=True, text=True, timeout=120)
 
         if os.path.exists(dst):
             logger.info(f"Successfully saved video thumbnail to: {dst}")
-        else:
-            logger.warning(f"ffmpeg completed but no file created for {src}. Creating error placeholder.")
-            create_error_thumb(dst)
-    except subprocess.CalledProcessError as e:
-        logger.error(f"ffmpeg failed for {src}: {e.stderr}")
-        logger.info(f"Creating fallback error thumbnail for {src}")
-        create_error_thumb(dst)
-
-def create_error_thumb(dst):
-    """Creates a placeholder thumbnail for corrupted or unreadable files."""
+            return True
+        logger.warning(f"ffmpeg created no thumbnail for {src}: {result.stderr.strip()}. Using the shared error placeholder.")
+    except subprocess.TimeoutExpired:
+        logger.error(f"ffmpeg timed out for {src}. Using the shared error placeholder.")
+    return False
+
+def create_gif_preview(src, dst, size=(PREVIEW_WIDTH, PREVIEW_WIDTH)):
+    """
+    Builds a small animated WebP from at most GIF_PREVIEW_FRAMES evenly sampled frames of an
+    animated GIF. Returns False for static GIFs or if the preview would exceed its caps.
+    """
+    deadline = time.monotonic() + GIF_PREVIEW_TIME_LIMIT
     try:
-        # Create a 600x600 dark red square using a context manager
-        with Image.new('RGB', (600, 600), color=(50, 0, 0)) as img:
-            d = ImageDraw.Draw(img)
-            # Draw a cross
-            d.line([(150, 150), (450, 450)], fill=(200, 50, 50), width=20)
-            d.line([(450, 150), (150, 450)], fill=(200, 50, 50), width=20)
-            output_format = "JPEG" if dst.lower().endswith(".jpg") else "GIF"
-            img.save(dst, output_format, quality=90) if output_format == "JPEG" else img.save(dst, output_format)
-            logger.info(f"Successfully saved error thumbnail to: {dst}")
-    except Exception as eval_e:
-        logger.error(f"Failed to create error thumbnail: {eval_e}", exc_info=True)
-def create_audio_thumb(dst):
-    """Creates a placeholder thumbnail for audio files."""
+        with Image.open(src) as im:
+            frame_count = getattr(im, "n_frames", 1)
+            if frame_count < 2:
+                return False
+            step = -(-frame_count // GIF_PREVIEW_FRAMES)
+            frames, durations = [], []
+            for index in range(0, frame_count, step):
+                if time.monotonic() > deadline:
+                    logger.info(f"GIF preview for {src} cut short at {len(frames)} frames (time limit)")
+                    break
+                # GIF frames are deltas, so seeking still decodes the skipped frames, but
+                # only the sampled ones are converted, scaled and kept in memory
+                im.seek(index)
+                frame = im.convert("RGBA")
+                frame.thumbnail(size)
+                frames.append(frame)
+                # Stretch each kept frame over the ones skipped to keep the original pace
+                durations.append(im.info.get("duration", 100) * min(step, frame_count - index))
+            if len(frames) < 2:
+                return False
+            frames[0].save(dst, "WEBP", save_all=True, append_images=frames[1:],
+                           duration=durations, loop=0, quality=50, method=4)
+        if os.path.getsize(dst) > GIF_PREVIEW_MAX_BYTES:
+            logger.info(f"GIF preview for {src} exceeds {GIF_PREVIEW_MAX_BYTES} bytes, discarding")
+            os.remove(dst)
+            return False
+        logger.info(f"Successfully saved GIF preview to: {dst}")
+        return True
+    except Exception as e:
+        logger.warning(f"Failed to create GIF preview for {src}: {e}")
+        return False
+
+def create_audio_thumb(src, dst, size=THUMB_SIZE):
+    """
+    Extracts embedded cover art from an audio file as its thumbnail.
+    Returns False if the file has none, in which case the shared audio placeholder is used.
+    """
+    width, height = size
     try:
-        # Create a 600x600 dark grey square using a context manager
-        with Image.new('RGB', (600, 600), color=(50, 50, 50)) as img:
-            d = ImageDraw.Draw(img)
-            # We can't easily rely on fonts being present, so just draw a simple shape
-            # Draw a lighter grey circle in the middle
-            d.ellipse([150, 150, 450, 450], fill=(100, 100, 100))
-            img.save(dst, "JPEG", quality=90)
-            logger.info(f"Successfully saved audio thumbnail to: {dst}")
+        subprocess.run(
+            ["ffmpeg", "-y", "-v", "error", "-i", src, "-map", "0:v:0", "-frames:v", "1",
+             "-vf", f"scale={width}:{height}:force_original_aspect_ratio=decrease",
+             "-strict", "unofficial", dst],
+            check=False, capture_output=True, text=True, timeout=30
+        )
+    except subprocess.TimeoutExpired:
+        logger.warning(f"ffmpeg timed out extracting cover art from {src}")
+    if os.path.exists(dst):
+        logger.info(f"Successfully saved audio cover art to: {dst}")
+        return True
+    return False
+
+def temp_path(dst):
+    root, ext = os.path.splitext(dst)
+    # Keep the real extension last: the encoders pick the output format from it
+    return f"{root}.{uuid.uuid4().hex}.tmp{ext}"
+
+def get_preview_path(mid):
+    return os.path.join(PREVIEW_DIR, f"{mid}.webp")
+
+def has_preview(src, ftype):
+    """Whether a hover preview is rendered alongside this item's thumbnail."""
+    if ftype == "video":
+        return VIDEO_PREVIEWS
+    return ftype == "image" and GIF_PREVIEWS and src.lower().endswith(".gif")
+
+def describe_thumbnail(path):
+    """
+    Computes the inline placeholders for a rendered thumbnail: a 16px WebP data URI (LQIP)
+    and the dominant colour as #rrggbb. Returns (None, None) if the file can't be read.
+    """
+    try:
+        with Image.open(path) as im:
+            with im.convert("RGB") as rgb:
+                small = rgb.copy()
+                small.thumbnail((LQIP_SIZE, LQIP_SIZE))
+                buf = io.BytesIO()
+                small.save(buf, "WEBP", quality=40, method=4)
+                lqip = "data:image/webp;base64," + base64.b64encode(buf.getvalue()).decode("ascii")
+                # Most common of a few palette colours, which tracks the dominant hue better than a mean
+                with rgb.resize((64, 64), Image.BILINEAR).quantize(colors=4) as quantized:
+                    count, index = max(quantized.getcolors())
+                    palette = quantized.getpalette()
+                    r, g, b = palette[index * 3:index * 3 + 3]
+        return lqip, f"#{r:02x}{g:02x}{b:02x}"
     except Exception as e:
-        logger.error(f"Failed to create audio thumbnail: {e}", exc_info=True)
-        raise
+        logger.warning(f"Could not compute placeholders for {path}: {e}")
+        return None, None
 
-def get_media_row(media_id):
-    """Fetches a media record from the database by its ID."""
+def render_thumbnail(src, ftype, dst, mid=None):
+    """
+    Renders the thumbnail for one media item into a temp file and atomically renames it to dst,
+    so readers never see a half-written file. Runs in the API process pool and the scanner threads.
+    Returns the values to store on the media row: thumb_state ("ready", or "placeholder" if the
+    shared placeholder should be used) plus its lqip and dominant_color.
+    """
+    tmp = temp_path(dst)
+    outputs = {dst: tmp}
+    preview_tmp = None
+    if mid is not None and has_preview(src, ftype):
+        preview_tmp = temp_path(get_preview_path(mid))
+        outputs[get_preview_path(mid)] = preview_tmp
+    try:
+        if ftype == "image":
+            if create_image_version(src, tmp, size=THUMB_SIZE, quality=90) and preview_tmp:
+                create_gif_preview(src, preview_tmp)
+        elif ftype == "audio":
+            create_audio_thumb(src, tmp)
+        else:
+            create_video_thumb(src, tmp, preview_dst=preview_tmp)
+        for final, temp in outputs.items():
+            if os.path.exists(temp):
+                os.replace(temp, final)
+    finally:
+        for temp in outputs.values():
+            if os.path.exists(temp):
+                os.remove(temp)
+    if not os.path.exists(dst):
+        return {"thumb_state": "placeholder", "lqip": None, "dominant_color": None}
+    lqip, dominant_color = describe_thumbnail(dst)
+    return {"thumb_state": "ready", "lqip": lqip, "dominant_color": dominant_color}
+
+def _get_pool():
+    """Returns this worker's generation pool, creating it on first use."""
+    global _pool, _pool_pid
+    # Gunicorn forks workers after import, so each worker lazily builds its own pool.
+    # "spawn" keeps the children free of the parent's gevent hub and open sockets.
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = ProcessPoolExecutor(
+            max_workers=THUMBNAIL_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        _pool_pid = os.getpid()
+    return _pool
+
+def _reset_pool(pool):
+    """Drops a broken pool (e.g. a child was OOM-killed) so the next request starts a fresh one."""
+    global _pool
+    with _inflight_lock:
+        if _pool is not pool:
+            return  # Already replaced
+        _pool = None
+    logger.error("Thumbnail process pool broke, it will be recreated on the next request.")
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _generation_done(key, pool, cost, future):
+    with _inflight_lock:
+        _inflight.pop(key, None)
+    GENERATION_BUDGET.release(cost)
+    GENERATION_SEMAPHORE.release()
+    if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+        _reset_pool(pool)
+
+def submit_generation(key, cost, fn, *args, wait=1.0):
+    """
+    Runs fn(*args) in the generation pool and returns its future. Concurrent submissions with the
+    same key share one run. Returns None if no generation slot (or memory budget) frees up within
+    `wait` seconds.
+    """
+    with _inflight_lock:
+        future = _inflight.get(key)
+    if future is not None:
+        return future
+
+    if not GENERATION_SEMAPHORE.acquire(timeout=wait):
+        return None
+    if not GENERATION_BUDGET.acquire(cost, timeout=wait):
+        GENERATION_SEMAPHORE.release()
+        return None
+
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is not None:
+            # Another request started this key while we were waiting for a slot
+            GENERATION_BUDGET.release(cost)
+            GENERATION_SEMAPHORE.release()
+            return future
+        pool = _get_pool()
+        try:
+            future = pool.submit(fn, *args)
+        except BrokenProcessPool:
+            future = None
+        else:
+            _inflight[key] = future
+
+    if future is None:
+        GENERATION_BUDGET.release(cost)
+        GENERATION_SEMAPHORE.release()
+        _reset_pool(pool)
+        return None
+
+    future.add_done_callback(partial(_generation_done, key, pool, cost))
+    return future
+
+def request_generation(mid, src, ftype, dst, width=None, height=None):
+    """Returns a future for the thumbnail of mid, or None if the server is too busy to start one."""
+    # The estimate reads the file's header, which must not stall the event loop
+    cost = run_blocking(estimate_decode_bytes, src, ftype, width, height, THUMB_SIZE)
+    return submit_generation(("thumb", mid), cost, render_thumbnail, src, ftype, dst, mid)
+
+def _enqueue_thumbnail(mid):
+    conn = None
+    try:
+        conn = get_db()
+        conn.execute(
+            "INSERT INTO thumbnail_queue (media_id, requested_at) VALUES (?, ?) "
+            "ON CONFLICT(media_id) DO UPDATE SET requested_at = excluded.requested_at",
+            (mid, time.time()),
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.warning(f"Could not queue thumbnail for ID {mid}: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+def _record_thumbnail(mid, result):
     conn = None
     try:
         conn = get_db()
+        conn.execute(
+            "UPDATE media SET thumb_state=?, lqip=?, dominant_color=? WHERE id=?",
+            (result["thumb_state"], result["lqip"], result["dominant_color"], mid),
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.warning(f"Could not record thumbnail state for ID {mid}: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+def _get_media_row(media_id):
+    conn = None
+    try:
+        conn = get_read_db()
         c = conn.cursor()
         c.execute("SELECT * FROM media WHERE id=?", (media_id,))
         row = c.fetchone()
@@ -146,69 +422,207 @@ def get_media_row(media_id):
         if conn:
             conn.close()
 
+# Database access from the views below goes through the offload threadpool (see offload.py)
+def enqueue_thumbnail(mid):
+    """Asks the scanner service to generate a thumbnail next, ahead of its background backfill."""
+    run_blocking(_enqueue_thumbnail, mid)
+
+def record_thumbnail(mid, result):
+    """Stores the thumb_state and inline placeholders returned by render_thumbnail()."""
+    run_blocking(_record_thumbnail, mid, result)
+
+def get_media_row(media_id):
+    """Fetches a media record from the database by its ID."""
+    return run_blocking(_get_media_row, media_id)
+
+
+def get_thumb_path(mid, src):
+    """Thumbnail file of an item and its mimetype: GIF for original GIFs, JPG for the rest."""
+    if src.lower().endswith(".gif"):
+        return os.path.join(THUMB_DIR, f"{mid}.gif"), "image/gif"
+    return os.path.join(THUMB_DIR, f"{mid}.jpg"), "image/jpeg"
+
+
+@bp.route("/api/thumbnails/batch")
+@api_key_required
+@offload
+def thumb_batch():
+    """
+    Serves the ready thumbnails of several items (`ids=1,2,3`) as one multipart/mixed response,
+    one part per item carrying an X-Media-Id header, so a grid page costs one round trip instead
+    of one per cell. Items whose thumbnail still has to be generated get no part; clients fetch
+    those from /api/thumbnails/<id>, which renders them.
+    """
+    ids = parse_ids(MAX_THUMB_BATCH)
+    conn = get_read_db()
+    try:
+        rows = conn.execute(
+            f"SELECT id, path, type, thumb_state FROM media WHERE id IN ({','.join('?' * len(ids))})", ids
+        ).fetchall()
+    finally:
+        conn.close()
+    found = {row["id"]: row for row in rows}
+
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for mid in ids:
+        row = found.get(mid)
+        if row is None:
+            continue
+        if row["thumb_state"] == "placeholder":
+            data, mime_type = PLACEHOLDER_BYTES["audio" if row["type"] == "audio" else "error"], "image/jpeg"
+        else:
+            dst, mime_type = get_thumb_path(mid, row["path"])
+            try:
+                with open(dst, "rb") as f:
+                    data = f.read()
+            except OSError:
+                continue  # Not generated yet
+        body.write(
+            f"--{boundary}\r\nContent-Type: {mime_type}\r\nContent-Length: {len(data)}\r\n"
+            f"X-Media-Id: {mid}\r\n\r\n".encode()
+        )
+        body.write(data)
+        body.write(b"\r\n")
+    body.write(f"--{boundary}--\r\n".encode())
+
+    response = Response(body.getvalue(), mimetype=f"multipart/mixed; boundary={boundary}")
+    # Thumbnails are regenerated in place at times; batches are cached for less than single ones
+    response.headers["Cache-Control"] = "private, max-age=86400"
+    return response
+
+
 @bp.route("/api/thumbnails/<int:mid>")
 @api_key_required
 def thumb(mid):
     """Serves a thumbnail. JPG for most, GIF for original GIFs."""
+    # Happy path without the database: the file cache knows the source path of recent ids
+    media = get_media_file(mid, validate=False)
+    if media is not None:
+        dst, mime_type = get_thumb_path(mid, media.path)
+        if path_exists(dst):
+            return send_file(dst, mimetype=mime_type, max_age=31536000)
+
     row = get_media_row(mid)
     src = row["path"]
-    
-    is_gif = src.lower().endswith(".gif")
-    thumb_ext = ".gif" if is_gif else ".jpg"
-    dst = os.path.join(THUMB_DIR, f"{mid}{thumb_ext}")
-    mime_type = "image/gif" if is_gif else "image/jpeg"
+    dst, mime_type = get_thumb_path(mid, src)
 
     # 1. If the thumbnail exists, serve it instantly (Happy Path)
-    if os.path.exists(dst):
+    if row["thumb_state"] == "placeholder":
+        return serve_placeholder(row["type"])
+    if path_exists(dst):
         return send_file(dst, mimetype=mime_type, max_age=31536000)
 
     # 2. Source file is missing from disk
-    if not os.path.exists(src):
+    if not path_exists(src):
         abort(404)
 
-    # 3. Handle Generation with a TIMEOUT (The Fast Fail)
-    # Wait a maximum of 1.0 seconds for a free CPU slot. 
-    acquired = GENERATION_SEMAPHORE.acquire(timeout=1.0)
-    
-    if not acquired:
-        # The server is slammed. 4 threads are already generating thumbnails.
-        # Don't block Flask! Return a temporary placeholder immediately.
-        logger.warning(f"Server busy. Fast-failing thumbnail generation for ID: {mid}")
+    # 3. Generate in the process pool, joining any generation already running for this id
+    future = request_generation(mid, src, row["type"], dst, row["width"], row["height"])
+    if future is None:
+        # The server is slammed and every generation slot is taken.
+        # Don't block Flask! Hand the id to the scanner's priority queue and
+        # return a temporary placeholder immediately.
+        logger.warning(f"Server busy. Queueing thumbnail generation for ID: {mid}")
+        enqueue_thumbnail(mid)
         return serve_busy_placeholder()
 
     try:
-        # We secured a slot! Safe to generate.
-        if row["type"] == "image":
-             create_image_version(src, dst, size=(600, 600), quality=90)
-        elif row["type"] == "audio":
-             dst_jpg = os.path.join(THUMB_DIR, f"{mid}.jpg")
-             create_audio_thumb(dst_jpg)
-             dst = dst_jpg
-             mime_type = "image/jpeg"
-        else: 
-             dst_jpg = os.path.join(THUMB_DIR, f"{mid}.jpg")
-             create_video_thumb(src, dst_jpg)
-             dst = dst_jpg
-             mime_type = "image/jpeg"
-    finally:
-        # ALWAYS release the lock so the next request can use it, even if generation crashes.
-        GENERATION_SEMAPHORE.release()
+        result = future.result(timeout=GENERATION_WAIT_TIMEOUT)
+    except FutureTimeoutError:
+        # Still generating; the client will retry once the placeholder expires
+        return serve_busy_placeholder()
+    except Exception as e:
+        logger.error(f"Thumbnail generation failed for ID {mid}: {e}", exc_info=True)
+        abort(500)
+
+    record_thumbnail(mid, result)
+    if result["thumb_state"] == "placeholder":
+        return serve_placeholder(row["type"])
 
     # Serve the newly generated file, or 500 if something went terribly wrong.
-    if os.path.exists(dst):
+    if path_exists(dst):
         return send_file(dst, mimetype=mime_type, max_age=31536000)
     else:
         abort(500)
 
 
+@bp.route("/api/thumbnails/<int:mid>/preview")
+@api_key_required
+def preview(mid):
+    """
+    Serves the animated WebP hover preview of a video or animated GIF,
+    rendering it on first request. 404 for items without one.
+    """
+    preview_path = get_preview_path(mid)
+    if path_exists(preview_path):
+        return send_file(preview_path, mimetype="image/webp", max_age=31536000)
+
+    row = get_media_row(mid)
+    src = row["path"]
+    if not has_preview(src, row["type"]) or not path_exists(src):
+        abort(404)
+    if row["type"] == "image" and row["thumb_state"] is not None:
+        # GIF previews are made with the thumbnail; once that ran, a missing one means
+        # the GIF is static or went over the preview caps.
+        abort(404)
+
+    thumb_ext = ".gif" if row["type"] == "image" else ".jpg"
+    future = request_generation(mid, src, row["type"], os.path.join(THUMB_DIR, f"{mid}{thumb_ext}"),
+                                row["width"], row["height"])
+    if future is None:
+        abort(503)
+    try:
+        result = future.result(timeout=GENERATION_WAIT_TIMEOUT)
+    except FutureTimeoutError:
+        abort(503)
+    except Exception as e:
+        logger.error(f"Preview generation failed for ID {mid}: {e}", exc_info=True)
+        abort(500)
+    record_thumbnail(mid, result)
+
+    if path_exists(preview_path):
+        return send_file(preview_path, mimetype="image/webp", max_age=31536000)
+    abort(404)
+
+
 # Pre-generate the busy placeholder once at module load time to avoid disk I/O and race conditions
 BUSY_IMG_BYTES = io.BytesIO()
 with Image.new('RGB', (600, 600), color=(100, 100, 100)) as img:
     img.save(BUSY_IMG_BYTES, "JPEG", quality=70)
 
 
+def _render_placeholder(kind):
+    """Renders one of the shared 600x600 placeholder JPEGs."""
+    buf = io.BytesIO()
+    if kind == "audio":
+        # Dark grey square with a lighter circle; we can't rely on fonts being present
+        with Image.new('RGB', (600, 600), color=(50, 50, 50)) as img:
+            ImageDraw.Draw(img).ellipse([150, 150, 450, 450], fill=(100, 100, 100))
+            img.save(buf, "JPEG", quality=90)
+    else:
+        # Dark red square with a cross, for corrupted or unreadable files
+        with Image.new('RGB', (600, 600), color=(50, 0, 0)) as img:
+            d = ImageDraw.Draw(img)
+            d.line([(150, 150), (450, 450)], fill=(200, 50, 50), width=20)
+            d.line([(450, 150), (150, 450)], fill=(200, 50, 50), width=20)
+            img.save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+
+# Audio files without cover art and broken sources share these instead of one file each
+PLACEHOLDER_BYTES = {kind: _render_placeholder(kind) for kind in ("audio", "error")}
+
+
+def serve_placeholder(ftype):
+    """Serves the shared audio or error placeholder from memory."""
+    data = PLACEHOLDER_BYTES["audio" if ftype == "audio" else "error"]
+    # Cached for a day rather than a year, so a fixed or re-tagged file shows up eventually
+    return send_file(io.BytesIO(data), mimetype="image/jpeg", max_age=86400)
+
+
 def serve_busy_placeholder():
     """Serves a lightweight 'Busy' placeholder from memory."""
     # Max age is short (60s). We WANT the browser to ask for this image again soon,
-    # because the background scanner will eventually finish the real thumbnail!
+    # because the scanner will finish the real thumbnail from its priority queue!
     return send_file(io.BytesIO(BUSY_IMG_BYTES.getvalue()), mimetype="image/jpeg", max_age=60)
\ No newline at end of file
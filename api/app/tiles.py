@@ -0,0 +1,338 @@
+import os
+import time
+import uuid
+import shutil
+import logging
+from collections import OrderedDict
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from flask import Blueprint, Response, send_file, abort
+from PIL import Image
+from app.api_key_middleware import api_key_required
+from app.offload import run_blocking, path_exists
+from app.large_images import (
+    LARGE_IMAGE_PIXELS, STRIP_MODES, read_png_header, can_decode_in_strips, png_strip_rows,
+    iter_png_strips, estimate_decode_bytes,
+)
+from app.thumbnails import submit_generation, get_media_row, GENERATION_WAIT_TIMEOUT
+
+logger = logging.getLogger(__name__)
+bp = Blueprint("tiles", __name__)
+
+# Deep-zoom tiles for large images, laid out as <TILE_DIR>/<media id>/<level>/<col>_<row>.jpg
+# so the folder is a Deep Zoom (DZI) "_files" directory. A level is rendered on the first request
+# for one of its tiles, in one pass over the source that holds a band of TILE_BAND_ROWS tile
+# rows at a time, so memory stays bounded however large the level is.
+TILE_DIR = "/app/data/tiles"
+os.makedirs(TILE_DIR, exist_ok=True)
+TILE_SIZE = 256
+TILE_QUALITY = 85
+TILE_BAND_ROWS = 4
+# Seconds between checks for the requested tile while its level is rendering
+TILE_POLL_INTERVAL = 0.25
+# Total size of the tile cache; least recently viewed images are evicted first
+TILE_CACHE_BYTES = int(os.getenv("TILE_CACHE_MB", 2048)) * 1024 * 1024
+# Seconds between access-time updates of an image's tile folder (the LRU clock), and the
+# number of images whose last update this worker remembers
+TILE_TOUCH_INTERVAL = 60
+TILE_TOUCH_ENTRIES = 4096
+# The cache is measured (and evicted) when this worker's running estimate of it goes over
+# budget, or after this many seconds, as other workers add tiles too
+TILE_MEASURE_INTERVAL = 600
+# Render folders older than this are left over from a crashed render rather than in progress
+TILE_RENDER_STALE = 3600
+
+_touched = OrderedDict()  # media id -> last time its tile folder was touched by this worker
+_cache_bytes = None  # This worker's running estimate of the tile cache size
+_measured_at = 0.0
+
+
+def max_level(width, height):
+    """The full-resolution level: level 0 is 1x1 and each level doubles the previous one."""
+    return (max(width, height) - 1).bit_length()
+
+
+def level_size(width, height, level):
+    scale = 1 << (max_level(width, height) - level)
+    return -(-width // scale), -(-height // scale)
+
+
+def band_bounds(width, height, level, band):
+    """Top and bottom pixel rows of a band of tile rows within its level."""
+    top = band * TILE_BAND_ROWS * TILE_SIZE
+    return top, min(level_size(width, height, level)[1], top + TILE_BAND_ROWS * TILE_SIZE)
+
+
+def _strip_header(src, width, height):
+    """The PNG header when the image takes the strip-decoding path, else None."""
+    header = read_png_header(src) if src.lower().endswith(".png") else None
+    if width * height > LARGE_IMAGE_PIXELS and can_decode_in_strips(header):
+        return header
+    return None
+
+
+def _strip_factor(header, scale):
+    """Power of two strips are reduced by as they are read: the level's scale, if a strip allows."""
+    return min(scale, 1 << (png_strip_rows(header).bit_length() - 1))
+
+
+def level_cost(src, width, height, level):
+    """Estimated peak memory of render_tile_level(), for admission control."""
+    scale = 1 << (max_level(width, height) - level)
+    level_w = level_size(width, height, level)[0]
+    band_bytes = level_w * TILE_BAND_ROWS * TILE_SIZE * 4
+    header = _strip_header(src, width, height)
+    if header is None:
+        return estimate_decode_bytes(src, "image", width, height, level_size(width, height, level)) + band_bytes
+    factor = _strip_factor(header, scale)
+    strip_bytes = png_strip_rows(header, factor) * (width * STRIP_MODES[header[3]][1] + 1)
+    # Inflated strip + stored-zlib copy + decoded strip, plus the band at the strip reduction
+    return 3 * strip_bytes + band_bytes * (scale // factor) ** 2
+
+
+def _strip_bands(src, header, width, height, level):
+    """_level_bands() for huge PNGs: one pass over the strips, each reduced as it is read."""
+    scale = 1 << (max_level(width, height) - level)
+    level_h = level_size(width, height, level)[1]
+    factor = _strip_factor(header, scale)
+    mode = STRIP_MODES[header[3]][0]
+
+    def new_band(top, bottom):
+        src_top, src_bottom = top * scale, min(height, bottom * scale)
+        return Image.new(mode, (-(-width // factor), -(-(src_bottom - src_top) // factor))), src_top, src_bottom
+
+    band_index = 0
+    top, bottom = band_bounds(width, height, level, 0)
+    band, src_top, src_bottom = new_band(top, bottom)
+    strips = iter_png_strips(src, png_strip_rows(header, factor))
+    try:
+        for y, strip in strips:
+            with strip, strip.reduce(factor) as small:
+                # A strip can finish one band and start the next
+                while True:
+                    band.paste(small, (0, (y - src_top) // factor))
+                    if y + strip.height < src_bottom:
+                        break
+                    if factor < scale:
+                        band = band.reduce(scale // factor)
+                    yield top, band
+                    band_index += 1
+                    if band_index * TILE_BAND_ROWS * TILE_SIZE >= level_h:
+                        return
+                    top, bottom = band_bounds(width, height, level, band_index)
+                    band, src_top, src_bottom = new_band(top, bottom)
+    finally:
+        strips.close()
+
+
+def _level_bands(src, width, height, level):
+    """
+    Yields (top row, image) for each band of TILE_BAND_ROWS tile rows of a level, top to bottom,
+    reading the source once. Only one band is held at a time.
+    """
+    header = _strip_header(src, width, height)
+    if header is not None:
+        yield from _strip_bands(src, header, width, height, level)
+        return
+
+    scale = 1 << (max_level(width, height) - level)
+    level_w, level_h = level_size(width, height, level)
+    with Image.open(src) as im:
+        if im.format in ("JPEG", "MPO"):
+            im.draft("RGB", (level_w, level_h))  # Decode at 1/2, 1/4 or 1/8 scale
+        if im.mode not in ("RGB", "L"):
+            im = im.convert("RGB")
+        im.load()
+        # Each band is resampled from its box of the (possibly draft-reduced) image; resampling
+        # still reads the pixels around the box, so neighbouring bands join seamlessly
+        ratio = im.height / height
+        for top in range(0, level_h, TILE_BAND_ROWS * TILE_SIZE):
+            bottom = min(level_h, top + TILE_BAND_ROWS * TILE_SIZE)
+            box = (0, top * scale * ratio, im.width, min(height, bottom * scale) * ratio)
+            yield top, im.resize((level_w, bottom - top), Image.LANCZOS, box=box, reducing_gap=3.0)
+
+
+def render_tile_level(src, width, height, level, out_dir):
+    """
+    Cuts every tile of a level into out_dir (the level folder). Runs in the generation pool.
+    The source is decoded once and the level produced a band at a time, each band's tiles
+    written to a temporary folder and then moved into place, so a tile is either complete or
+    absent and the top of the level can be served while the rest is still rendering. Returns
+    the bytes written.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    tmp_dir = os.path.join(out_dir, f"level.{uuid.uuid4().hex}.tmp")
+    os.makedirs(tmp_dir)
+    written = 0
+    try:
+        for top, image in _level_bands(src, width, height, level):
+            with image:
+                if image.mode not in ("RGB", "L"):
+                    image = image.convert("RGB")
+                for y in range(0, image.height, TILE_SIZE):
+                    for x in range(0, image.width, TILE_SIZE):
+                        box = (x, y, min(x + TILE_SIZE, image.width), min(y + TILE_SIZE, image.height))
+                        with image.crop(box) as tile:
+                            name = f"{x // TILE_SIZE}_{(top + y) // TILE_SIZE}.jpg"
+                            tile.save(os.path.join(tmp_dir, name), "JPEG", quality=TILE_QUALITY)
+            for entry in os.scandir(tmp_dir):
+                written += entry.stat().st_size
+                os.replace(entry.path, os.path.join(out_dir, entry.name))
+        return written
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _folder_bytes(path, now):
+    """Size of a folder, and whether a render is writing into it."""
+    total, busy = 0, False
+    for entry in os.scandir(path):
+        if entry.is_dir(follow_symlinks=False):
+            if entry.name.endswith(".tmp") and now - entry.stat().st_mtime < TILE_RENDER_STALE:
+                busy = True
+            size, sub_busy = _folder_bytes(entry.path, now)
+            total += size
+            busy = busy or sub_busy
+        else:
+            total += entry.stat(follow_symlinks=False).st_size
+    return total, busy
+
+
+def evict_tiles(keep=None):
+    """
+    Removes the least recently viewed images' tiles until the cache fits TILE_CACHE_BYTES,
+    skipping images with a render in progress. Returns the size of what is left, or None if
+    the cache could not be measured.
+    """
+    folders = []
+    now = time.time()
+    try:
+        for entry in os.scandir(TILE_DIR):
+            if entry.is_dir(follow_symlinks=False):
+                folders.append((entry.stat().st_mtime, *_folder_bytes(entry.path, now), entry.path))
+    except OSError as e:
+        logger.warning(f"Could not measure the tile cache: {e}")
+        return None
+    total = sum(size for _, size, _, _ in folders)
+    for _, size, busy, path in sorted(folders):
+        if total <= TILE_CACHE_BYTES:
+            break
+        if busy or path == keep:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        logger.info(f"Evicted tiles: {path}")
+    return total
+
+
+def _note_written(written, keep):
+    """Adds a render to this worker's estimate of the cache, evicting once it may be over budget."""
+    global _cache_bytes, _measured_at
+    if _cache_bytes is not None:
+        _cache_bytes += written
+    if _cache_bytes is None or _cache_bytes > TILE_CACHE_BYTES or time.time() - _measured_at > TILE_MEASURE_INTERVAL:
+        _cache_bytes = evict_tiles(keep)
+        _measured_at = time.time()
+
+
+def _utime(path):
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _touch(mid, folder):
+    """Marks an image's tiles as recently viewed, at most once per TILE_TOUCH_INTERVAL."""
+    now = time.time()
+    if now - _touched.get(mid, 0) < TILE_TOUCH_INTERVAL:
+        return
+    _touched[mid] = now
+    _touched.move_to_end(mid)
+    if len(_touched) > TILE_TOUCH_ENTRIES:
+        _touched.popitem(last=False)
+    run_blocking(_utime, folder)
+
+
+def _read_size(path):
+    try:
+        with Image.open(path) as im:  # Reads the header only
+            return im.size
+    except Exception:
+        return None
+
+
+def _image_size(row):
+    if row["type"] != "image" or row["path"].lower().endswith(".gif"):
+        abort(404)
+    if row["width"] and row["height"]:
+        return row["width"], row["height"]
+    size = run_blocking(_read_size, row["path"])
+    if size is None:
+        abort(404)
+    return size
+
+
+def _busy():
+    # Viewers retry failed tiles (e.g. OpenSeadragon's tileRetryMax)
+    return Response("Tile generation busy", status=503, headers={"Retry-After": "2"})
+
+
+@bp.route("/api/tiles/<int:mid>.dzi")
+@api_key_required
+def descriptor(mid):
+    """Serves the Deep Zoom descriptor; tiles live under /api/tiles/<id>_files/."""
+    width, height = _image_size(get_media_row(mid))
+    xml = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" TileSize="{TILE_SIZE}" '
+        f'Overlap="0" Format="jpg"><Size Width="{width}" Height="{height}"/></Image>'
+    )
+    return Response(xml, mimetype="application/xml", headers={"Cache-Control": "max-age=3600"})
+
+
+@bp.route("/api/tiles/<int:mid>_files/<int:level>/<int:col>_<int:row>.jpg")
+@api_key_required
+def tile(mid, level, col, row):
+    """Serves one 256px tile, generating its whole level on the first request."""
+    media = get_media_row(mid)
+    width, height = _image_size(media)
+    if level > max_level(width, height):
+        abort(404)
+    level_w, level_h = level_size(width, height, level)
+    if col * TILE_SIZE >= level_w or row * TILE_SIZE >= level_h:
+        abort(404)
+
+    folder = os.path.join(TILE_DIR, str(mid))
+    path = os.path.join(folder, str(level), f"{col}_{row}.jpg")
+    if path_exists(path):
+        _touch(mid, folder)
+        return send_file(path, mimetype="image/jpeg", max_age=31536000)
+
+    src = media["path"]
+    if not path_exists(src):
+        abort(404)
+    future = submit_generation(
+        ("tiles", mid, level), run_blocking(level_cost, src, width, height, level), render_tile_level,
+        src, width, height, level, os.path.join(folder, str(level)),
+    )
+    if future is None:
+        return _busy()
+    # Tiles land band by band, so this one is usually ready well before the whole level
+    deadline = time.monotonic() + GENERATION_WAIT_TIMEOUT
+    while True:
+        try:
+            written = future.result(timeout=TILE_POLL_INTERVAL)
+            break
+        except FutureTimeoutError:
+            if path_exists(path):
+                return send_file(path, mimetype="image/jpeg", max_age=31536000)
+            if time.monotonic() > deadline:
+                return _busy()
+        except Exception as e:
+            logger.error(f"Tile generation failed for ID {mid} level {level}: {e}", exc_info=True)
+            abort(500)
+    run_blocking(_note_written, written, folder)
+
+    if not path_exists(path):
+        abort(500)
+    return send_file(path, mimetype="image/jpeg", max_age=31536000)
@@ -0,0 +1,106 @@
+# api/app/timeline.py
+import calendar
+import time
+from datetime import datetime, timedelta, timezone
+from flask import Blueprint, jsonify, request, abort
+from app.db import get_read_db, get_generation
+from app.api_key_middleware import api_key_required
+from app.offload import offload
+from app.gallery import read_filters, filter_sql
+
+bp = Blueprint("timeline", __name__)
+
+DAY = 86400
+
+# Bucket size -> strftime format of its key
+BUCKETS = {
+    "day": "%Y-%m-%d",
+    "month": "%Y-%m",
+}
+
+# Histograms per (filters, bucket, utc offset): key -> (db generation, expiry time, buckets).
+# mtime-only changes don't bump the generation, hence the TTL.
+TIMELINE_CACHE_TTL = 300
+TIMELINE_CACHE_SIZE = 64
+_timeline_cache = {}
+
+
+def _histogram(c, bucket, offset, where_conditions, params):
+    where_sql = "WHERE media.mtime >= 0"
+    if where_conditions:
+        where_sql += " AND " + " AND ".join(where_conditions)
+    # Only mtime is read, so the scan stays on an (…, mtime) index. Rows are grouped by local
+    # day number, plain integer arithmetic that is several times cheaper per row than
+    # strftime(); days are rolled up into months here.
+    rows = c.execute(f"""
+        SELECT (CAST(media.mtime AS INTEGER) + ?) / {DAY} AS day, COUNT(*)
+        FROM media {where_sql}
+        GROUP BY day
+        ORDER BY day DESC
+    """, (offset, *params)).fetchall()
+
+    buckets = []
+    epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    for day, count in rows:
+        first = epoch + timedelta(days=day)
+        if bucket == "day":
+            after = first + timedelta(days=1)
+        else:
+            first = first.replace(day=1)
+            after = (first + timedelta(days=32)).replace(day=1)
+        key = first.strftime(BUCKETS[bucket])
+        if buckets and buckets[-1]["key"] == key:
+            buckets[-1]["count"] += count
+            continue
+        buckets.append({
+            "key": key,
+            "from": calendar.timegm(first.timetuple()) - offset,
+            "to": calendar.timegm(after.timetuple()) - offset,
+            "count": count,
+        })
+    return buckets
+
+
+@bp.route("/api/timeline")
+@api_key_required
+@offload
+def timeline():
+    """
+    Item counts per day or month (`bucket=day|month`, default month), newest first, for a
+    date scrubber. Takes the gallery's filters (q, group, subgroup, folder, recursive) and
+    `tz`, the client's offset from UTC in minutes, so buckets follow local dates.
+
+    Each bucket has `from`/`to` (Unix times, `to` exclusive). To jump there, request
+    /api/gallery?sort=date_desc&start=<to> (or sort=date_asc&start=<from>).
+    """
+    bucket = request.args.get("bucket", "month")
+    if bucket not in BUCKETS:
+        abort(400, description=f"bucket must be one of: {', '.join(BUCKETS)}")
+    offset = request.args.get("tz", 0, type=int) * 60
+    if abs(offset) > 14 * 3600:
+        abort(400, description="tz must be within ±14 hours")
+    filters = read_filters()
+    where_conditions, params = filter_sql(*filters)
+
+    conn = get_read_db()
+    try:
+        c = conn.cursor()
+        key = (filters, bucket, offset)
+        generation = get_generation(c)
+        cached = _timeline_cache.get(key)
+        if cached and cached[0] == generation and cached[1] > time.time():
+            buckets = cached[2]
+        else:
+            buckets = _histogram(c, bucket, offset, where_conditions, params)
+            _timeline_cache.pop(key, None)
+            if len(_timeline_cache) >= TIMELINE_CACHE_SIZE:
+                _timeline_cache.pop(next(iter(_timeline_cache)))  # Oldest entry
+            _timeline_cache[key] = (generation, time.time() + TIMELINE_CACHE_TTL, buckets)
+    finally:
+        conn.close()
+
+    return jsonify({
+        "bucket": bucket,
+        "total": sum(b["count"] for b in buckets),
+        "buckets": buckets,
+    })
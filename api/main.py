@@ -1,15 +1,18 @@
-from flask import Flask
+from flask import Flask, g
 import os
+import time
 from flasgger import Swagger
 import logging
 from filelock import FileLock, Timeout
 
-from app import auth, db, gallery, groups, subgroups, like, scan_api, search, stream, random_scroller, thumbnails, health
-from app import delete
+from app import auth, db, gallery, groups, subgroups, folders, like, scan_api, search, stream, random_scroller, thumbnails, tiles, display, health
+from app import delete, media, timeline, hls
+from app.json_provider import FastJSONProvider
 
 def create_app():
     """Create and configure an instance of the Flask application."""
     app = Flask(__name__, instance_relative_config=True)
+    app.json = FastJSONProvider(app)
     swagger = Swagger(app)
 
     secret_key = os.environ.get("SECRET_KEY", "dev")
@@ -77,16 +80,35 @@ def create_app():
     app.register_blueprint(gallery.bp)
     app.register_blueprint(groups.bp)
     app.register_blueprint(subgroups.bp)
+    app.register_blueprint(folders.bp)
     app.register_blueprint(like.bp)
     app.register_blueprint(scan_api.scan_bp)
     app.register_blueprint(search.search_bp)
     # app.register_blueprint(settings.bp)
     app.register_blueprint(stream.stream_bp)
+    app.register_blueprint(hls.bp)
     app.register_blueprint(thumbnails.bp)
+    app.register_blueprint(tiles.bp)
+    app.register_blueprint(display.bp)
     app.register_blueprint(random_scroller.bp)
     app.register_blueprint(health.bp)
     app.register_blueprint(delete.bp)
+    app.register_blueprint(media.bp)
+    app.register_blueprint(timeline.bp)
     
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def add_server_timing(response):
+        """Reports time spent acquiring DB connections and handling the request (Server-Timing)."""
+        if "request_start" in g:
+            total = (time.perf_counter() - g.request_start) * 1000
+            db_connect = g.get("db_connect_time", 0.0) * 1000
+            response.headers["Server-Timing"] = f"db-connect;dur={db_connect:.2f}, app;dur={total:.2f}"
+        return response
+
     @app.after_request
     def add_security_headers(response):
         """Inject security headers into every response."""
@@ -11,4 +11,7 @@ set -e
 echo "--- Starting Gunicorn web server ---"
 # Use the WORKERS environment variable, with a default of 2
 # Set timeout to 300s to allow long-running background scans without killing workers
-exec gunicorn -w ${WORKERS:-2} -k gevent --max-requests 1000 --timeout 300 -b 0.0.0.0:5000 "main:create_app()"
\ No newline at end of file
+# WORKER_CLASS defaults to gevent, whose workers hand DB and disk calls to OFFLOAD_THREADS
+# native threads (app/offload.py); gthread is a plain thread-per-request alternative
+# sized by THREADS.
+exec gunicorn -w ${WORKERS:-2} -k ${WORKER_CLASS:-gevent} --threads ${THREADS:-8} --max-requests 1000 --timeout 300 -b 0.0.0.0:5000 "main:create_app()"
\ No newline at end of file
@@ -6,7 +6,7 @@ Runs independently from API workers to avoid lock contention and timeouts.
 import logging
 import os
 import time
-from app.scanner import scan, precompute_missing_thumbnails, GALLERY_PATH
+from app.scanner import scan, precompute_missing_thumbnails, process_thumbnail_queue, thumbnail_queue_pending, GALLERY_PATH
 from app.watcher import start_watcher
 from app.db import init_db
 
@@ -83,16 +83,22 @@ def main():
             start_wait = time.time()
             while time.time() - start_wait < scan_interval:
                 try:
+                    # Thumbnails the API is waiting on always go ahead of the backfill
+                    if process_thumbnail_queue():
+                        continue
+
                     processed_any = precompute_missing_thumbnails(batch_size=50)
                     if processed_any:
                         # Very small sleep to yield CPU between batches
                         time.sleep(1)
                         continue
                     else:
-                        # Caught up, sleep until next check or interval ends
+                        # Caught up, sleep until next check or interval ends,
+                        # waking up early if the API queues a thumbnail request
                         remaining = scan_interval - (time.time() - start_wait)
-                        if remaining > 0:
-                            time.sleep(min(remaining, 60))
+                        idle_until = time.time() + min(remaining, 60)
+                        while time.time() < idle_until and not thumbnail_queue_pending():
+                            time.sleep(1)
                 except Exception as e:
                     logger.error(f"Error during thumbnail precomputation: {e}", exc_info=True)
                     time.sleep(60) # Prevent tight error loops
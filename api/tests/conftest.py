@@ -0,0 +1,82 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The app reads DB_PATH at import; point it somewhere harmless before anything imports it.
+# Each test then gets its own database through the `db` fixture.
+os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(prefix="vuvur-tests-"), "app.db"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import db as app_db, delete, file_cache, folders, gallery, like, stream, timeline  # noqa: E402
+from app.folders import assign_folders  # noqa: E402
+
+
+def _drain_pools():
+    for pool in (app_db._read_pool, app_db._write_pool):
+        while pool._idle:
+            conn = pool._idle.pop()
+            conn.pool = None  # Really close it rather than hand it back
+            conn.close()
+
+
+@pytest.fixture(scope="session")
+def app():
+    from main import create_app
+    return create_app()
+
+
+@pytest.fixture
+def gallery_dir(tmp_path, monkeypatch):
+    """An empty gallery root standing in for /mnt/gallery; the liked and recycle bin folders live in it."""
+    root = tmp_path / "gallery"
+    root.mkdir()
+    for module in (app_db, folders, gallery, stream):
+        monkeypatch.setattr(module, "GALLERY_PATH", str(root))
+    monkeypatch.setattr(like, "LIKED_DIR", str(root / "liked"))
+    monkeypatch.setattr(delete, "RECYCLEBIN_PATH", str(root / "recyclebin"))
+    return root
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch, gallery_dir):
+    """A fresh, initialised database for one test; yields a read-write connection."""
+    _drain_pools()
+    monkeypatch.setattr(app_db, "DB_PATH", str(tmp_path / "app.db"))
+    for cache in (gallery._count_cache, gallery._manifest_cache, timeline._timeline_cache, file_cache._files):
+        cache.clear()
+    monkeypatch.setattr(file_cache, "_generation", None)
+    monkeypatch.setattr(file_cache, "_checked_at", 0.0)
+    app_db.init_db()
+    conn = app_db.get_db()
+    yield conn
+    conn.close()
+    _drain_pools()
+
+
+@pytest.fixture
+def client(app, db):
+    return app.test_client()
+
+
+@pytest.fixture
+def add_media(db):
+    """
+    Inserts a media row for a path relative to the gallery as the scanner would (group from the
+    first folder) and returns its id. The file itself is not created.
+    """
+    def add(rel, type="image", mtime=0, width=100, height=100, exif=None, **columns):
+        path = os.path.join(app_db.GALLERY_PATH, rel)
+        row = {
+            "path": path, "filename": os.path.basename(path), "type": type, "size": 1, "mtime": mtime,
+            "width": width, "height": height, "exif": exif or "{}",
+            "group_tag": rel.split(os.sep)[0] if os.sep in rel else None, **columns,
+        }
+        mid = db.execute(
+            f"INSERT INTO media ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})", tuple(row.values())
+        ).lastrowid
+        assign_folders(db.cursor())
+        db.commit()
+        return mid
+    return add
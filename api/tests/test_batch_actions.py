@@ -0,0 +1,117 @@
+import os
+import sqlite3
+
+import pytest
+
+from app import delete, like
+
+
+@pytest.fixture
+def files(gallery_dir, add_media):
+    """Creates files under the gallery with their rows; returns {relative path: id}."""
+    def create(*paths):
+        ids = {}
+        for rel in paths:
+            path = gallery_dir / rel
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(rel.encode())
+            ids[rel] = add_media(rel)
+        return ids
+    return create
+
+
+def media_ids(db):
+    return {row[0] for row in db.execute("SELECT id FROM media")}
+
+
+def test_delete_batch_partial_failure(client, db, files, gallery_dir, monkeypatch):
+    ids = files("a/one.jpg", "a/two.jpg", "b/gone.jpg", "b/stuck.jpg")
+    os.remove(gallery_dir / "b/gone.jpg")
+    real_move = delete.shutil.move
+
+    def move(src, dst):
+        if src.endswith("stuck.jpg"):
+            raise PermissionError(src)
+        return real_move(src, dst)
+    monkeypatch.setattr(delete.shutil, "move", move)
+
+    order = [ids["a/one.jpg"], 9999, ids["b/gone.jpg"], ids["b/stuck.jpg"], ids["a/two.jpg"]]
+    body = client.post("/api/delete/batch", json={"ids": order}).get_json()
+
+    assert [(r["id"], r["status"]) for r in body["results"]] == [
+        (ids["a/one.jpg"], "ok"), (9999, "not_found"), (ids["b/gone.jpg"], "warning"),
+        (ids["b/stuck.jpg"], "error"), (ids["a/two.jpg"], "ok"),
+    ]
+    assert all("recycled_path" not in r for r in body["results"])
+    assert body["deleted"] == 3
+    assert media_ids(db) == {ids["b/stuck.jpg"]}
+    assert (gallery_dir / "b/stuck.jpg").exists()
+    recycled = sorted(os.listdir(gallery_dir / "recyclebin"))
+    assert [name.split("_")[0] for name in recycled] == ["one", "two"]
+
+
+def test_delete_batch_restores_files_when_the_records_fail(client, db, files, gallery_dir, monkeypatch):
+    ids = files("a/one.jpg", "a/two.jpg")
+
+    def fail(ids):
+        raise sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr(delete, "_delete_records", fail)
+
+    body = client.post("/api/delete/batch", json={"ids": list(ids.values())}).get_json()
+    assert {r["status"] for r in body["results"]} == {"error"}
+    assert body["deleted"] == 0
+    assert media_ids(db) == set(ids.values())
+    assert (gallery_dir / "a/one.jpg").exists() and (gallery_dir / "a/two.jpg").exists()
+    assert os.listdir(gallery_dir / "recyclebin") == []
+
+
+def test_like_batch_partial_failure(client, db, files, gallery_dir):
+    ids = files("a/one.jpg", "a/same.jpg", "b/same.jpg", "c/taken.jpg", "liked/done.jpg")
+    db.execute("UPDATE media SET liked = 1 WHERE id = ?", (ids["liked/done.jpg"],))
+    db.commit()
+    (gallery_dir / "liked/taken.jpg").write_bytes(b"other")
+
+    order = [ids["a/one.jpg"], ids["a/same.jpg"], ids["b/same.jpg"], ids["c/taken.jpg"], ids["liked/done.jpg"], 9999]
+    body = client.post("/api/like/batch", json={"ids": order, "liked": True}).get_json()
+
+    assert [(r["id"], r["status"]) for r in body["results"]] == [
+        (ids["a/one.jpg"], "ok"), (ids["a/same.jpg"], "ok"),
+        (ids["b/same.jpg"], "error"),  # Same name as a/same.jpg in this batch
+        (ids["c/taken.jpg"], "error"),  # Name already in the liked folder
+        (ids["liked/done.jpg"], "unchanged"), (9999, "not_found"),
+    ]
+    assert body["changed"] == 2
+    liked = {row[0]: (row[1], row[2]) for row in db.execute("SELECT id, path, original_path FROM media WHERE liked = 1")}
+    assert liked[ids["a/one.jpg"]] == (str(gallery_dir / "liked/one.jpg"), str(gallery_dir / "a/one.jpg"))
+    assert set(liked) == {ids["a/one.jpg"], ids["a/same.jpg"], ids["liked/done.jpg"]}
+    assert (gallery_dir / "liked/same.jpg").read_bytes() == b"a/same.jpg"
+    assert (gallery_dir / "b/same.jpg").exists() and (gallery_dir / "c/taken.jpg").exists()
+
+    # Unliking puts files back; one without a known original location cannot move
+    body = client.post("/api/like/batch", json={"ids": [ids["a/one.jpg"], ids["liked/done.jpg"]], "liked": False}).get_json()
+    assert [r["status"] for r in body["results"]] == ["ok", "error"]
+    assert (gallery_dir / "a/one.jpg").exists()
+
+
+def test_like_batch_moves_files_back_when_the_records_fail(client, db, files, gallery_dir, monkeypatch):
+    ids = files("a/one.jpg", "a/two.jpg")
+
+    def fail(changes):
+        raise sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr(like, "_record_likes", fail)
+
+    body = client.post("/api/like/batch", json={"ids": list(ids.values()), "liked": True}).get_json()
+    assert {r["status"] for r in body["results"]} == {"error"}
+    assert body["changed"] == 0
+    assert (gallery_dir / "a/one.jpg").exists() and (gallery_dir / "a/two.jpg").exists()
+    assert os.listdir(gallery_dir / "liked") == []
+    assert not db.execute("SELECT 1 FROM media WHERE liked = 1").fetchone()
+
+
+@pytest.mark.parametrize("path, body", [
+    ("/api/delete/batch", {"ids": "1,2"}),
+    ("/api/like/batch", {"ids": [1]}),
+    ("/api/like/batch", {"ids": [1], "liked": "yes"}),
+])
+def test_batch_rejects_bad_bodies(client, db, path, body):
+    assert client.post(path, json=body).status_code == 400
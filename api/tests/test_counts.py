@@ -0,0 +1,79 @@
+import pytest
+
+from app.db import _subgroup_sql, get_generation
+
+
+def counts(db):
+    return {tuple(row[:3]): row[3] for row in db.execute("SELECT group_tag, subgroup, type, count FROM media_counts")}
+
+
+def recounted(db):
+    """What media_counts should hold, counted from scratch."""
+    return {tuple(row[:3]): row[3] for row in db.execute(f"""
+        SELECT coalesce(group_tag, ''), {_subgroup_sql("media")}, coalesce(type, ''), COUNT(*)
+        FROM media GROUP BY 1, 2, 3
+    """)}
+
+
+def folder_counts(db):
+    return {row[0]: row[1] for row in db.execute("SELECT path, item_count FROM folders WHERE item_count > 0")}
+
+
+@pytest.fixture
+def files(gallery_dir, add_media):
+    """Three files on disk with their rows: two images in grp/sub, a video in other."""
+    ids = {}
+    for rel, type in [("grp/sub/a.jpg", "image"), ("grp/sub/b.jpg", "image"), ("other/c.mp4", "video")]:
+        path = gallery_dir / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"x")
+        ids[rel] = add_media(rel, type=type)
+    return ids
+
+
+def test_insert_counts_and_bumps_generation(db, add_media, gallery_dir):
+    before = get_generation(db)
+    add_media("grp/sub/a.jpg")
+    add_media("grp/b.jpg")
+    add_media("c.jpg")
+    assert counts(db) == recounted(db) == {("grp", "sub", "image"): 1, ("grp", "", "image"): 1, ("", "", "image"): 1}
+    assert folder_counts(db) == {str(gallery_dir / "grp" / "sub"): 1, str(gallery_dir / "grp"): 1, str(gallery_dir): 1}
+    assert get_generation(db) == before + 3
+
+
+def test_delete_drops_counts_and_bumps_generation(client, db, files, gallery_dir):
+    before = get_generation(db)
+    assert client.post(f"/api/delete/{files['other/c.mp4']}").status_code == 200
+    assert client.post(f"/api/delete/{files['grp/sub/a.jpg']}").status_code == 200
+    # Emptied counters are removed, not left at zero
+    assert counts(db) == recounted(db) == {("grp", "sub", "image"): 1}
+    assert folder_counts(db) == {str(gallery_dir / "grp" / "sub"): 1}
+    assert get_generation(db) == before + 2
+
+
+def test_like_move_follows_the_file(client, db, files, gallery_dir):
+    mid = files["grp/sub/a.jpg"]
+    before = get_generation(db)
+
+    assert client.post(f"/api/toggle_like/{mid}").get_json() == {"status": "ok", "liked": True}
+    assert counts(db) == recounted(db)
+    assert sum(counts(db).values()) == 3
+    assert folder_counts(db) == {
+        str(gallery_dir / "liked"): 1, str(gallery_dir / "grp" / "sub"): 1, str(gallery_dir / "other"): 1,
+    }
+    assert get_generation(db) == before + 1
+
+    assert client.post(f"/api/toggle_like/{mid}").get_json() == {"status": "ok", "liked": False}
+    assert counts(db) == recounted(db) == {("grp", "sub", "image"): 2, ("other", "", "video"): 1}
+    assert folder_counts(db) == {str(gallery_dir / "grp" / "sub"): 2, str(gallery_dir / "other"): 1}
+    # Emptied folders are pruned
+    assert db.execute("SELECT 1 FROM folders WHERE path = ?", (str(gallery_dir / "liked"),)).fetchone() is None
+    assert get_generation(db) == before + 2
+
+
+def test_gallery_total_uses_the_counters(client, db, files):
+    db.execute("DELETE FROM media WHERE id = ?", (files["grp/sub/b.jpg"],))
+    db.commit()
+    body = client.get("/api/gallery", query_string={"group": "grp"}).get_json()
+    assert body["total_items"] == 1
+    assert [item["id"] for item in body["items"]] == [files["grp/sub/a.jpg"]]
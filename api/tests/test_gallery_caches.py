@@ -0,0 +1,35 @@
+from app import gallery
+
+
+def test_unseeded_random_manifests_are_not_cached(client, add_media):
+    add_media("grp/a.jpg")
+    response = client.get("/api/gallery/manifest", query_string={"sort": "random"})
+    assert response.status_code == 200
+    assert not gallery._manifest_cache
+
+    seed = response.headers["X-Manifest-Seed"]
+    again = client.get("/api/gallery/manifest", query_string={"sort": "random", "seed": seed})
+    assert again.data == response.data
+    assert len(gallery._manifest_cache) == 1
+
+
+def test_manifest_cache_evicts_least_recently_used(client, add_media, monkeypatch):
+    monkeypatch.setattr(gallery, "MANIFEST_CACHE_SIZE", 2)
+    add_media("grp/a.jpg")
+
+    def fetch(sort):
+        assert client.get("/api/gallery/manifest", query_string={"sort": sort}).status_code == 200
+
+    fetch("date_desc")
+    fetch("date_asc")
+    fetch("date_desc")  # Hit: date_asc is now the oldest
+    fetch("file_asc")
+    assert [key[1] for key in gallery._manifest_cache] == ["date_desc", "file_asc"]
+
+
+def test_count_cache_is_bounded(db, monkeypatch):
+    monkeypatch.setattr(gallery, "COUNT_CACHE_SIZE", 3)
+    c = db.cursor()
+    for i in range(5):
+        gallery.count_items(c, ("q", i), None, "SELECT COUNT(*) FROM media", ())
+    assert list(gallery._count_cache) == [("q", 2), ("q", 3), ("q", 4)]
@@ -0,0 +1,76 @@
+import pytest
+
+PAGE = 7
+ITEMS = 30
+
+
+@pytest.fixture
+def library(add_media):
+    # Duplicate mtimes and filenames make the id tie-breaker matter
+    return {
+        add_media(f"grp/sub/img{i % 10}_{i}.jpg", mtime=1000 + i // 3, filename=f"img{i % 5}.jpg")
+        for i in range(ITEMS)
+    }
+
+
+def walk(client, sort, send_page, **params):
+    """Follows next_cursor from the first page; returns every id seen, in order."""
+    ids, cursor, page = [], None, 1
+    for _ in range(ITEMS):  # More requests than pages means the walk never ends
+        query = {"sort": sort, "limit": PAGE, "fields": "id", **params}
+        if cursor:
+            query["cursor"] = cursor
+        if send_page:
+            query["page"] = page
+        body = client.get("/api/gallery", query_string=query).get_json()
+        ids += [item["id"] for item in body["items"]]
+        cursor, page = body["next_cursor"], page + 1
+        if cursor is None:
+            return ids
+    pytest.fail(f"{sort} walk did not end")
+
+
+@pytest.mark.parametrize("sort", ["date_desc", "date_asc", "file_asc", "file_desc", "random"])
+@pytest.mark.parametrize("send_page", [False, True])
+def test_cursor_walk_visits_every_item_once(client, library, sort, send_page):
+    ids = walk(client, sort, send_page)
+    assert len(ids) == len(set(ids))
+    assert set(ids) == library
+
+
+@pytest.mark.parametrize("sort,column,reverse", [
+    ("date_desc", "mtime", True), ("date_asc", "mtime", False),
+    ("file_asc", "filename", False), ("file_desc", "filename", True),
+])
+def test_cursor_walk_follows_the_sort(client, db, library, sort, column, reverse):
+    ids = walk(client, sort, send_page=False)
+    rows = {row["id"]: row for row in db.execute("SELECT id, mtime, filename FROM media")}
+    expected = sorted(library, key=lambda mid: (rows[mid][column], mid), reverse=reverse)
+    assert ids == expected
+
+
+def test_random_walk_keeps_its_seed(client, library):
+    first = client.get("/api/gallery", query_string={"sort": "random", "limit": PAGE, "seed": 12345, "fields": "id"}).get_json()
+    again = client.get("/api/gallery", query_string={"sort": "random", "limit": PAGE, "seed": 12345, "fields": "id"}).get_json()
+    assert first["seed"] == 12345
+    assert first["items"] == again["items"]
+    assert walk(client, "random", send_page=True, seed=12345)[:PAGE] == [item["id"] for item in first["items"]]
+
+
+@pytest.mark.parametrize("sort", ["date_desc", "file_asc", "random"])
+def test_page_numbers_without_cursor(client, library, sort):
+    ids = []
+    for page in range(1, ITEMS // PAGE + 2):
+        body = client.get("/api/gallery", query_string={
+            "sort": sort, "limit": PAGE, "page": page, "seed": 99, "fields": "id",
+        }).get_json()
+        ids += [item["id"] for item in body["items"]]
+    assert len(ids) == len(set(ids))
+    assert set(ids) == library
+
+
+def test_cursor_of_another_sort_is_rejected(client, library):
+    body = client.get("/api/gallery", query_string={"sort": "date_desc", "limit": PAGE}).get_json()
+    response = client.get("/api/gallery", query_string={"sort": "file_asc", "cursor": body["next_cursor"]})
+    assert response.status_code == 400
+    assert client.get("/api/gallery", query_string={"sort": "date_desc", "cursor": "not-a-cursor"}).status_code == 400
@@ -0,0 +1,65 @@
+import random
+
+import pytest
+from PIL import Image, ImageFile
+
+from app import large_images
+from app.large_images import can_decode_in_strips, iter_png_strips, png_strip_rows, read_png_header
+
+
+def make_png(path, mode, size=(53, 41)):
+    """Noise over a gradient, so the encoder's adaptive filtering picks every filter type."""
+    rng = random.Random(mode)
+    width, height = size
+    bands = len(mode)
+    data = bytes(
+        (x * 5 + y * 3 + b * 40 + (rng.randrange(64) if (x // 8 + y // 8) % 2 else 0)) % 256
+        for y in range(height) for x in range(width) for b in range(bands)
+    )
+    Image.frombytes(mode, size, data).save(path)
+    return path
+
+
+def decode_strips(path, rows):
+    header = read_png_header(path)
+    strips = list(iter_png_strips(path, rows))
+    assert [y for y, _ in strips] == list(range(0, header[1], rows))
+    return b"".join(strip.tobytes() for _, strip in strips)
+
+
+@pytest.mark.parametrize("mode", ["L", "LA", "RGB", "RGBA"])
+@pytest.mark.parametrize("rows", [1, 7, 41, 100])
+def test_strips_match_full_decode(tmp_path, mode, rows):
+    path = make_png(tmp_path / f"{mode}.png", mode)
+    assert can_decode_in_strips(read_png_header(path))
+    with Image.open(path) as im:
+        assert decode_strips(path, rows) == im.tobytes()
+
+
+def test_strips_across_many_idat_chunks(tmp_path, monkeypatch):
+    path = make_png(tmp_path / "chunks.png", "RGB", size=(300, 200))
+    with Image.open(path) as im:
+        expected = im.tobytes()
+    # Re-save with tiny IDAT chunks so strips straddle chunk boundaries
+    monkeypatch.setattr(ImageFile, "MAXBLOCK", 97)
+    Image.frombytes("RGB", (300, 200), expected).save(path)
+    assert path.read_bytes().count(b"IDAT") > 10
+    assert decode_strips(path, 13) == expected
+
+
+def test_strip_rows_stay_near_budget_and_keep_multiple(monkeypatch):
+    monkeypatch.setattr(large_images, "STRIP_BYTES", 10_000)
+    header = (1000, 5000, 8, 2, 0)  # RGB, 3001-byte scanlines
+    assert png_strip_rows(header) == 3
+    assert png_strip_rows(header, 4) == 4
+    assert png_strip_rows((100, 5000, 8, 6, 0), 8) == 24
+
+
+@pytest.mark.parametrize("header", [
+    None,
+    (10, 10, 16, 2, 0),  # 16-bit
+    (10, 10, 8, 3, 0),  # Palette
+    (10, 10, 8, 2, 1),  # Interlaced
+])
+def test_ineligible_pngs(header):
+    assert not can_decode_in_strips(header)
@@ -0,0 +1,26 @@
+import pytest
+
+from app import random_scroller
+
+
+@pytest.fixture
+def library(add_media):
+    return {add_media(f"grp/img{i}.jpg") for i in range(20)}
+
+
+def test_random_files_returns_distinct_library_items(client, library):
+    items = client.get("/api/files/random", query_string={"count": 5}).get_json()
+    ids = [item["id"] for item in items]
+    assert len(ids) == len(set(ids)) == 5
+    assert set(ids) <= library
+
+
+@pytest.mark.parametrize("count", [0, -3, random_scroller.MAX_RANDOM_COUNT + 1])
+def test_random_files_rejects_out_of_range_count(client, library, count):
+    assert client.get("/api/files/random", query_string={"count": count}).status_code == 400
+
+
+def test_random_files_limit_is_configurable(client, library, monkeypatch):
+    monkeypatch.setattr(random_scroller, "MAX_RANDOM_COUNT", 3)
+    assert client.get("/api/files/random", query_string={"count": 4}).status_code == 400
+    assert len(client.get("/api/files/random", query_string={"count": 3}).get_json()) == 3
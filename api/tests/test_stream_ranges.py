@@ -0,0 +1,101 @@
+import re
+
+import pytest
+
+from app.stream import parse_ranges
+
+SIZE = 1000
+DATA = bytes(i % 251 for i in range(SIZE))
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", [(0, 99)]),
+    ("bytes=900-", [(900, 999)]),
+    ("bytes=900-5000", [(900, 999)]),
+    ("bytes=-100", [(900, 999)]),
+    ("bytes=-5000", [(0, 999)]),
+    ("bytes=0-0, -1", [(0, 0), (999, 999)]),
+    ("BYTES = 10-19,30-39", [(10, 19), (30, 39)]),
+    ("bytes=1000-", []),
+    ("bytes=-0", []),
+    ("bytes=2000-3000, 1500-", []),
+    ("bytes=5000-, 0-9", [(0, 9)]),
+])
+def test_parse_ranges(header, expected):
+    assert parse_ranges(header, SIZE) == expected
+
+
+@pytest.mark.parametrize("header", [None, "", "items=0-9", "bytes=", "bytes=5", "bytes=9-0", "bytes=a-b", "bytes=" + ",".join(["0-1"] * 17)])
+def test_parse_ranges_falls_back_to_whole_file(header):
+    assert parse_ranges(header, SIZE) is None
+
+
+@pytest.fixture
+def media(gallery_dir, add_media):
+    (gallery_dir / "grp").mkdir()
+    (gallery_dir / "grp" / "clip.mp4").write_bytes(DATA)
+    return add_media("grp/clip.mp4", type="video")
+
+
+def get(client, media, **headers):
+    return client.get(f"/api/stream/{media}", headers=headers)
+
+
+def test_whole_file(client, media):
+    response = get(client, media)
+    assert response.status_code == 200
+    assert response.data == DATA
+    assert response.headers["Accept-Ranges"] == "bytes"
+
+
+def test_single_and_suffix_ranges(client, media):
+    response = get(client, media, Range="bytes=100-199")
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == f"bytes 100-199/{SIZE}"
+    assert response.data == DATA[100:200]
+
+    response = get(client, media, Range="bytes=-10")
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == f"bytes 990-999/{SIZE}"
+    assert response.data == DATA[-10:]
+
+
+def test_multiple_ranges(client, media):
+    response = get(client, media, Range="bytes=0-9, 500-509, -5")
+    assert response.status_code == 206
+    boundary = re.search(r"boundary=(\w+)", response.headers["Content-Type"]).group(1)
+    assert int(response.headers["Content-Length"]) == len(response.data)
+    parts = response.data.split(f"--{boundary}".encode())[1:-1]
+    bodies = [part.split(b"\r\n\r\n", 1) for part in parts]
+    assert [re.search(rb"Content-Range: bytes (\S+)", head).group(1) for head, _ in bodies] == [
+        b"0-9/1000", b"500-509/1000", b"995-999/1000",
+    ]
+    assert [body[:-2] for _, body in bodies] == [DATA[0:10], DATA[500:510], DATA[995:]]
+
+
+def test_unsatisfiable_range(client, media):
+    response = get(client, media, Range="bytes=5000-6000")
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == f"bytes */{SIZE}"
+
+
+def test_if_range(client, media):
+    etag = get(client, media).headers["ETag"]
+    current = get(client, media, Range="bytes=0-9", **{"If-Range": etag})
+    assert current.status_code == 206
+    assert current.data == DATA[:10]
+
+    stale = get(client, media, Range="bytes=0-9", **{"If-Range": '"stale"'})
+    assert stale.status_code == 200
+    assert stale.data == DATA
+
+    last_modified = get(client, media).headers["Last-Modified"]
+    assert get(client, media, Range="bytes=0-9", **{"If-Range": last_modified}).status_code == 206
+    old_date = get(client, media, Range="bytes=0-9", **{"If-Range": "Mon, 01 Jan 2001 00:00:00 GMT"})
+    assert old_date.status_code == 200
+    assert old_date.data == DATA
+
+
+def test_not_modified(client, media):
+    etag = get(client, media).headers["ETag"]
+    assert get(client, media, **{"If-None-Match": etag}).status_code == 304
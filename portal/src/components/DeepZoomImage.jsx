@@ -0,0 +1,57 @@
+import React, { useEffect, useRef } from 'react';
+
+// Zoomed-in images load from the server's Deep Zoom tiles (/api/tiles/<id>.dzi), so only the
+// part on screen is fetched at the resolution it is shown, instead of the whole original.
+// OpenSeadragon handles panning and zooming; a click or tap without dragging calls onExit.
+const stop = (e) => e.stopPropagation();
+
+const DeepZoomImage = ({ id, zoomLevel, onExit }) => {
+  const containerRef = useRef(null);
+  const onExitRef = useRef(onExit);
+  onExitRef.current = onExit;
+
+  useEffect(() => {
+    let viewer = null;
+    let destroyed = false;
+    import('openseadragon')
+      .then(({ default: OpenSeadragon }) => {
+        if (destroyed || !containerRef.current) return;
+        viewer = OpenSeadragon({
+          element: containerRef.current,
+          tileSources: `/api/tiles/${id}.dzi`,
+          showNavigationControl: false,
+          // Tiles are rendered on first request; the server answers 503 while it is busy
+          tileRetryMax: 5,
+          tileRetryDelay: 2000,
+          gestureSettingsMouse: { clickToZoom: false, dblClickToZoom: true },
+          gestureSettingsTouch: { clickToZoom: false, dblClickToZoom: true },
+        });
+        viewer.addOnceHandler('open', () => {
+          viewer.viewport.zoomTo(viewer.viewport.getHomeZoom() * zoomLevel, null, true);
+        });
+        viewer.addHandler('canvas-click', (event) => {
+          if (event.quick) onExitRef.current();
+        });
+      })
+      .catch((err) => console.error('Could not load the deep zoom viewer:', err));
+    return () => {
+      destroyed = true;
+      if (viewer) viewer.destroy();
+    };
+  }, [id]);
+
+  return (
+    <div
+      ref={containerRef}
+      className="deep-zoom-image"
+      onMouseDown={stop}
+      onMouseMove={stop}
+      onMouseUp={stop}
+      onTouchStart={stop}
+      onTouchMove={stop}
+      onTouchEnd={stop}
+    />
+  );
+};
+
+export default DeepZoomImage;
@@ -1,8 +1,16 @@
-import React from 'react';
+import React, { useState, useRef } from 'react';
 import LazyImage from './LazyImage';
 import Masonry from 'react-masonry-css';
 
+// Animated GIFs and videos have a small animated WebP preview (/api/thumbnails/<id>/preview)
+// shown while hovered, so the grid never pulls the original just to animate a cell
+const mayHavePreview = (file) =>
+  file.type === 'video' || (file.type === 'image' && (file.filename || '').toLowerCase().endsWith('.gif'));
+
 const Gallery = ({ files, onImageClick, lastImageRef }) => {
+  const [previewId, setPreviewId] = useState(null);
+  // Items the server has no preview for (static GIFs, video previews turned off)
+  const noPreview = useRef(new Set());
 
   if (!files || files.length === 0) {
     return <p>No media found. Check your filters or wait for the scan to complete.</p>;
@@ -26,7 +34,7 @@ const Gallery = ({ files, onImageClick, lastImageRef }) => {
         return (
           <div
             ref={isLastElement ? lastImageRef : null}
-            key={file.path + index}
+            key={file.id}
             className="gallery-item"
             onClick={() => onImageClick(index)}
             onKeyDown={(e) => {
@@ -35,16 +43,32 @@ const Gallery = ({ files, onImageClick, lastImageRef }) => {
                 onImageClick(index);
               }
             }}
+            onMouseEnter={() => setPreviewId(file.id)}
+            onMouseLeave={() => setPreviewId(null)}
             tabIndex={0}
             role="button"
             aria-label={`View ${file.type}${file.filename ? `: ${file.filename}` : ''}`}
           >
             <LazyImage
-              src={`/api/thumbnails/${file.id}`}
-              alt={file.path}
+              thumbnailId={file.id}
+              alt={file.filename}
               width={file.width}
               height={file.height}
+              lqip={file.lqip}
+              color={file.dominant_color}
             />
+            {previewId === file.id && mayHavePreview(file) && !noPreview.current.has(file.id) && (
+              <img
+                src={`/api/thumbnails/${file.id}/preview`}
+                alt=""
+                className="gallery-preview"
+                decoding="async"
+                onError={() => {
+                  noPreview.current.add(file.id);
+                  setPreviewId(null);
+                }}
+              />
+            )}
             {file.type === 'video' && <div className="media-type-overlay">▶</div>}
             {file.type === 'audio' && <div className="media-type-overlay">🎵</div>}
             <div className="image-dimension-overlay">
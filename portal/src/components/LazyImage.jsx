@@ -1,7 +1,10 @@
 import React, { useState, useEffect, useRef } from 'react';
+import { loadThumbnail, releaseThumbnail } from '../thumbnailBatcher';
 
-const LazyImage = ({ src, alt, width, height }) => {
+// Pass `src` for a plain image, or `thumbnailId` to load the item's thumbnail through the batcher
+const LazyImage = ({ src, thumbnailId, alt, width, height, lqip, color }) => {
   const [isLoaded, setIsLoaded] = useState(false);
+  const [batchedSrc, setBatchedSrc] = useState(null);
   const placeholderRef = useRef(null);
 
   useEffect(() => {
@@ -32,18 +35,41 @@ const LazyImage = ({ src, alt, width, height }) => {
     };
   }, []);
 
+  useEffect(() => {
+    if (!isLoaded || thumbnailId === undefined) return;
+    let loaded = false;
+    let cancelled = false;
+    loadThumbnail(thumbnailId).then((url) => {
+      loaded = true;
+      if (cancelled) releaseThumbnail(thumbnailId);
+      else setBatchedSrc(url);
+    });
+    return () => {
+      cancelled = true;
+      if (loaded) releaseThumbnail(thumbnailId);
+    };
+  }, [isLoaded, thumbnailId]);
+
+  const imageSrc = thumbnailId === undefined ? src : batchedSrc;
+
   // Calculate aspect ratio only if dimensions are valid
   const aspectRatio = width > 0 && height > 0 ? `${width} / ${height}` : '1 / 1';
 
+  // Paint the inline LQIP (or its dominant colour) from the gallery response right away,
+  // so the grid never shows empty boxes while thumbnails load
+  const placeholderStyle = { aspectRatio };
+  if (color) placeholderStyle.backgroundColor = color;
+  if (lqip) placeholderStyle.backgroundImage = `url(${lqip})`;
+
   return (
     <div
       ref={placeholderRef}
       className="lazy-image-placeholder"
-      style={{ aspectRatio }}
+      style={placeholderStyle}
     >
-      {isLoaded && (
+      {isLoaded && imageSrc && (
         <img
-          src={src}
+          src={imageSrc}
           alt={alt}
           className="lazy-image loaded"
           decoding="async"
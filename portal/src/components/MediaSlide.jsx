@@ -1,5 +1,7 @@
 import React, { useState, useRef, useEffect } from 'react';
 import HeartIcon from './HeartIcon';
+import { attachHls, needsTranscode } from '../hlsPlayer';
+import DeepZoomImage from './DeepZoomImage';
 
 // A simple component to render the EXIF data table, now used internally
 const ExifTable = ({ data }) => {
@@ -100,9 +102,24 @@ const MediaSlide = ({ file, index, currentIndex, onLike, onDelete, onClose, show
     return () => window.removeEventListener('keydown', handleKeyDown);
   }, [index, currentIndex, file.type]);
 
-  const imageUrl = `/api/stream/${file.id}`;
+  // The screen-sized rendition is enough until the user zooms in; zoomed images then load from
+  // deep zoom tiles, except GIFs, whose animation only the original has
+  const isGif = (file.filename || '').toLowerCase().endsWith('.gif');
+  const deepZoom = isZoomed && file.type === 'image' && !isGif;
+  const imageUrl = isZoomed ? `/api/stream/${file.id}` : `/api/display/${file.id}`;
   const videoUrl = `/api/stream/${file.id}`;
 
+  // Videos the browser cannot decode play as HLS transcoded by the server: known containers
+  // straight away, anything else once the original fails to load
+  const [useHls, setUseHls] = useState(false);
+  useEffect(() => {
+    setUseHls(file.type === 'video' && needsTranscode(file.filename));
+  }, [file.id, file.type, file.filename]);
+  useEffect(() => {
+    if (!useHls || !videoRef.current) return;
+    return attachHls(videoRef.current, file.id, index === currentIndex);
+  }, [useHls, file.id]);
+
   const handlePointerDown = (clientX, clientY) => {
     didDrag.current = false;
     setIsDragging(true);
@@ -160,7 +177,23 @@ const MediaSlide = ({ file, index, currentIndex, onLike, onDelete, onClose, show
     e.stopPropagation();
   };
 
+  // List endpoints leave exif out (it is the bulk of each record); fetch it when the panel opens
+  const [detail, setDetail] = useState(null);
+  useEffect(() => {
+    if (!showExif || file.exif !== undefined || (detail && detail.id === file.id)) return;
+    let cancelled = false;
+    fetch(`/api/media/${file.id}?fields=id,exif`)
+      .then(res => (res.ok ? res.json() : null))
+      .then(data => { if (!cancelled && data) setDetail(data); })
+      .catch(err => console.error("Could not load media details:", err));
+    return () => { cancelled = true; };
+  }, [showExif, file.id, file.exif, detail]);
+
   const getExifData = () => {
+    if (file && file.exif === undefined) {
+      if (!detail || detail.id !== file.id) return { status: 'Loading…' };
+      return Object.keys(detail.exif || {}).length > 0 ? detail.exif : { error: 'No EXIF data found.' };
+    }
     if (file && file.exif && typeof file.exif === 'object' && Object.keys(file.exif).length > 0) {
       return file.exif;
     }
@@ -176,7 +209,7 @@ const MediaSlide = ({ file, index, currentIndex, onLike, onDelete, onClose, show
     return { error: 'No EXIF data found.' };
   };
 
-  const exifData = React.useMemo(() => getExifData(), [file]);
+  const exifData = React.useMemo(() => getExifData(), [file, detail]);
 
 
   return (
@@ -196,10 +229,16 @@ const MediaSlide = ({ file, index, currentIndex, onLike, onDelete, onClose, show
         onTouchEnd={handlePointerUp}
         onTouchCancel={() => setIsDragging(false)}
       >
-        {file.type === 'image' ? (
+        {deepZoom ? (
+          <DeepZoomImage
+            id={file.id}
+            zoomLevel={zoomLevel}
+            onExit={() => { setIsZoomed(false); setCurrentPan({ x: 0, y: 0 }); }}
+          />
+        ) : file.type === 'image' ? (
           <img
             src={imageUrl}
-            alt={file.path}
+            alt={file.filename}
             decoding="async"
             style={{
               transform: `scale(${isZoomed ? zoomLevel : 1}) translate(${currentPan.x}px, ${currentPan.y}px)`,
@@ -225,9 +264,10 @@ const MediaSlide = ({ file, index, currentIndex, onLike, onDelete, onClose, show
         ) : (
           <video
             ref={videoRef}
-            src={videoUrl}
+            src={useHls ? undefined : videoUrl}
             controls
             loop
+            onError={() => { if (!useHls) setUseHls(true); }}
             onClick={(e) => e.stopPropagation()}
           />
         )}
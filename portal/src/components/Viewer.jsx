@@ -13,12 +13,24 @@ const Viewer = ({ files, initialIndex, onClose, onLike, onDelete, zoomLevel }) =
     const preload = (index) => {
       if (files[index] && files[index].type === 'image') {
         const img = new Image();
-        img.src = `/api/stream/${files[index].id}`;
+        img.src = `/api/display/${files[index].id}`;
       }
     };
     
     preload(nextIndex);
     preload(prevIndex);
+
+    // Have the server render the display images a little further ahead, without downloading them
+    const ahead = [currentIndex + 2, currentIndex + 3, currentIndex - 2]
+      .filter(i => i >= 0 && i < files.length && files[i].type === 'image')
+      .map(i => files[i].id);
+    if (ahead.length > 0) {
+      fetch('/api/display/prefetch', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ ids: ahead }),
+      }).catch(() => { });
+    }
   }, [currentIndex, files]);
 
   // Effect to handle keyboard shortcuts
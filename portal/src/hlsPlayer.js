@@ -0,0 +1,40 @@
+// Videos browsers cannot decode (mkv/avi containers, HEVC, ...) play from /api/hls/<id>/, which
+// transcodes them into short HLS segments on demand. Safari and Android WebViews play HLS
+// natively; other browsers load hls.js, which feeds the segments through Media Source Extensions.
+
+// Containers no browser plays from /api/stream; other files switch to HLS on a decode error
+const TRANSCODE_EXTENSIONS = new Set(['mkv', 'avi', 'wmv', 'flv', 'mpg', 'mpeg', 'm2ts', 'mts', '3gp']);
+
+export const needsTranscode = (filename) =>
+  TRANSCODE_EXTENSIONS.has((filename || '').split('.').pop().toLowerCase());
+
+// Plays the HLS rendition of `id` in `video`. Returns a function that detaches it again.
+export const attachHls = (video, id, autoPlay) => {
+  const url = `/api/hls/${id}/index.m3u8`;
+  const play = () => { if (autoPlay) video.play().catch(() => { }); };
+
+  if (video.canPlayType('application/vnd.apple.mpegurl')) {
+    video.src = url;
+    play();
+    return () => {
+      video.removeAttribute('src');
+      video.load();
+    };
+  }
+
+  let hls = null;
+  let detached = false;
+  import('hls.js')
+    .then(({ default: Hls }) => {
+      if (detached || !Hls.isSupported()) return;
+      hls = new Hls();
+      hls.on(Hls.Events.MANIFEST_PARSED, play);
+      hls.loadSource(url);
+      hls.attachMedia(video);
+    })
+    .catch((err) => console.error('Could not load the HLS player:', err));
+  return () => {
+    detached = true;
+    if (hls) hls.destroy();
+  };
+};
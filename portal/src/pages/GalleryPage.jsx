@@ -20,6 +20,7 @@ function GalleryPage() {
   const [page, setPage] = useState(1);
   const [hasMore, setHasMore] = useState(true);
   const [isLoading, setIsLoading] = useState(false);
+  const nextCursorRef = useRef(null); // Keyset cursor for the next page (date/filename sorts)
   const [groups, setGroups] = useState([]); // Top-level groups
   const [selectedGroup, setSelectedGroup] = useState(''); // Active top-level group
   const [subgroups, setSubgroups] = useState([]); // Second-level subgroups
@@ -114,8 +115,14 @@ function GalleryPage() {
       page: page,
       limit: batchSize,
       group: selectedGroup,
-      subgroup: selectedSubgroup // Pass selected subgroup
+      subgroup: selectedSubgroup, // Pass selected subgroup
+      // Just what the grid and viewer need; exif is fetched per item when shown
+      fields: 'id,type,width,height,mtime,liked,filename,lqip,dominant_color'
     });
+    // Continue from the last item of the previous page when the sort supports cursors
+    if (page > 1 && nextCursorRef.current) {
+      params.set('cursor', nextCursorRef.current);
+    }
 
     fetch(`/api/gallery?${params.toString()}`)
       .then(res => {
@@ -125,7 +132,13 @@ function GalleryPage() {
       .then(data => {
         if (data && data.items && Array.isArray(data.items)) {
           setFiles(prev => (page === 1 ? data.items : [...prev, ...data.items]));
-          setHasMore(page < data.total_pages);
+          if (data.next_cursor !== undefined) {
+            nextCursorRef.current = data.next_cursor;
+            setHasMore(data.next_cursor !== null);
+          } else {
+            nextCursorRef.current = null;
+            setHasMore(page < data.total_pages);
+          }
         } else {
           // Handle case where API might return unexpected structure
           console.warn("Received unexpected data structure from /api/gallery:", data);
@@ -0,0 +1,118 @@
+// Collects thumbnail requests made within a few milliseconds of each other (a grid page
+// scrolling into view) and fetches them with one /api/thumbnails/batch request. Thumbnails the
+// server has not generated yet come back without a part and fall back to the single-item
+// URL, which renders them.
+//
+// Batch URLs change with every id set, so the browser cache cannot serve them again. Instead
+// every thumbnail is fetched at most once per session: its object URL (or the single-item URL
+// it fell back to, which the browser does cache) is kept here and handed out again when the
+// item remounts. Object URLs are revoked when they leave the cache, never while an image shows one.
+
+const FLUSH_DELAY_MS = 15;
+const MAX_BATCH = 60;
+// Thumbnails kept for the session, least recently used first out (~20 KB each)
+const CACHE_SIZE = 2000;
+
+let pending = new Map(); // id -> [resolve, ...]
+let timer = null;
+const cache = new Map(); // id -> { url, refs }, least recently used first
+
+const evict = () => {
+  for (const [key, entry] of cache) {
+    if (cache.size <= CACHE_SIZE) return;
+    if (entry.refs > 0) continue; // Still on screen
+    cache.delete(key);
+    if (entry.url.startsWith('blob:')) URL.revokeObjectURL(entry.url);
+  }
+};
+
+const singleUrl = (id) => `/api/thumbnails/${id}`;
+
+const indexOf = (bytes, pattern, from) => {
+  outer: for (let i = from; i <= bytes.length - pattern.length; i++) {
+    for (let j = 0; j < pattern.length; j++) {
+      if (bytes[i + j] !== pattern[j]) continue outer;
+    }
+    return i;
+  }
+  return -1;
+};
+
+// Splits a multipart/mixed body into { id: Blob } using each part's X-Media-Id and Content-Length
+const parseMultipart = (buffer, boundary) => {
+  const bytes = new Uint8Array(buffer);
+  const encoder = new TextEncoder();
+  const decoder = new TextDecoder();
+  const delimiter = encoder.encode(`--${boundary}\r\n`);
+  const headerEnd = encoder.encode('\r\n\r\n');
+  const parts = {};
+  let pos = indexOf(bytes, delimiter, 0);
+  while (pos !== -1) {
+    const headersStart = pos + delimiter.length;
+    const bodyStart = indexOf(bytes, headerEnd, headersStart);
+    if (bodyStart === -1) break;
+    const headers = {};
+    decoder.decode(bytes.subarray(headersStart, bodyStart)).split('\r\n').forEach((line) => {
+      const sep = line.indexOf(':');
+      if (sep > 0) headers[line.slice(0, sep).trim().toLowerCase()] = line.slice(sep + 1).trim();
+    });
+    const start = bodyStart + headerEnd.length;
+    const length = parseInt(headers['content-length'], 10);
+    if (Number.isNaN(length)) break;
+    parts[headers['x-media-id']] = new Blob([bytes.subarray(start, start + length)], { type: headers['content-type'] });
+    pos = indexOf(bytes, delimiter, start + length);
+  }
+  return parts;
+};
+
+const fetchBatch = async (batch) => {
+  const ids = [...batch.keys()];
+  let parts = {};
+  try {
+    const res = await fetch(`/api/thumbnails/batch?ids=${ids.join(',')}`);
+    const match = /boundary=([^;]+)/.exec(res.headers.get('Content-Type') || '');
+    if (res.ok && match) parts = parseMultipart(await res.arrayBuffer(), match[1]);
+  } catch (err) {
+    console.warn('Batched thumbnail fetch failed, loading individually:', err);
+  }
+  batch.forEach((resolvers, id) => {
+    const blob = parts[id];
+    const entry = { url: blob ? URL.createObjectURL(blob) : singleUrl(id), refs: resolvers.length };
+    cache.set(id, entry);
+    resolvers.forEach((resolve) => resolve(entry.url));
+  });
+  evict();
+};
+
+const flush = () => {
+  timer = null;
+  const all = [...pending.entries()];
+  pending = new Map();
+  for (let i = 0; i < all.length; i += MAX_BATCH) {
+    fetchBatch(new Map(all.slice(i, i + MAX_BATCH)));
+  }
+};
+
+// Resolves to a URL for the thumbnail of `id`, from the session cache or the next batch. Call
+// releaseThumbnail(id) once the image using it is gone.
+export const loadThumbnail = (id) => {
+  const key = String(id);
+  const entry = cache.get(key);
+  if (entry) {
+    cache.delete(key); // Re-insert as most recently used
+    cache.set(key, entry);
+    entry.refs += 1;
+    return Promise.resolve(entry.url);
+  }
+  return new Promise((resolve) => {
+    if (!pending.has(key)) pending.set(key, []);
+    pending.get(key).push(resolve);
+    if (!timer) timer = setTimeout(flush, FLUSH_DELAY_MS);
+  });
+};
+
+export const releaseThumbnail = (id) => {
+  const entry = cache.get(String(id));
+  if (entry && entry.refs > 0) entry.refs -= 1;
+  if (cache.size > CACHE_SIZE) evict();
+};